@@ -0,0 +1,71 @@
+"""Memory of the per-tick DataFrames and scene keys, with and without compact dtypes / scene-key interning.
+
+Usage:
+    python -m benchmarks.bench_memory --num-scenes 100000
+"""
+import argparse
+import gc
+import tracemalloc
+
+import numpy as np
+
+from scheduler.helpers import memory
+from scheduler.helpers.airflow_api import dag_runs_to_dataframe
+
+
+def make_dag_runs(num_scenes: int, dag_id: str, batch_id: str = "bench_batch", seed: int = 0):
+    """dagRuns records as returned by the Airflow REST API, every string is a fresh object like after json decoding"""
+    rng = np.random.default_rng(seed)
+    states = rng.choice(["success", "failed", "running", "queued"], num_scenes, p=[0.85, 0.05, 0.05, 0.05])
+    return [
+        {
+            "dag_id": "".join(dag_id),
+            "dag_run_id": f"scene_id:scn_{i:06d}__{i}.0",
+            "state": "".join(str(states[i])),
+            "conf": {"batch_id": "".join(batch_id), "scene_id": f"scn_{i:06d}"},
+            "start_date": "2024-01-01T00:00:00+00:00",
+            "end_date": "2024-01-01T01:00:00+00:00",
+        }
+        for i in range(num_scenes)
+    ]
+
+
+def measure(num_scenes: int, num_dags: int, compact: bool):
+    memory.enable_compact_dtypes(compact)
+    memory.scene_key_table.clear()
+    records = [make_dag_runs(num_scenes, f"dag_{d}") for d in range(num_dags)]
+    gc.collect()
+
+    tracemalloc.start()
+    dfs = [dag_runs_to_dataframe(r, flatten_conf=True) for r in records]
+    if compact:
+        keys = [memory.intern_scene_keys(df, ["scene_id"]) for df in dfs]
+    else:
+        keys = [list(zip(df["scene_id"].tolist())) for df in dfs]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    df_bytes = sum(int(df.drop(columns=["conf"]).memory_usage(deep=True).sum()) for df in dfs)
+    unique_key_objects = len({id(k) for ks in keys for k in ks})
+    memory.enable_compact_dtypes(False)
+    return df_bytes, current, peak, unique_key_objects
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-scenes", type=int, default=100000)
+    parser.add_argument("--num-dags", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"scenes={args.num_scenes} dags={args.num_dags}")
+    for compact in (False, True):
+        df_bytes, current, peak, unique_key_objects = measure(args.num_scenes, args.num_dags, compact)
+        label = "after (compact)" if compact else "before"
+        print(
+            f"{label:16s} frames={df_bytes / 2**20:8.1f} MiB  traced={current / 2**20:8.1f} MiB  "
+            f"peak={peak / 2**20:8.1f} MiB  scene-key objects={unique_key_objects}"
+        )
+
+
+if __name__ == "__main__":
+    main()
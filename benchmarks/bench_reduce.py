@@ -0,0 +1,82 @@
+"""Benchmark of `reduce_dataframe` against the previous lambda-based implementation.
+
+Usage:
+    python -m benchmarks.bench_reduce --num-scenes 20000 --num-splits 8
+"""
+from typing import List
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from scheduler.upstream_sensor.reducible import reduce_dataframe
+
+
+def legacy_reduce_dataframe(df: pd.DataFrame, xcom_expanded_df: pd.DataFrame, base_scene_id_keys: List[str], refer_name: str) -> pd.DataFrame:
+    full_scene_id_keys = base_scene_id_keys + [refer_name]
+    _scene_id_keys = base_scene_id_keys[0] if len(base_scene_id_keys) == 1 else base_scene_id_keys
+    merged_df = pd.merge(df, xcom_expanded_df, how="outer", on=full_scene_id_keys)
+    other_columns = [c for c in merged_df.columns if c not in full_scene_id_keys + ['state', 'conf']]
+    reduced_df = merged_df.groupby(_scene_id_keys).agg({
+        **{col: lambda x: list(s)[0] if len(s:=set(x)) == 1 else s for col in other_columns},
+        'state': lambda x: 'success' if all(s == 'success' for s in x) else 'failed'
+    }).reset_index()
+    return reduced_df
+
+
+def make_frames(num_scenes: int, num_splits: int, seed: int = 0):
+    """DagRuns of a reduce sensor (one per split, some missing / failed) and the xcom expansion of the split map"""
+    rng = np.random.default_rng(seed)
+    scene_ids = np.repeat([f"scn_{i:06d}" for i in range(num_scenes)], num_splits)
+    split_ids = np.tile(np.arange(num_splits), num_scenes)
+    xcom_expanded_df = pd.DataFrame({"scene_id": scene_ids, "split_id": split_ids})
+
+    exists = rng.random(len(scene_ids)) < 0.9
+    states = np.where(rng.random(len(scene_ids)) < 0.95, "success", "failed")
+    df = pd.DataFrame(
+        {
+            "batch_id": "bench_batch",
+            "dag_id": "sparse_map_recon",
+            "dag_run_id": [f"{s}__split:{p}" for s, p in zip(scene_ids, split_ids)],
+            "dag_run_state": states,
+            "scene_id": scene_ids,
+            "split_id": split_ids,
+            "conf": [{"scene_id": s} for s in scene_ids],
+            "state": states,
+            "end_date": None,  # like the DagRuns that have not finished
+        }
+    )[exists].reset_index(drop=True)
+    return df, xcom_expanded_df
+
+
+def timeit(func, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - tic)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-scenes", type=int, default=20000)
+    parser.add_argument("--num-splits", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df, xcom_expanded_df = make_frames(args.num_scenes, args.num_splits)
+    params = (df, xcom_expanded_df, ["scene_id"], "split_id")
+
+    pd.testing.assert_frame_equal(reduce_dataframe(*params), legacy_reduce_dataframe(*params))
+
+    legacy = timeit(legacy_reduce_dataframe, *params, repeat=args.repeat)
+    vectorized = timeit(reduce_dataframe, *params, repeat=args.repeat)
+    print(f"rows={len(df)} scenes={args.num_scenes} splits={args.num_splits}")
+    print(f"legacy:     {legacy * 1000:9.1f} ms")
+    print(f"vectorized: {vectorized * 1000:9.1f} ms  ({legacy / vectorized:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
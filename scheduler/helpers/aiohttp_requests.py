@@ -1,9 +1,131 @@
+from typing import Dict, Sequence
 import aiohttp
 import asyncio
 import json
+import time
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the fast path falls back to the stdlib json
+    orjson = None
+
+from .replay import Recorder
+from .response_cache import ResponseCache
+
 
 class Non200Response(Exception):
-    pass
+    def __init__(self, message: str = "", status: int = None) -> None:
+        super().__init__(message)
+        self.status = status  # the HTTP status code, None if the record was not read from the RESTAPI
+
+
+_fast_json = False
+
+
+def enable_fast_json(enabled: bool = True) -> None:
+    """Enable the fast path of `get`: the body is decoded with orjson (if installed) straight from bytes,
+    and the records are projected to the `fields` given by the caller right after decoding.
+
+    The whole body is still read into memory first, the fast path only avoids the str copy of the body
+    and keeping the unused fields of the decoded records, it does not parse the body incrementally."""
+    global _fast_json
+    _fast_json = enabled
+
+
+def fast_json_enabled() -> bool:
+    return _fast_json
+
+
+def loads(data: bytes):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def project(json_data, fields: Sequence[str], records_key: str = None):
+    """Keep only `fields` of the json object, or of each record in json_data[records_key] if records_key is given"""
+    def _project(record: dict) -> dict:
+        return {f: record[f] for f in fields if f in record}
+
+    if not isinstance(json_data, dict):
+        return json_data
+    if records_key is None:
+        return _project(json_data)
+    if isinstance(json_data.get(records_key), list):
+        json_data[records_key] = [_project(r) for r in json_data[records_key]]
+    return json_data
+
+
+_recorder: Recorder = None
+
+
+def start_recording(path: str) -> Recorder:
+    """Record every request and response to `path` (see helpers.replay), until `stop_recording`"""
+    global _recorder
+    stop_recording()
+    _recorder = Recorder(path)
+    return _recorder
+
+
+def stop_recording() -> None:
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+    _recorder = None
+
+
+_response_cache: ResponseCache = None
+
+
+def enable_response_cache(max_entries: int = 1024, ttl: Dict[str, float] = None) -> ResponseCache:
+    """Cache the responses of `get` (see helpers.response_cache), None to disable it.
+    The cached json data is shared by the callers, which must not modify it in place."""
+    global _response_cache
+    _response_cache = ResponseCache(max_entries, ttl=ttl) if max_entries else None
+    return _response_cache
+
+
+def current_response_cache() -> ResponseCache:
+    return _response_cache
+
+
+_transport = None
+
+
+def set_transport(transport=None) -> None:
+    """Send the requests to `transport` instead of the network, e.g. a simulated Airflow (see scheduler.simulator).
+
+    Parameters
+    ----------
+    transport : optional
+        an async callable (method, url, data) -> (status, json_data), None to go back to the network.
+        The retries do not wait when a transport is set.
+    """
+    global _transport
+    _transport = transport
+
+
+_session: aiohttp.ClientSession = None
+_session_loop: asyncio.AbstractEventLoop = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """The ClientSession (and so the connection pool) shared by all the requests of the process.
+    Cookies are sent per request and the cookies set by responses are not kept, so that
+    watchers of different batches never leak cookies to each other.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        _session = aiohttp.ClientSession(cookie_jar=aiohttp.DummyCookieJar())
+        _session_loop = loop
+    return _session
+
+
+async def close_session() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
 
 def async_retry(retries=3, delay=1):
     def decorator(func):
@@ -14,24 +136,81 @@ def async_retry(retries=3, delay=1):
                     # response is a tuple of (status_code, json_data) in `get` and `post` defined below
                     response = await func(*args, **kwargs)
                     if response[0] != 200:  # Assuming the first element of the return tuple is status code
-                        raise Non200Response(f"Status code {response[0]} received.")
+                        raise Non200Response(f"Status code {response[0]} received.", status=response[0])
                     return response
                 except (aiohttp.ClientError, Non200Response) as e:
                     last_exception = e
-                    await asyncio.sleep(delay)
+                    await asyncio.sleep(delay if _transport is None else 0)
             raise last_exception
         return wrapper
     return decorator
 
 
 @async_retry(retries=3, delay=1)
-async def get(url, cookies=None):
-    async with aiohttp.ClientSession(cookies=cookies) as session:
-        async with session.get(url) as response:
-            status = response.status
+async def get(url, cookies=None, fields: Sequence[str] = None, records_key: str = None):
+    """GET the url and decode the json body.
+
+    Parameters
+    ----------
+    url : str
+        the url
+    cookies : dict, optional
+        cookies for authentication
+    fields : Sequence[str], optional
+        the fields consumed by the caller, only used by the fast path (see `enable_fast_json`): the other fields
+        are dropped after the whole body is read and decoded
+    records_key : str, optional
+        if given, `fields` apply to each record of the list json_data[records_key] instead of json_data itself
+    """
+    if _transport is not None:
+        status, json_data = await _transport("GET", url, None)
+        if _fast_json and fields is not None:
+            json_data = project(json_data, fields, records_key=records_key)
+        return status, json_data
+
+    cache, entry, headers = _response_cache, None, None
+    if cache is not None:
+        key = (url, tuple(fields) if _fast_json and fields is not None else None, records_key)
+        entry, fresh = cache.lookup(key)
+        if fresh:
+            return 200, entry.json_data
+        headers = entry.conditional_headers() if entry is not None else None
+
+    start = time.monotonic()
+    async with get_session().get(url, cookies=cookies, headers=headers) as response:
+        status = response.status
+        if status == 304 and entry is not None:
+            json_data = cache.revalidated(key, url, entry).json_data
+            if _recorder is not None:
+                # recorded as the 200 it stands for, the replaying scheduler has no cached body to revalidate
+                _recorder.record("GET", url, None, 200, json.dumps(json_data).encode(), time.monotonic() - start)
+            return 200, json_data
+        if status == 304:
+            # not revalidating anything (e.g. the cache entry was evicted), there is no body to decode:
+            # raised as a Non200Response by async_retry, and retried without conditional headers
+            if _recorder is not None:
+                _recorder.record("GET", url, None, status, b"", time.monotonic() - start)
+            return status, None
+        if not _fast_json and _recorder is None and cache is None:
             json_data = await response.json()
             return status, json_data
 
+        # the whole body, the fields are only projected once it is decoded
+        body = await response.read()
+        if _recorder is not None:
+            _recorder.record("GET", url, None, status, body, time.monotonic() - start)
+        try:
+            json_data = loads(body) if _fast_json else json.loads(body)
+        except ValueError as e:
+            raise aiohttp.ContentTypeError(
+                response.request_info, response.history, status=status, message=f"Invalid json body: {e}"
+            )
+        if _fast_json and fields is not None:
+            json_data = project(json_data, fields, records_key=records_key)
+        if cache is not None and status == 200:
+            cache.store(key, url, json_data, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return status, json_data
+
 
 @async_retry(retries=3, delay=1)
 async def post(url, data, cookies=None):
@@ -39,9 +218,14 @@ async def post(url, data, cookies=None):
         'Content-type':'application/json', 
         'Accept':'application/json'
     }
+    if _transport is not None:
+        return await _transport("POST", url, data)
+
     json_data = json.dumps(data)
-    async with aiohttp.ClientSession(headers=headers, cookies=cookies) as session:
-        async with session.post(url, data=json_data) as response:
-            status = response.status
-            json_data = await response.json()
-            return status, json_data
+    start = time.monotonic()
+    async with get_session().post(url, data=json_data, headers=headers, cookies=cookies) as response:
+        status = response.status
+        if _recorder is not None:
+            _recorder.record("POST", url, data, status, await response.read(), time.monotonic() - start)
+        json_data = await response.json()
+        return status, json_data
@@ -1,10 +1,17 @@
-from typing import Union, List, Sequence
+from functools import partial
+from typing import Dict, Iterable, Union, List, Sequence
 
 import numpy as np
 import pandas as pd
 from loguru import logger
 
-from . import aiohttp_requests as ar
+from .. import aiohttp_requests as ar
+from ..dag_run_cache import current_dag_run_cache
+from ..done_set import get_done_set
+from ..memory import compact_dtypes
+from .datasource import DataSource, get_data_source, set_data_source
+from .rest import DAG_RUN_FIELDS, TASK_INSTANCE_FIELDS, RestDataSource
+from .sql import SQLDataSource
 
 pd.set_option("display.max_columns", None)
 
@@ -19,6 +26,7 @@ async def get_dag_runs(
 ) -> Union[List[dict], pd.DataFrame]:
     """Get all the DagRuns of `dag_id` with the same batch_id as batch_id using Airflow RESTAPI:
     http://{api_url}/api/v1/dags/{dag_id}/dagRuns
+    The DagRuns of the done scenes of the batch are dropped, see helpers.done_set.
 
     Parameters
     ----------
@@ -40,21 +48,93 @@ async def get_dag_runs(
     """
     assert to_dataframe or not flatten_conf, "flatten_conf only works when to_dataframe is True"
 
-    url = f"{api_url}/api/v1/dags/{dag_id}/dagRuns"
-    status, json_data = await ar.get(url, cookies=cookies)
-    dag_runs = json_data["dag_runs"]
-    dag_runs = [dr for dr in dag_runs if dr["conf"].get("batch_id") == batch_id]
+    cache = current_dag_run_cache()
+    if cache is None:
+        dag_runs = await request_dag_runs(api_url, dag_id, cookies)
+        dag_runs = [dr for dr in dag_runs if dr["conf"].get("batch_id") == batch_id]
+    else:
+        dag_runs = await cache.get_batch(api_url, dag_id, batch_id, partial(request_dag_runs, api_url, dag_id, cookies))
+    done_set = get_done_set(batch_id)
+    if done_set is not None:
+        dag_runs = done_set.drop_done(dag_runs)
     if to_dataframe:
-        if len(dag_runs) == 0:
-            dag_runs = pd.DataFrame([])
-        else:
-            dag_runs = pd.DataFrame.from_records(dag_runs)
-            dag_runs.loc[:, "dag_run_state"] = dag_runs.state
-            if flatten_conf:
-                dag_runs = pd.concat([dag_runs, dag_runs["conf"].apply(pd.Series)], axis=1)
+        dag_runs = dag_runs_to_dataframe(dag_runs, flatten_conf=flatten_conf)
     return dag_runs
 
 
+async def request_dag_runs(api_url: str, dag_id: str, cookies: dict) -> List[dict]:
+    """Get all the DagRuns (of all batches) of `dag_id` from the data source in use, by default the Airflow RESTAPI:
+    http://{api_url}/api/v1/dags/{dag_id}/dagRuns
+    """
+    return await get_data_source().dag_runs(api_url, dag_id, cookies)
+
+
+async def request_dag_runs_bulk(
+    api_url: str,
+    dag_ids: Iterable[str],
+    cookies: dict,
+    states: Sequence[str] = None,
+    page_limit: int = 100,
+    **date_filters: str,
+) -> Dict[str, List[dict]]:
+    """Get the DagRuns (of all batches) of many DAGs in one query from the data source in use,
+    by default one paginated query of the Airflow RESTAPI:
+    POST http://{api_url}/api/v1/dags/~/dagRuns/list
+
+    Parameters
+    ----------
+    api_url : str
+        api endpoint url
+    dag_ids : Iterable[str]
+        the dag ids
+    cookies: dict
+        cookies for authentication
+    states : Sequence[str], optional
+        only the DagRuns in these states, by default all
+    page_limit : int, optional
+        the number of DagRuns per page, at most the maximum_page_limit of Airflow, by default 100
+    **date_filters : str
+        the date filters of the endpoint, e.g. start_date_gte="2024-01-01T00:00:00+00:00",
+        see execution_date_gte/lte, start_date_gte/lte and end_date_gte/lte in the Airflow RESTAPI
+
+    Returns
+    -------
+    Dict[str, List[dict]]
+        dag_id -> its DagRuns, every dag_id is present even if it has no DagRun
+    """
+    return await get_data_source().dag_runs_bulk(api_url, dag_ids, cookies, states=states, page_limit=page_limit, **date_filters)
+
+
+async def fetch_dag_runs(api_url: str, dag_id: str, cookies: dict) -> List[dict]:
+    """Same as `request_dag_runs`, but if a DagRunCache is in use (see helpers.dag_run_cache),
+    the DagRuns are fetched at most once per cache.
+    """
+    cache = current_dag_run_cache()
+    if cache is None:
+        return await request_dag_runs(api_url, dag_id, cookies)
+    return await cache.get(api_url, dag_id, partial(request_dag_runs, api_url, dag_id, cookies))
+
+
+def dag_runs_to_dataframe(dag_runs: List[dict], flatten_conf: bool = False) -> pd.DataFrame:
+    """Convert list of dagruns (dict) into pandas.DataFrame, the low-cardinality columns become
+    categoricals if compact dtypes are enabled (see helpers.memory)
+
+    Parameters
+    ----------
+    dag_runs : List[dict]
+        dag runs info
+    flatten_conf : bool, optional
+        if True, each key of dag_run.conf will become a column, by default False.
+    """
+    if len(dag_runs) == 0:
+        return pd.DataFrame([])
+    dag_runs = pd.DataFrame.from_records(dag_runs)
+    dag_runs.loc[:, "dag_run_state"] = dag_runs.state
+    if flatten_conf:
+        dag_runs = pd.concat([dag_runs, dag_runs["conf"].apply(pd.Series)], axis=1)
+    return compact_dtypes(dag_runs)
+
+
 # async def get_task_instances(
 #     api_url: str, dag_id: str, dag_run_id: str, cookies: dict, to_dataframe: bool = False
 # ) -> Union[List[dict], pd.DataFrame]:
@@ -121,8 +201,7 @@ async def get_task_instance(
     Union[List[dict], pd.DataFrame]
         list of task instance info
     """
-    url = f"{api_url}/api/v1/dags/{dag_id}/dagRuns/{dag_run_id}/taskInstances/{task_id}"
-    status, ti = await ar.get(url, cookies=cookies)
+    ti = await get_data_source().task_instance(api_url, dag_id, dag_run_id, task_id, cookies)
     if to_dataframe:
         ti = pd.DataFrame.from_records([ti])
         ti.loc[:, "task_instance_state"] = ti.state
@@ -131,6 +210,7 @@ async def get_task_instance(
             columns_actually_dropped = set(columns_to_drop).intersection(ti.columns)
             ti.drop(columns=list(columns_actually_dropped), inplace=True)
     else:
+        ti = dict(ti)  # the response may be shared through the response cache of aiohttp_requests
         ti["task_instance_state"] = ti["state"]
 
         if columns_to_drop:
@@ -234,9 +314,46 @@ async def get_xcom(
     Union[List[dict], pd.DataFrame]
         xcom value dict of dataframe
     """
-    url = f"{api_url}/api/v1/dags/{dag_id}/dagRuns/{dag_run_id}/taskInstances/{xcom_task_id}/xcomEntries/{xcom_key}"
-    status, data = await ar.get(url, cookies=cookies)
-    data = [data]
+    data = [await get_data_source().xcom(api_url, dag_id, dag_run_id, xcom_task_id, xcom_key, cookies)]
     if to_dataframe:
         data = pd.DataFrame.from_records(data)
     return data
+
+
+async def get_xcoms(
+    api_url: str,
+    dag_id: str,
+    dag_runs: Sequence[dict],
+    xcom_task_id: str,
+    cookies: dict,
+    xcom_key: str = "return_value",
+    max_concurrency: int = 16,
+) -> Dict[str, str]:
+    """Get the xcom values of a specific xcom_key for many DagRuns of `dag_id` at once, by default by listing
+    the XCom entries of the DagRuns that changed since the last call using Airflow RestAPI (see `RestDataSource.xcoms_bulk`):
+    http://{api_url}/api/v1/dags/{dag_id}/dagRuns/~/taskInstances/{task_id}/xcomEntries
+
+    Parameters
+    ----------
+    api_url : str
+        api endpoint url
+    dag_id : str
+        dag id
+    dag_runs : Sequence[dict]
+        the DagRuns, with their dag_run_id and execution_date (and their state, end_date and batch_id, without
+        which their values are read each time)
+    xcom_task_id : str
+        task id that produce (push) the xcom
+    cookies: dict
+        cookies for authentication
+    xcom_key: str
+        the xcom key
+    max_concurrency : int, optional
+        the maximum number of concurrent requests, by default 16
+
+    Returns
+    -------
+    Dict[str, str]
+        dag_run_id -> the (unparsed) xcom value, for the DagRuns that have one
+    """
+    return await get_data_source().xcoms_bulk(api_url, dag_id, dag_runs, xcom_task_id, xcom_key, cookies, max_concurrency)
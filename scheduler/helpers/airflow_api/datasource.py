@@ -0,0 +1,81 @@
+from typing import Dict, Iterable, List, Sequence
+import asyncio
+
+from ..aiohttp_requests import Non200Response
+
+
+class DataSource:
+    """Where the DagRuns, TaskInstances and XComs are read from. The records have the shape of the
+    Airflow RESTAPI responses, whatever the source, so the sensors and watchers do not depend on it.
+    The writes (triggering a DagRun) always go through the RESTAPI.
+    """
+
+    async def dag_runs(self, api_url: str, dag_id: str, cookies: dict) -> List[dict]:
+        """all the DagRuns (of all batches) of `dag_id`"""
+        raise NotImplementedError
+
+    async def dag_runs_bulk(
+        self,
+        api_url: str,
+        dag_ids: Iterable[str],
+        cookies: dict,
+        states: Sequence[str] = None,
+        page_limit: int = 100,
+        **date_filters: str,
+    ) -> Dict[str, List[dict]]:
+        """dag_id -> its DagRuns, for many DAGs at once, see `request_dag_runs_bulk`"""
+        raise NotImplementedError
+
+    async def task_instance(self, api_url: str, dag_id: str, dag_run_id: str, task_id: str, cookies: dict) -> dict:
+        """the TaskInstance `task_id` of a DagRun, raises Non200Response if it does not exist"""
+        raise NotImplementedError
+
+    async def xcom(self, api_url: str, dag_id: str, dag_run_id: str, task_id: str, xcom_key: str, cookies: dict) -> dict:
+        """the XCom entry `xcom_key` pushed by `task_id` in a DagRun, raises Non200Response if it does not exist"""
+        raise NotImplementedError
+
+    async def xcoms_bulk(
+        self,
+        api_url: str,
+        dag_id: str,
+        dag_runs: Sequence[dict],
+        task_id: str,
+        xcom_key: str,
+        cookies: dict,
+        max_concurrency: int = 16,
+    ) -> Dict[str, str]:
+        """dag_run_id -> the value of the XCom entry `xcom_key` pushed by `task_id`, for the DagRuns of `dag_runs`
+        (with their dag_run_id and execution_date) that have one. By default one `xcom` per DagRun, at most
+        `max_concurrency` at once."""
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def fetch(dag_run_id: str):
+            async with semaphore:
+                try:
+                    return dag_run_id, (await self.xcom(api_url, dag_id, dag_run_id, task_id, xcom_key, cookies))["value"]
+                except Non200Response:
+                    return dag_run_id, None
+
+        results = await asyncio.gather(*[fetch(dr["dag_run_id"]) for dr in dag_runs])
+        return {dag_run_id: value for dag_run_id, value in results if value is not None}
+
+    def forget_batch(self, batch_id: str) -> None:
+        """drop what is kept in memory for the DagRuns of `batch_id`, called when the batch is removed"""
+
+
+_data_source: DataSource = None
+
+
+def set_data_source(data_source: DataSource = None) -> None:
+    """Read from `data_source` instead of the Airflow RESTAPI, None to go back to the RESTAPI"""
+    global _data_source
+    _data_source = data_source
+
+
+def get_data_source() -> DataSource:
+    global _data_source
+    if _data_source is None:
+        from .rest import RestDataSource
+
+        _data_source = RestDataSource()
+    return _data_source
@@ -0,0 +1,242 @@
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+import asyncio
+
+from loguru import logger
+
+from .. import aiohttp_requests as ar
+from ..aiohttp_requests import Non200Response
+from .datasource import DataSource
+
+# the fields of the Airflow responses that the sensors and watchers consume, the others are dropped
+# right after decoding when the fast json path of aiohttp_requests is enabled.
+DAG_RUN_FIELDS = ("dag_id", "dag_run_id", "state", "conf", "logical_date", "execution_date", "start_date", "end_date")
+TASK_INSTANCE_FIELDS = ("dag_id", "dag_run_id", "task_id", "state", "start_date", "end_date", "try_number", "map_index")
+# the statuses of the xcomEntries list endpoint meaning that the Airflow version does not support the ~ wildcards
+XCOM_LIST_UNSUPPORTED = (400, 404, 405)
+# the states of the DagRuns whose XComs do not change any more, unless the DagRun is cleared
+FINISHED_STATES = ("success", "failed")
+
+
+class RestDataSource(DataSource):
+    """The Airflow RESTAPI (the default data source)"""
+
+    def __init__(self, xcom_page_limit: int = 100) -> None:
+        """
+        Parameters
+        ----------
+        xcom_page_limit : int, optional
+            the number of XCom entries per page of the xcomEntries list endpoint, by default 100
+        """
+        self.xcom_page_limit = xcom_page_limit
+        self.num_xcom_values_reused = 0
+        self._xcom_list_unsupported: Set[str] = set()  # the api_urls whose xcomEntries list endpoint failed
+        # (api_url, dag_id, task_id, xcom_key) -> dag_run_id -> the value read by `xcoms_bulk`
+        self._xcom_values: Dict[Tuple[str, str, str, str], Dict[str, "_XComValue"]] = {}
+        # (api_url, dag_id, task_id, xcom_key) -> the number of pages of the last list of the entries of all the DagRuns
+        self._xcom_list_pages: Dict[Tuple[str, str, str, str], int] = {}
+
+    async def dag_runs(self, api_url: str, dag_id: str, cookies: dict) -> List[dict]:
+        url = f"{api_url}/api/v1/dags/{dag_id}/dagRuns"
+        status, json_data = await ar.get(url, cookies=cookies, fields=DAG_RUN_FIELDS, records_key="dag_runs")
+        return json_data["dag_runs"]
+
+    async def dag_runs_bulk(
+        self,
+        api_url: str,
+        dag_ids: Iterable[str],
+        cookies: dict,
+        states: Sequence[str] = None,
+        page_limit: int = 100,
+        **date_filters: str,
+    ) -> Dict[str, List[dict]]:
+        dag_ids = sorted(set(dag_ids))
+        url = f"{api_url}/api/v1/dags/~/dagRuns/list"
+        query = {"dag_ids": dag_ids, "order_by": "id", "page_limit": page_limit, **date_filters}
+        if states:
+            query["states"] = list(states)
+
+        async def request_page(page_offset: int) -> dict:
+            status, json_data = await ar.post(url, {**query, "page_offset": page_offset}, cookies=cookies)
+            if ar.fast_json_enabled():
+                json_data = ar.project(json_data, DAG_RUN_FIELDS, records_key="dag_runs")
+            return json_data
+
+        # the first page gives the total number of DagRuns, the other pages are requested concurrently
+        first_page = await request_page(0)
+        pages = [first_page] + await asyncio.gather(
+            *[request_page(offset) for offset in range(page_limit, first_page["total_entries"], page_limit)]
+        )
+
+        dag_runs = {dag_id: [] for dag_id in dag_ids}
+        seen = set()
+        for page in pages:
+            for dr in page["dag_runs"]:
+                key = (dr["dag_id"], dr["dag_run_id"])
+                if key in seen:  # a DagRun created between two pages shifts the next pages
+                    continue
+                seen.add(key)
+                dag_runs.setdefault(dr["dag_id"], []).append(dr)
+        return dag_runs
+
+    async def task_instance(self, api_url: str, dag_id: str, dag_run_id: str, task_id: str, cookies: dict) -> dict:
+        url = f"{api_url}/api/v1/dags/{dag_id}/dagRuns/{dag_run_id}/taskInstances/{task_id}"
+        status, ti = await ar.get(url, cookies=cookies, fields=TASK_INSTANCE_FIELDS)
+        return ti
+
+    async def xcom(self, api_url: str, dag_id: str, dag_run_id: str, task_id: str, xcom_key: str, cookies: dict) -> dict:
+        url = f"{api_url}/api/v1/dags/{dag_id}/dagRuns/{dag_run_id}/taskInstances/{task_id}/xcomEntries/{xcom_key}"
+        status, data = await ar.get(url, cookies=cookies)
+        return data
+
+    async def xcoms_bulk(
+        self,
+        api_url: str,
+        dag_id: str,
+        dag_runs: Sequence[dict],
+        task_id: str,
+        xcom_key: str,
+        cookies: dict,
+        max_concurrency: int = 16,
+    ) -> Dict[str, str]:
+        """The values are kept in memory with the state and end_date of their DagRun, and read again only for the
+        DagRuns that are new, not finished, or changed since (e.g. cleared), so the requests follow the DagRuns in
+        flight rather than the history of the DAG. The XCom entries of these DagRuns, which do not include the
+        values, are listed first (filtered on `xcom_key`): one list per DagRun if they are fewer than the pages of
+        the list of the entries of all the DagRuns (GET /api/v1/dags/{dag_id}/dagRuns/~/taskInstances/{task_id}/xcomEntries),
+        otherwise that list. The values are then fetched (at most `max_concurrency` at once) only for the entries
+        whose timestamp changed. The DagRuns are expected with their state, end_date and batch_id, the values of the
+        DagRuns of a batch that are not in `dag_runs` any more (e.g. retired, see helpers.done_set) are dropped.
+        If the Airflow version cannot list the XCom entries, one `xcom` per DagRun."""
+        if api_url in self._xcom_list_unsupported:
+            return await super().xcoms_bulk(api_url, dag_id, dag_runs, task_id, xcom_key, cookies, max_concurrency)
+        cache_key = (api_url, dag_id, task_id, xcom_key)
+        cached = self._xcom_values.setdefault(cache_key, {})
+        wanted = {dr["dag_run_id"]: dr for dr in dag_runs}
+        batch_ids = {dr.get("batch_id") for dr in dag_runs}
+        for i in [i for i, entry in cached.items() if entry.batch_id in batch_ids and i not in wanted]:
+            del cached[i]
+
+        stale = []
+        for i, dr in wanted.items():
+            entry = cached.get(i)
+            if entry is not None and entry.is_settled(dr):
+                self.num_xcom_values_reused += entry.value is not None
+            else:
+                stale.append(i)
+        if not stale:
+            return {i: cached[i].value for i in wanted if cached[i].value is not None}
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+        try:
+            pages = self._xcom_list_pages.get(cache_key)
+            if pages is not None and len(stale) <= pages:
+                listed = await self._list_run_xcom_entries(api_url, dag_id, stale, task_id, xcom_key, cookies, semaphore)
+            else:
+                listed = await self._list_xcom_entries(api_url, dag_id, wanted.values(), task_id, xcom_key, cookies)
+        except Non200Response as e:
+            if e.status in XCOM_LIST_UNSUPPORTED:
+                self._xcom_list_unsupported.add(api_url)
+                logger.warning(f"[RestDataSource] {api_url} cannot list the XCom entries, reading them one by one: {e}")
+            return await super().xcoms_bulk(api_url, dag_id, dag_runs, task_id, xcom_key, cookies, max_concurrency)
+
+        async def fetch(i: str) -> None:
+            async with semaphore:
+                try:
+                    data = await self.xcom(api_url, dag_id, i, task_id, xcom_key, cookies)
+                except Non200Response:  # deleted since it was listed
+                    cached.pop(i, None)
+                    return
+                cached[i] = _XComValue.of(wanted[i], listed[i], data["value"])
+
+        to_fetch = []
+        for i in stale:
+            entry, timestamp = cached.get(i), listed.get(i)
+            if timestamp is None:  # no XCom (yet)
+                cached[i] = _XComValue.of(wanted[i], None, None)
+            elif entry is not None and entry.value is not None and entry.timestamp == timestamp:
+                self.num_xcom_values_reused += 1
+                cached[i] = _XComValue.of(wanted[i], timestamp, entry.value)
+            else:
+                to_fetch.append(i)
+        await asyncio.gather(*[fetch(i) for i in to_fetch])
+        return {i: cached[i].value for i in wanted if i in cached and cached[i].value is not None}
+
+    def forget_batch(self, batch_id: str) -> None:
+        """drop the XCom values of the DagRuns of `batch_id`, the ones of a batch still running are dropped by
+        `xcoms_bulk` when their DagRuns leave the listing"""
+        for cache_key, cached in list(self._xcom_values.items()):
+            for i in [i for i, entry in cached.items() if entry.batch_id == batch_id]:
+                del cached[i]
+            if not cached:
+                del self._xcom_values[cache_key]
+                self._xcom_list_pages.pop(cache_key, None)
+
+    @staticmethod
+    def _xcom_timestamps(entries: Iterable[dict], xcom_key: str) -> Dict[str, str]:
+        """(DagRun id -> timestamp) of the entries of `xcom_key`. The entries identify their DagRun by dag_run_id in
+        recent versions, by execution_date in the older ones"""
+        return {
+            entry.get("dag_run_id") or entry.get("run_id") or entry.get("execution_date"): entry.get("timestamp")
+            for entry in entries
+            if entry.get("key") == xcom_key and entry.get("map_index", -1) == -1
+        }
+
+    async def _list_xcom_entries(
+        self, api_url: str, dag_id: str, dag_runs: Iterable[dict], task_id: str, xcom_key: str, cookies: dict
+    ) -> Dict[str, str]:
+        """dag_run_id -> timestamp of the entries of `dag_runs`, from the paginated list of the entries of all the DagRuns"""
+        url = f"{api_url}/api/v1/dags/{dag_id}/dagRuns/~/taskInstances/{task_id}/xcomEntries"
+        limit = self.xcom_page_limit
+
+        async def request_page(offset: int) -> dict:
+            status, json_data = await ar.get(f"{url}?xcom_key={xcom_key}&limit={limit}&offset={offset}", cookies=cookies)
+            return json_data
+
+        first_page = await request_page(0)
+        pages = [first_page] + await asyncio.gather(
+            *[request_page(offset) for offset in range(limit, first_page["total_entries"], limit)]
+        )
+        self._xcom_list_pages[(api_url, dag_id, task_id, xcom_key)] = len(pages)
+        timestamps = self._xcom_timestamps((entry for page in pages for entry in page["xcom_entries"]), xcom_key)
+        listed = {}
+        for dr in dag_runs:
+            for i in (dr["dag_run_id"], dr.get("execution_date") or dr.get("logical_date")):
+                if i in timestamps:
+                    listed[dr["dag_run_id"]] = timestamps[i]
+                    break
+        return listed
+
+    async def _list_run_xcom_entries(
+        self, api_url: str, dag_id: str, dag_run_ids: Iterable[str], task_id: str, xcom_key: str, cookies: dict,
+        semaphore: asyncio.Semaphore,
+    ) -> Dict[str, str]:
+        """dag_run_id -> timestamp of the entries of `dag_run_ids`, one list per DagRun"""
+        async def request(dag_run_id: str) -> Tuple[str, str]:
+            url = f"{api_url}/api/v1/dags/{dag_id}/dagRuns/{dag_run_id}/taskInstances/{task_id}/xcomEntries"
+            async with semaphore:
+                status, json_data = await ar.get(f"{url}?xcom_key={xcom_key}", cookies=cookies)
+            # the DagRun is known, its entries may only have an execution_date
+            timestamps = list(self._xcom_timestamps(json_data["xcom_entries"], xcom_key).values())
+            return dag_run_id, timestamps[0] if timestamps else None
+
+        results = await asyncio.gather(*[request(i) for i in dag_run_ids])
+        return {i: timestamp for i, timestamp in results if timestamp is not None}
+
+
+class _XComValue:
+    __slots__ = ("batch_id", "signature", "timestamp", "value")
+
+    def __init__(self, batch_id: str, signature: tuple, timestamp: str, value: str) -> None:
+        """The value of an XCom entry (None if the DagRun has none) and the (state, end_date) of its DagRun"""
+        self.batch_id = batch_id
+        self.signature = signature
+        self.timestamp = timestamp
+        self.value = value
+
+    @classmethod
+    def of(cls, dag_run: dict, timestamp: str, value: str) -> "_XComValue":
+        return cls(dag_run.get("batch_id"), (dag_run.get("state"), dag_run.get("end_date")), timestamp, value)
+
+    def is_settled(self, dag_run: dict) -> bool:
+        """whether the DagRun finished, and has not changed since the value was read"""
+        return self.signature[0] in FINISHED_STATES and self.signature == (dag_run.get("state"), dag_run.get("end_date"))
@@ -1,3 +1,4 @@
+from typing import List
 import json
 
 import aiofiles
@@ -25,6 +26,22 @@ def extract_values(input: str) -> list:
     assert len(d) > 0, "input should not be empty"
     return [list(item.values())[0] if isinstance(item, dict) else item for item in d]
 
+
+def extract_values_batch(inputs: List[str]) -> List[list]:
+    """`extract_values` of many inputs, decoded with one json.loads of their concatenation"""
+    if not inputs:
+        return []
+    try:
+        decoded = json.loads(f"[{','.join(inputs)}]".replace("'", '"'))
+    except ValueError:
+        return [extract_values(input) for input in inputs]  # raises on the invalid one
+    if len(decoded) != len(inputs):  # an input was not a single json value
+        return [extract_values(input) for input in inputs]
+    for d in decoded:
+        assert isinstance(d, list), "input string should be actually a list"
+        assert len(d) > 0, "input should not be empty"
+    return [[list(item.values())[0] if isinstance(item, dict) else item for item in d] for d in decoded]
+
 # async def read_cookie_session():
 #     async with open('conf/cookie_session', 'r') as f:
 #         cookie_session = f.read()
@@ -0,0 +1,112 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable
+import asyncio
+import time
+
+from loguru import logger
+
+
+_executor: Executor = None
+_executor_kind: str = "inline"
+_wrap_thread_call: Callable[[Callable], Callable] = None
+
+
+def configure_compute(kind: str = "thread", max_workers: int = None) -> None:
+    """Configure where the CPU-heavy DataFrame transforms (merge, groupby, explode, ...) are executed.
+
+    Parameters
+    ----------
+    kind : str, optional
+        Valid choices: ["inline", "thread", "process"], by default "thread".
+        "inline" runs the transforms directly on the event loop (the old behavior).
+    max_workers : int, optional
+        max number of workers of the executor, by default None (decided by concurrent.futures)
+    """
+    global _executor, _executor_kind
+    assert kind in ["inline", "thread", "process"], "invalid compute executor kind"
+    shutdown_compute()
+    if kind == "thread":
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="compute")
+    elif kind == "process":
+        _executor = ProcessPoolExecutor(max_workers=max_workers)
+    _executor_kind = kind
+
+
+def shutdown_compute() -> None:
+    global _executor, _executor_kind
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+    _executor_kind = "inline"
+
+
+def set_compute_wrapper(wrapper: Callable[[Callable], Callable] = None) -> None:
+    """Wrap the calls submitted to the thread executor with `wrapper(call)` (called on the event loop, returns the
+    callable run by the worker), e.g. by the profiler to credit their samples to the calling watcher. None to stop."""
+    global _wrap_thread_call
+    _wrap_thread_call = wrapper
+
+
+async def run_compute(func: Callable, *args, **kwargs):
+    """Run `func(*args, **kwargs)` in the configured compute executor and await the result.
+    When using the process executor, `func` and its arguments must be picklable,
+    so pass module-level functions rather than lambdas or bound methods.
+    """
+    if _executor is None:
+        # still yield once so that other coroutines get a chance to run between transforms
+        await asyncio.sleep(0)
+        return func(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    call = partial(func, *args, **kwargs)
+    if _wrap_thread_call is not None and _executor_kind == "thread":
+        call = _wrap_thread_call(call)
+    return await loop.run_in_executor(_executor, call)
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.5, report_every: int = 120) -> None:
+        """Measures how late the event loop wakes up a coroutine that sleeps `interval` seconds.
+        A large lag means something is blocking the event loop.
+
+        Parameters
+        ----------
+        interval : float, optional
+            sampling interval (in seconds), by default 0.5
+        report_every : int, optional
+            log a summary every `report_every` samples, by default 120. 0 means never log.
+        """
+        self.interval = interval
+        self.report_every = report_every
+        self.reset()
+
+    def reset(self) -> None:
+        self.num_samples = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+
+    @property
+    def mean_lag(self) -> float:
+        return self.total_lag / self.num_samples if self.num_samples else 0.0
+
+    def record(self, lag: float) -> None:
+        lag = max(lag, 0.0)
+        self.num_samples += 1
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.total_lag += lag
+
+    async def run(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record(time.perf_counter() - expected)
+            if self.report_every and self.num_samples % self.report_every == 0:
+                logger.info(f"[LoopLag] {self}")
+
+    def __repr__(self) -> str:
+        return (
+            f"LoopLagMonitor(samples={self.num_samples}, last={self.last_lag * 1000:.1f}ms, "
+            f"mean={self.mean_lag * 1000:.1f}ms, max={self.max_lag * 1000:.1f}ms)"
+        )
@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple
+import asyncio
+
+
+_SOURCE = object()  # key of the split DagRuns to the list they are split from
+
+
+class DagRunCache:
+    def __init__(self) -> None:
+        """Cache of the raw DagRuns (of all batches) of each dag_id, shared by all the sensors and watchers
+        running in the same cycle. Concurrent requests of the same dag_id are coalesced into one fetch.
+        """
+        self._runs: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._by_batch: Dict[Tuple[str, str], Dict[str, List[dict]]] = {}
+        self.num_fetches = 0
+
+    async def get(self, api_url: str, dag_id: str, fetch: Callable[[], Awaitable[List[dict]]]) -> List[dict]:
+        """Return the cached DagRuns of `dag_id`, calling `fetch()` if they are not cached yet.
+        A failed fetch is not cached, the next call will retry it.
+        """
+        key = (api_url, dag_id)
+        future = self._runs.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fetch())
+            self._runs[key] = future
+            self.num_fetches += 1
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            if self._runs.get(key) is future:
+                del self._runs[key]
+            raise
+
+    async def get_batch(
+        self, api_url: str, dag_id: str, batch_id: str, fetch: Callable[[], Awaitable[List[dict]]]
+    ) -> List[dict]:
+        """Like `get`, but only the DagRuns whose conf.batch_id is `batch_id`. The DagRuns of a dag_id
+        are split by batch_id once, and then shared by all the batches.
+        """
+        key = (api_url, dag_id)
+        dag_runs = await self.get(api_url, dag_id, fetch)
+        by_batch = self._by_batch.get(key)
+        if by_batch is None or by_batch.get(_SOURCE) is not dag_runs:
+            by_batch = {_SOURCE: dag_runs}
+            for dr in dag_runs:
+                by_batch.setdefault(dr["conf"].get("batch_id"), []).append(dr)
+            self._by_batch[key] = by_batch
+        return list(by_batch.get(batch_id, []))
+
+    def put(self, api_url: str, dag_id: str, dag_runs: List[dict]) -> None:
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(dag_runs)
+        self._runs[(api_url, dag_id)] = future
+
+    def invalidate(self, dag_ids: Iterable[str] = None) -> None:
+        """Drop the cached DagRuns of `dag_ids` (all if None), e.g. after triggering a new DagRun"""
+        if dag_ids is None:
+            self._runs.clear()
+            self._by_batch.clear()
+            return
+        dag_ids = set(dag_ids)
+        for key in [k for k in self._runs if k[1] in dag_ids]:
+            del self._runs[key]
+            self._by_batch.pop(key, None)
+
+    def cancel_pending(self) -> int:
+        """cancel the fetches still pending, e.g. of a watcher cancelled at its deadline, returns their number"""
+        pending = [future for future in self._runs.values() if not future.done()]
+        for future in pending:
+            future.cancel()
+        return len(pending)
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        future = self._runs.get(key)
+        return future is not None and future.done() and not future.cancelled() and future.exception() is None
+
+
+_current_dag_run_cache: ContextVar[DagRunCache] = ContextVar("dag_run_cache", default=None)
+
+
+def current_dag_run_cache() -> DagRunCache:
+    return _current_dag_run_cache.get()
+
+
+@contextmanager
+def use_dag_run_cache(cache: DagRunCache):
+    """Within the context (and the asyncio tasks created in it), `get_dag_runs` reads from `cache`"""
+    token = _current_dag_run_cache.set(cache)
+    try:
+        yield cache
+    finally:
+        _current_dag_run_cache.reset(token)
@@ -0,0 +1,130 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
+
+
+ACTIVE_STATES = ("queued", "running")
+TIERS = ("hot", "warm", "cold")
+
+
+class RefreshPolicy:
+    def __init__(self, hot: float = 0, warm: float = 60, cold: float = 600, hot_for: float = 120) -> None:
+        """How often the DagRuns of a DAG are refreshed, depending on its activity
+
+        Parameters
+        ----------
+        hot : float, optional
+            time (in seconds) between two refreshes of a hot DAG, i.e. with queued / running DagRuns, or whose
+            DagRuns changed in the last `hot_for` seconds, by default 0 (every cycle)
+        warm : float, optional
+            time between two refreshes of a quiescent DAG that a watcher is still waiting on, i.e. a watcher
+            reading it has ready scenes queued or triggers a hot DAG, by default 60
+        cold : float, optional
+            time between two refreshes of the other DAGs, whose DagRuns only change if they are cleared or
+            triggered by someone else, by default 600
+        hot_for : float, optional
+            time (in seconds) for which a DAG stays hot after its DagRuns changed, by default 120
+        """
+        assert 0 <= hot <= warm <= cold, f"the refresh intervals should be hot <= warm <= cold: {hot}, {warm}, {cold}"
+        self.intervals = {"hot": hot, "warm": warm, "cold": cold}
+        self.hot_for = hot_for
+
+    @classmethod
+    def parse(cls, items: Iterable[str]) -> "RefreshPolicy":
+        """from ["hot=0", "cold=900", ...]"""
+        return cls(**{k: float(v) for k, v in (item.split("=", 1) for item in items)})
+
+    def __repr__(self) -> str:
+        return f"RefreshPolicy({', '.join(f'{k}={v:g}' for k, v in self.intervals.items())}, hot_for={self.hot_for:g})"
+
+
+class DagState:
+    __slots__ = ("dag_runs", "signature", "num_active", "fetched_at", "changed_at", "tier")
+
+    def __init__(self) -> None:
+        self.dag_runs: List[dict] = None
+        self.signature: int = None
+        self.num_active = 0
+        self.fetched_at: float = None
+        self.changed_at: float = None
+        self.tier = "hot"
+
+
+class DagStateStore:
+    def __init__(self, policy: RefreshPolicy = None) -> None:
+        """The last DagRuns of each DAG kept across cycles, with the activity of the DAG, so that the coordinator
+        refreshes the hot DAGs every cycle and the quiescent ones rarely (see RefreshPolicy).
+        A DAG triggered by a watcher is hot again from the next cycle (`touch`).
+
+        Parameters
+        ----------
+        policy : RefreshPolicy, optional
+            the refresh intervals, by default RefreshPolicy()
+        """
+        self.policy = policy or RefreshPolicy()
+        self._states: Dict[Tuple[str, str], DagState] = {}
+        self.num_refreshes = 0
+        self.num_reused = 0
+
+    def get(self, api_url: str, dag_id: str) -> Optional[DagState]:
+        return self._states.get((api_url, dag_id))
+
+    def is_due(self, api_url: str, dag_id: str, now: float) -> bool:
+        state = self._states.get((api_url, dag_id))
+        if state is None or state.dag_runs is None:
+            return True
+        return now - state.fetched_at >= self.policy.intervals[state.tier]
+
+    def update(self, api_url: str, dag_id: str, dag_runs: List[dict], now: float) -> bool:
+        """store freshly fetched DagRuns, returns True if they changed"""
+        state = self._states.setdefault((api_url, dag_id), DagState())
+        signature = hash(tuple((dr["dag_run_id"], dr["state"]) for dr in dag_runs))
+        changed = signature != state.signature
+        if changed:
+            state.signature = signature
+            state.changed_at = now
+        state.dag_runs = dag_runs
+        state.num_active = sum(dr["state"] in ACTIVE_STATES for dr in dag_runs)
+        state.fetched_at = now
+        self.num_refreshes += 1
+        return changed
+
+    def touch(self, api_url: str, dag_id: str, now: float) -> None:
+        """the DAG was just triggered, refresh it in the next cycle"""
+        state = self._states.get((api_url, dag_id))
+        if state is not None:
+            state.changed_at = now
+            state.tier = "hot"
+            state.fetched_at = float("-inf")
+
+    def classify(self, now: float, waited_on: Set[Tuple[str, str]] = frozenset()) -> Dict[str, List[str]]:
+        """Re-tier all the DAGs, `waited_on` are the DAGs a watcher is still waiting on (see RefreshPolicy).
+        The tier changes are logged. Returns tier -> dag_ids"""
+        tiers = {tier: [] for tier in TIERS}
+        for key, state in self._states.items():
+            if state.num_active > 0 or (state.changed_at is not None and now - state.changed_at < self.policy.hot_for):
+                tier = "hot"
+            elif key in waited_on:
+                tier = "warm"
+            else:
+                tier = "cold"
+            if tier != state.tier:
+                logger.info(f"[DagState] {key[1]}: {state.tier} -> {tier}")
+                state.tier = tier
+            tiers[tier].append(key[1])
+        return tiers
+
+    def forget(self, keys: Iterable[Tuple[str, str]]) -> None:
+        for key in keys:
+            self._states.pop(key, None)
+
+    def keys(self) -> Set[Tuple[str, str]]:
+        return set(self._states)
+
+    def stats(self) -> Dict[str, int]:
+        stats = {tier: 0 for tier in TIERS}
+        for state in self._states.values():
+            stats[state.tier] += 1
+        stats["refreshes"] = self.num_refreshes
+        stats["reused"] = self.num_reused
+        return stats
@@ -0,0 +1,115 @@
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence, Set
+import json
+
+import pandas as pd
+from loguru import logger
+
+from .memory import intern_scene_key, intern_scene_keys
+
+
+class DoneSet:
+    def __init__(self, scene_id_keys: Sequence[str], terminal_dag_ids: Iterable[str], path: Path = None) -> None:
+        """The scenes of a batch that are done, i.e. whose DagRuns of every terminal DAG (the DAGs that no other
+        watcher of the batch reads) succeeded. The DagRuns of the done scenes are dropped by `get_dag_runs`
+        (see `set_done_set`), so they are no longer joined by the sensors, nor are their TaskInstances or XComs
+        read, and the work of a tick follows the scenes in flight instead of the whole history of the batch.
+
+        The done scenes are appended to `path` (one JSON list of scene_id_values per line) and loaded back at
+        start, so they stay retired across restarts. Delete the file to re-run a batch from scratch.
+
+        Parameters
+        ----------
+        scene_id_keys : Sequence[str]
+            the scene_id_keys of the terminal watchers
+        terminal_dag_ids : Iterable[str]
+            the dag_ids of the terminal watchers
+        path : Path, optional
+            the file the done scenes are persisted to, by default None (not persisted)
+        """
+        self.scene_id_keys = list(scene_id_keys)
+        self.terminal_dag_ids = set(terminal_dag_ids)
+        self.path = Path(path) if path is not None else None
+        self._done: Set[tuple] = set()
+        self.version = 0  # incremented when scenes become done
+        self._partial: Dict[tuple, Set[str]] = {}  # scene -> the terminal DAGs it succeeded in, while not done
+        if self.path is not None and self.path.is_file():
+            self._load()
+
+    def _load(self) -> None:
+        with open(self.path, "r") as f:
+            for line in f:
+                if line.strip():
+                    self._done.add(intern_scene_key(json.loads(line)))
+        self.version += 1
+        logger.info(f"[DoneSet] loaded {len(self._done)} done scenes from {self.path}")
+
+    def report(self, dag_id: str, success_keys: Iterable[tuple]) -> List[tuple]:
+        """the scenes whose DagRun of the terminal DAG `dag_id` succeeded, returns the scenes that became done"""
+        if dag_id not in self.terminal_dag_ids:
+            return []
+        newly_done = []
+        for key in success_keys:
+            if key in self._done:
+                continue
+            dag_ids = self._partial.setdefault(key, set())
+            dag_ids.add(dag_id)
+            if dag_ids == self.terminal_dag_ids:
+                del self._partial[key]
+                self._done.add(key)
+                newly_done.append(key)
+        if newly_done:
+            self.version += 1
+            self._persist(newly_done)
+            logger.info(f"[DoneSet] {len(newly_done)} scenes done, {len(self._done)} in total")
+        return newly_done
+
+    def _persist(self, keys: List[tuple]) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            # the numpy scalars of the scene_id_values are written as python ones
+            f.writelines(json.dumps(list(key), default=lambda v: v.item()) + "\n" for key in keys)
+
+    def drop_done(self, dag_runs: List[dict]) -> List[dict]:
+        """the DagRuns whose conf is not a done scene, the DagRuns without all the scene_id_keys are kept"""
+        if not self._done:
+            return dag_runs
+        return [dr for dr in dag_runs if not self.is_done(dr["conf"])]
+
+    def drop_done_df(self, df: pd.DataFrame) -> pd.DataFrame:
+        """the rows of `df` that are not a done scene, `df` itself if none is or it lacks a scene_id_key"""
+        if not self._done or len(df) == 0 or any(k not in df.columns for k in self.scene_id_keys):
+            return df
+        mask = [key not in self._done for key in intern_scene_keys(df, self.scene_id_keys)]
+        return df if all(mask) else df[mask].reset_index(drop=True)
+
+    def is_done(self, scene: dict) -> bool:
+        """whether the scene (a dict with the scene_id_keys) is done"""
+        keys = self.scene_id_keys
+        return all(k in scene for k in keys) and tuple(scene[k] for k in keys) in self._done
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._done
+
+    def __iter__(self) -> Iterator[tuple]:
+        return iter(self._done)
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+
+_done_sets: Dict[str, DoneSet] = {}
+
+
+def set_done_set(batch_id: str, done_set: DoneSet = None) -> None:
+    """Retire the done scenes of `batch_id` from the DagRuns read by `get_dag_runs`, None to stop"""
+    if done_set is None:
+        _done_sets.pop(batch_id, None)
+    else:
+        _done_sets[batch_id] = done_set
+
+
+def get_done_set(batch_id: str) -> DoneSet:
+    return _done_sets.get(batch_id)
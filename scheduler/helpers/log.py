@@ -0,0 +1,88 @@
+from typing import Dict, Tuple
+import sys
+import time
+
+from loguru import logger
+
+
+class RateLimitFilter:
+    def __init__(self, max_records: int = 10, interval: float = 60, min_level: str = "WARNING") -> None:
+        """A loguru filter letting at most `max_records` records of each call site (module and line)
+        through every `interval` seconds. The records at or above `min_level` are never dropped.
+        The first record let through after some were dropped tells how many were.
+
+        Parameters
+        ----------
+        max_records : int, optional
+            the maximum number of records per call site per interval, by default 10
+        interval : float, optional
+            the length (in seconds) of the interval, by default 60
+        min_level : str, optional
+            the level from which the records are not rate-limited, by default "WARNING"
+        """
+        self.max_records = max_records
+        self.interval = interval
+        self.min_level_no = logger.level(min_level).no
+        self._windows: Dict[Tuple[str, int], list] = {}  # call site -> [window start, #passed, #suppressed]
+
+    def __call__(self, record: dict) -> bool:
+        if record["level"].no >= self.min_level_no:
+            return True
+        now = time.monotonic()
+        window = self._windows.setdefault((record["name"], record["line"]), [now, 0, 0])
+        if now - window[0] >= self.interval:
+            window[0], window[1] = now, 0
+        if window[1] >= self.max_records:
+            window[2] += 1
+            return False
+        window[1] += 1
+        if window[2]:
+            record["extra"]["suppressed"] = window[2]
+            record["message"] += f" ({window[2]} similar records suppressed)"
+            window[2] = 0
+        return True
+
+
+def setup_logging(
+    level: str = "INFO",
+    json: bool = False,
+    enqueue: bool = True,
+    rate_limit: int = None,
+    rate_limit_interval: float = 60,
+    sink=sys.stderr,
+) -> int:
+    """Replace the default loguru handler, so that logging stays off the event loop's critical path
+
+    Parameters
+    ----------
+    level : str, optional
+        the minimum level, by default "INFO". The messages logged with `logger.opt(lazy=True)`
+        are only formatted when their level is enabled.
+    json : bool, optional
+        if True, write each record as a JSON object (loguru's `serialize`), by default False
+    enqueue : bool, optional
+        if True, the records are queued and written by a background thread, so a slow sink does
+        not block the event loop, by default True. Call `await logger.complete()` before exiting.
+    rate_limit : int, optional
+        if provided, at most `rate_limit` records below WARNING per call site per
+        `rate_limit_interval` seconds, see RateLimitFilter, by default None (no limit)
+    rate_limit_interval : float, optional
+        by default 60
+    sink : optional
+        where to write, by default sys.stderr
+
+    Returns
+    -------
+    int
+        the id of the handler
+    """
+    logger.remove()
+    return logger.add(
+        sink,
+        level=level,
+        serialize=json,
+        enqueue=enqueue,
+        filter=RateLimitFilter(rate_limit, rate_limit_interval) if rate_limit else None,
+        backtrace=False,
+        diagnose=False,
+    )
@@ -0,0 +1,73 @@
+from typing import Iterable, List, Sequence
+import sys
+
+import pandas as pd
+
+
+# low-cardinality string columns that are stored as pandas categoricals (small-int codes) when compact dtypes are enabled
+CATEGORICAL_COLUMNS = ("state", "dag_run_state", "task_instance_state", "dag_id", "batch_id")
+
+_compact_dtypes = False
+
+
+def enable_compact_dtypes(enabled: bool = True) -> None:
+    """If enabled, the DataFrames built from Airflow responses store CATEGORICAL_COLUMNS as categoricals"""
+    global _compact_dtypes
+    _compact_dtypes = enabled
+
+
+def compact_dtypes(df: pd.DataFrame, columns: Sequence[str] = CATEGORICAL_COLUMNS) -> pd.DataFrame:
+    """Convert the `columns` of df (the ones that exist) into categoricals inplace, does nothing unless enabled"""
+    if not _compact_dtypes or len(df) == 0:
+        return df
+    for col in columns:
+        if col in df.columns and df[col].dtype == object:
+            df[col] = df[col].astype("category")
+    return df
+
+
+class SceneKeyTable:
+    def __init__(self) -> None:
+        """A table of interned scene-key tuples, e.g. ("20231220_1101", 3) for scene_id_keys ["scene_id", "split_id"].
+        Equal keys built from different DataFrames are resolved to the same tuple object (with interned strings),
+        so the keys held across ticks and watchers are stored only once.
+        """
+        self._table = {}
+
+    def intern(self, key: Iterable) -> tuple:
+        key = tuple(key)
+        found = self._table.get(key)
+        if found is None:
+            found = tuple(sys.intern(v) if type(v) is str else v for v in key)
+            self._table[found] = found
+        return found
+
+    def clear(self) -> None:
+        self._table.clear()
+
+    def retain(self, keys: Iterable[tuple]) -> None:
+        """Drop all the keys but `keys` (the ones still held, e.g. after a batch is removed), the others are
+        interned again when seen"""
+        table = self._table
+        self._table = {found: found for found in (table.get(key) for key in keys) if found is not None}
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._table
+
+
+scene_key_table = SceneKeyTable()
+
+
+def intern_scene_key(key: Iterable) -> tuple:
+    """Intern the scene-key in the process-wide scene_key_table"""
+    return scene_key_table.intern(key)
+
+
+def intern_scene_keys(df: pd.DataFrame, scene_id_keys: List[str]) -> List[tuple]:
+    """Interned scene-key tuples of each row of df"""
+    if len(df) == 0:
+        return []
+    return [scene_key_table.intern(key) for key in zip(*[df[k].tolist() for k in scene_id_keys])]
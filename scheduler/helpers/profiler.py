@@ -0,0 +1,228 @@
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Tuple
+import asyncio
+import os
+import sys
+import threading
+
+from loguru import logger
+
+from .compute import set_compute_wrapper
+
+
+# the (function, file) of the leaf frames of a thread that waits, their samples are not CPU time
+IDLE_FRAMES = {
+    ("select", "selectors.py"),
+    ("wait", "threading.py"),
+    ("get", "queue.py"),
+    ("_recv", "connection.py"),
+}
+# the category of the self time of a leaf frame, from the path of its file (the first match)
+CATEGORIES = (
+    ("pandas", ("/pandas/",)),
+    ("numpy", ("/numpy/",)),
+    ("json", ("/json/", "orjson")),
+    ("http", ("/aiohttp/", "/yarl/", "/multidict/", "/ssl.py", "/socket.py")),
+    ("logging", ("/loguru/",)),
+    ("asyncio", ("/asyncio/",)),
+    ("scheduler", ("/scheduler/",)),
+)
+
+
+def categorize(filename: str) -> str:
+    for category, patterns in CATEGORIES:
+        if any(p in filename for p in patterns):
+            return category
+    return "other"
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.005) -> None:
+        """Samples the Python stacks of all the threads every `interval` seconds, from a background thread, so the
+        profiled code is not instrumented. Each sample is attributed to the watcher (and the sensor) it runs in,
+        found by walking the stack up to their `watch` (and `sense`) frames. The idle samples (the event loop
+        waiting in select, idle executor workers) are dropped, so the profile is the CPU time of the scheduler.
+        While it runs, the calls submitted to the thread compute executor are credited to the watcher (and the
+        sensor) awaiting them, see helpers.compute.set_compute_wrapper.
+
+        Parameters
+        ----------
+        interval : float, optional
+            sampling interval (in seconds), by default 0.005
+        """
+        assert interval > 0, "interval should be positive"
+        self.interval = interval
+        # (stack from the root to the leaf, watcher label, sensor label) -> number of samples
+        self.samples: Counter = Counter()
+        self.num_samples = 0
+        self.num_idle = 0
+        self._frame_names: Dict[object, str] = {}
+        self._categories: Dict[str, str] = {}  # frame name -> category
+        self._labels: Dict[int, str] = {}
+        self._owners: Dict[int, Tuple[object, object]] = {}  # compute thread id -> (watcher, sensor) of its call
+        self._thread: threading.Thread = None
+        self._stop = threading.Event()
+
+    def label(self, watchers: Iterable) -> None:
+        """name the samples of the watchers and of their sensors by batch_id.dag_id (and sensor index and class)"""
+        for w in watchers:
+            name = f"{getattr(w, 'batch_id', None)}.{getattr(w, 'dag_id', type(w).__name__)}"
+            self._labels[id(w)] = name
+            for i, sensor in enumerate(getattr(w, "upstream_sensors", [])):
+                self._labels[id(sensor)] = f"{name}.{i}-{type(sensor).__name__}"
+
+    def start(self) -> None:
+        set_compute_wrapper(self.wrap_compute)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        set_compute_wrapper(None)
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        own, main = threading.get_ident(), threading.main_thread().ident
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own:
+                    owner = self._owners.get(thread_id)
+                    self.sample(frame, names.get(thread_id, "thread"), is_main=thread_id == main, owner=owner)
+
+    @staticmethod
+    def find_owner(frame) -> Tuple[object, object]:
+        """the watcher and the sensor whose `watch` and `sense` frames are on the stack of `frame`"""
+        watcher, sensor = None, None
+        while frame is not None:
+            name = frame.f_code.co_name
+            if name == "watch" and watcher is None:
+                watcher = frame.f_locals.get("self")
+            elif name == "sense" and sensor is None:
+                sensor = frame.f_locals.get("self")
+            frame = frame.f_back
+        return watcher, sensor
+
+    def wrap_compute(self, call: Callable) -> Callable:
+        """credit the samples of `call` in a compute thread to the watcher and the sensor awaiting it"""
+        watcher, sensor = self.find_owner(sys._getframe(1))
+        if watcher is None and sensor is None:
+            return call
+
+        def owned_call():
+            thread_id = threading.get_ident()
+            self._owners[thread_id] = (watcher, sensor)
+            try:
+                return call()
+            finally:
+                self._owners.pop(thread_id, None)
+
+        return owned_call
+
+    def sample(self, frame, thread_name: str = "MainThread", is_main: bool = True, owner: Tuple[object, object] = None) -> None:
+        """record the stack of `frame` (the leaf frame of a thread), `owner` is the (watcher, sensor) of a compute call"""
+        code = frame.f_code
+        if (code.co_name, os.path.basename(code.co_filename)) in IDLE_FRAMES:
+            self.num_idle += 1
+            return
+        stack, watcher, sensor = [], None, None
+        while frame is not None:
+            code = frame.f_code
+            name = self._frame_names.get(code)
+            if name is None:
+                path = "/".join(code.co_filename.split(os.sep)[-2:])
+                name = f"{getattr(code, 'co_qualname', code.co_name)} ({path}:{code.co_firstlineno})"
+                self._frame_names[code] = name
+                self._categories[name] = categorize(code.co_filename)
+            stack.append(name)
+            if code.co_name == "watch":
+                watcher = frame.f_locals.get("self")
+            elif code.co_name == "sense":
+                sensor = frame.f_locals.get("self")
+            frame = frame.f_back
+        if owner is not None and watcher is None and sensor is None:
+            watcher, sensor = owner
+        # the watchers added since `label` (e.g. of a new batch) are labelled when first seen
+        if watcher is not None and id(watcher) not in self._labels:
+            self.label([watcher])
+        watcher, sensor = self._labels.get(id(watcher)), self._labels.get(id(sensor))
+        if not is_main:
+            stack.append(thread_name)
+        stack.reverse()
+        self.samples[(tuple(stack), watcher, sensor)] += 1
+        self.num_samples += 1
+
+    def folded(self, select: Callable[[str, str], bool] = None) -> List[str]:
+        """the samples (for which `select(watcher, sensor)` is True) as folded stacks, the input of flamegraph.pl
+        and speedscope: one line per stack, the frames from the root separated by ";", then the number of samples"""
+        merged = Counter()
+        for (stack, watcher, sensor), count in self.samples.items():
+            if select is None or select(watcher, sensor):
+                merged[";".join(stack)] += count
+        return [f"{stack} {count}" for stack, count in sorted(merged.items())]
+
+    def self_time(self) -> Tuple[Counter, Counter, Counter]:
+        """the number of samples of each function as the leaf (self time) and anywhere in the stack (total time),
+        and the self time of each category"""
+        own, total, categories = Counter(), Counter(), Counter()
+        for (stack, _, _), count in self.samples.items():
+            leaf = stack[-1]
+            own[leaf] += count
+            categories[self._categories.get(leaf, "other")] += count
+            for name in set(stack):
+                total[name] += count
+        return own, total, categories
+
+    def summary(self, top: int = 30) -> str:
+        n = max(self.num_samples, 1)
+        own, total, categories = self.self_time()
+        lines = [
+            f"{self.num_samples} samples every {self.interval * 1000:.1f}ms ({self.num_samples * self.interval:.2f}s of CPU), "
+            f"{self.num_idle} idle samples dropped",
+            "",
+            "self time by category",
+        ]
+        lines += [f"  {c:<12}{count / n:>7.1%}{count * self.interval:>9.2f}s" for c, count in categories.most_common()]
+        lines += ["", f"top {top} functions by self time", f"  {'self':>7}{'total':>8}  function"]
+        lines += [f"  {count / n:>7.1%}{total[name] / n:>8.1%}  {name}" for name, count in own.most_common(top)]
+        for title, index in (("watcher", 1), ("sensor", 2)):
+            by_label = Counter()
+            for key, count in self.samples.items():
+                by_label[key[index] or "(none)"] += count
+            lines += ["", f"samples by {title}"]
+            lines += [f"  {count / n:>7.1%}  {label}" for label, count in by_label.most_common()]
+        return "\n".join(lines) + "\n"
+
+    def write(self, out_dir: Path, top: int = 30) -> Path:
+        """Write the folded stacks of all the samples (all.folded), of each watcher (watchers/{label}.folded) and of
+        each sensor (sensors/{label}.folded), and the summary (summary.txt) to `out_dir`, returns the summary path"""
+        out_dir = Path(out_dir)
+        for sub in ("watchers", "sensors"):
+            (out_dir / sub).mkdir(parents=True, exist_ok=True)
+        (out_dir / "all.folded").write_text("\n".join(self.folded()) + "\n")
+        watchers = {w for _, w, _ in self.samples if w is not None}
+        sensors = {s for _, _, s in self.samples if s is not None}
+        for label in watchers:
+            lines = self.folded(lambda w, s: w == label)
+            (out_dir / "watchers" / f"{label}.folded").write_text("\n".join(lines) + "\n")
+        for label in sensors:
+            lines = self.folded(lambda w, s: s == label)
+            (out_dir / "sensors" / f"{label}.folded").write_text("\n".join(lines) + "\n")
+        path = out_dir / "summary.txt"
+        path.write_text(self.summary(top))
+        return path
+
+
+async def stop_after(tasks: List[asyncio.Task], num_ticks: Callable[[], int], ticks: int = None, seconds: float = None) -> None:
+    """cancel `tasks` once `num_ticks()` reaches `ticks` or after `seconds`, whichever comes first (never if both are None)"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + seconds if seconds is not None else None
+    while (ticks is None or num_ticks() < ticks) and (deadline is None or loop.time() < deadline):
+        await asyncio.sleep(0.1)
+    logger.info(f"[Profiler] stopping after {num_ticks()} ticks")
+    for task in tasks:
+        task.cancel()
@@ -0,0 +1,135 @@
+"""Record the Airflow API traffic and serve it back, to reproduce and profile a tick offline.
+
+Record (only the method, path, request body, status, response body and latency are kept, not the cookies):
+
+    python main.py ... --record-http airflow.jsonl.gz
+
+Replay, then point the scheduler (or a benchmark) at the replay server with --api-url:
+
+    python -m scheduler.helpers.replay airflow.jsonl.gz --port 8080
+"""
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+import argparse
+import asyncio
+import gzip
+import json
+import time
+
+from aiohttp import web
+from loguru import logger
+
+
+def _open(path: str, mode: str):
+    return gzip.open(path, mode + "t", encoding="utf-8") if str(path).endswith(".gz") else open(path, mode, encoding="utf-8")
+
+
+def request_key(method: str, url: str) -> Tuple[str, str]:
+    """(method, path?query) of a request, the host is dropped so that a recording can be replayed anywhere"""
+    parts = urlsplit(url)
+    return method.upper(), parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+class Recorder:
+    def __init__(self, path: str) -> None:
+        """Append the requests and responses to a JSON-lines file (gzipped if the path ends with .gz)
+
+        Parameters
+        ----------
+        path : str
+            the recording file
+        """
+        self.path = path
+        self.num_records = 0
+        self._file = _open(path, "a")
+        self._start = time.monotonic()
+
+    def record(self, method: str, url: str, data, status: int, body: bytes, latency: float) -> None:
+        method, path = request_key(method, url)
+        entry = {
+            "t": round(time.monotonic() - self._start, 6),
+            "method": method,
+            "path": path,
+            "data": data,
+            "status": status,
+            "latency": round(latency, 6),
+            "body": body.decode("utf-8", errors="replace"),
+        }
+        self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self.num_records += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def load_recording(path: str) -> Dict[Tuple[str, str], List[dict]]:
+    """(method, path) -> the recorded responses in the order they were recorded"""
+    recording = {}
+    with _open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recording.setdefault((entry["method"], entry["path"]), []).append(entry)
+    return recording
+
+
+class ReplayServer:
+    def __init__(self, path: str, replay_latency: bool = False) -> None:
+        """Serve a recording back: the n-th request of a (method, path) gets the n-th response recorded for it,
+        and the last one once they are used up, so the same sequence of requests always gets the same responses.
+        The requests that were never recorded get a 404.
+
+        Parameters
+        ----------
+        path : str
+            the recording file
+        replay_latency : bool, optional
+            if True, each response is delayed by its recorded latency, by default False
+        """
+        self.recording = load_recording(path)
+        self.replay_latency = replay_latency
+        self.num_served = 0
+        self.misses: Dict[Tuple[str, str], int] = {}
+        self._cursor: Dict[Tuple[str, str], int] = {}
+
+    def reset(self) -> None:
+        """replay from the beginning"""
+        self._cursor.clear()
+        self.num_served = 0
+        self.misses.clear()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        key = request_key(request.method, str(request.rel_url))
+        entries = self.recording.get(key)
+        if not entries:
+            self.misses[key] = self.misses.get(key, 0) + 1
+            return web.json_response({"title": "not recorded", "request": list(key)}, status=404)
+        i = self._cursor.get(key, 0)
+        self._cursor[key] = i + 1
+        entry = entries[min(i, len(entries) - 1)]
+        if self.replay_latency:
+            await asyncio.sleep(entry["latency"])
+        self.num_served += 1
+        return web.Response(body=entry["body"].encode("utf-8"), status=entry["status"], content_type="application/json")
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self.handle)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve a recording of the Airflow API traffic")
+    parser.add_argument("recording", help="the file written with --record-http")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--replay-latency", action="store_true", help="delay each response by its recorded latency")
+    args = parser.parse_args()
+
+    server = ReplayServer(args.recording, replay_latency=args.replay_latency)
+    logger.info(f"[Replay] {sum(len(v) for v in server.recording.values())} responses of {len(server.recording)} requests")
+    web.run_app(server.make_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+import re
+import time
+
+
+class CachedResponse:
+    __slots__ = ("json_data", "etag", "last_modified", "expires_at")
+
+    def __init__(self, json_data, etag: str = None, last_modified: str = None, expires_at: float = None) -> None:
+        self.json_data = json_data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+    @property
+    def has_validators(self) -> bool:
+        return self.etag is not None or self.last_modified is not None
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1024, ttl: Dict[str, float] = None) -> None:
+        """A bounded (LRU) cache of the decoded GET responses, keyed by URL, used by `aiohttp_requests.get`.
+
+        A response carrying an ETag or a Last-Modified header is revalidated on every GET with
+        If-None-Match / If-Modified-Since, and its decoded body is reused when the server answers 304.
+        A response without validators is only cached if its URL matches one of the `ttl` patterns, and is
+        then served without any request until it expires.
+
+        The cached objects are shared by all the callers, they must not be modified in place.
+
+        Parameters
+        ----------
+        max_entries : int, optional
+            the maximum number of cached responses, the least recently used ones are evicted first, by default 1024
+        ttl : Dict[str, float], optional
+            regex searched in the URL -> time to live (in seconds) of the responses without validators,
+            the first matching pattern wins, e.g. {"/dags/[^/]+$": 60, "/xcomEntries/": 300}, by default None
+        """
+        assert max_entries > 0, f"max_entries must be positive: {max_entries}"
+        self.max_entries = max_entries
+        self.ttl = [(re.compile(pattern), seconds) for pattern, seconds in (ttl or {}).items()]
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self.hits = 0  # served without a request (TTL)
+        self.revalidations = 0  # 304, the cached body is reused
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def ttl_of(self, url: str) -> Optional[float]:
+        for pattern, seconds in self.ttl:
+            if pattern.search(url):
+                return seconds
+        return None
+
+    def lookup(self, key: Hashable, now: float = None) -> Tuple[Optional[CachedResponse], bool]:
+        """(entry, fresh): `fresh` means the entry can be returned without a request, otherwise the entry
+        (if any) holds the validators to send"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, False
+        now = time.monotonic() if now is None else now
+        if entry.expires_at is not None and now < entry.expires_at:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry, True
+        if not entry.has_validators:
+            del self._entries[key]
+            return None, False
+        return entry, False
+
+    def store(self, key: Hashable, url: str, json_data, etag: str = None, last_modified: str = None, now: float = None) -> None:
+        """Cache a 200 response if it has validators or its URL has a TTL"""
+        self.misses += 1
+        ttl = self.ttl_of(url)
+        if etag is None and last_modified is None and not ttl:
+            self._entries.pop(key, None)
+            return
+        now = time.monotonic() if now is None else now
+        self._entries[key] = CachedResponse(json_data, etag, last_modified, now + ttl if ttl else None)
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def revalidated(self, key: Hashable, url: str, entry: CachedResponse, now: float = None) -> CachedResponse:
+        """the server answered 304 to the conditional request sent with the validators of `entry`"""
+        ttl = self.ttl_of(url)
+        if ttl:
+            entry.expires_at = (time.monotonic() if now is None else now) + ttl
+        self._entries[key] = entry  # it may have been evicted while waiting for the response
+        self._entries.move_to_end(key)
+        self._evict()
+        self.revalidations += 1
+        return entry
+
+    def invalidate(self, pattern: str = None) -> None:
+        """Drop the responses whose URL matches `pattern` (all if None)"""
+        if pattern is None:
+            self._entries.clear()
+            return
+        regex = re.compile(pattern)
+        for key in [k for k in self._entries if regex.search(k[0])]:
+            del self._entries[key]
+
+    def stats(self) -> Dict[str, float]:
+        requests = self.hits + self.revalidations + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "revalidations": self.revalidations,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.revalidations) / requests if requests else 0.0,
+        }
@@ -0,0 +1,446 @@
+"""Simulate a batch against a simulated Airflow on a virtual clock, for capacity planning.
+
+The real watchers and sensors (created from the batch config, as in main.py) run in a Coordinator,
+the HTTP layer is routed to an in-process SimulatedAirflow (see aiohttp_requests.set_transport), and
+the virtual clock jumps from cycle to cycle, so simulated hours take seconds:
+
+    python -m scheduler.simulator batch/dry_run.yml --scenes 20000 --sim-config sim.yml
+
+where sim.yml gives the DagRun durations (in seconds) and the other knobs of the simulated Airflow:
+
+    default_duration: 600
+    durations:
+      generate_base_data: 300                       # constant
+      nvidia_segmentation: {mean: 1200, std: 300}   # normal, clipped at 0
+      generate_ipm: {min: 100, max: 200}            # uniform
+    max_active_runs: {nvidia_segmentation: 8}       # Airflow's own limit per DAG, by default unlimited
+    failure_rate: {generate_ipm: 0.01}
+    xcoms:                                          # dag_id.task_id.xcom_key -> value of the successful runs
+      split.gen.return_value: [0, 1, 2]
+"""
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+from urllib.parse import parse_qsl, urlsplit
+import argparse
+import asyncio
+import copy
+import heapq
+import math
+import random
+import re
+
+import yaml
+
+from .helpers import aiohttp_requests as ar
+from .helpers.dag_state import RefreshPolicy
+from .helpers.log import setup_logging
+from .watcher.batch import Batch, load_batch_config
+from .watcher.coordinator import Coordinator
+
+
+SIMULATED_API_URL = "http://simulated-airflow"
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class VirtualClock:
+    def __init__(self, start: float = 0.0) -> None:
+        """the simulated time, in seconds since the start of the simulation"""
+        self.now = start
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+    def isoformat(self, t: float = None) -> str:
+        return (EPOCH + timedelta(seconds=self.now if t is None else t)).isoformat()
+
+
+class DurationModel:
+    def __init__(self, spec: Union[float, dict], rng: random.Random) -> None:
+        """the duration (in seconds) of the DagRuns of a DAG: a number, {mean, std} (normal) or {min, max} (uniform)"""
+        self.spec = spec
+        self.rng = rng
+
+    def sample(self) -> float:
+        spec = self.spec
+        if not isinstance(spec, dict):
+            return float(spec)
+        if "min" in spec:
+            return self.rng.uniform(spec["min"], spec["max"])
+        return max(self.rng.gauss(spec["mean"], spec.get("std", 0)), 0.0)
+
+
+_ROUTES = [
+    ("POST", re.compile(r"^/api/v1/dags/~/dagRuns/list$"), "list_dag_runs_bulk"),
+    ("GET", re.compile(r"^/api/v1/dags/(?P<dag_id>[^/]+)$"), "dag"),
+    ("GET", re.compile(r"^/api/v1/dags/(?P<dag_id>[^/]+)/dagRuns$"), "list_dag_runs"),
+    ("POST", re.compile(r"^/api/v1/dags/(?P<dag_id>[^/]+)/dagRuns$"), "post_dag_run"),
+    ("GET", re.compile(r"^/api/v1/dags/(?P<dag_id>[^/]+)/dagRuns/(?P<run>[^/]+)/taskInstances/(?P<task>[^/]+)$"), "task_instance"),
+    ("GET", re.compile(r"^/api/v1/dags/(?P<dag_id>[^/]+)/dagRuns/(?P<run>[^/]+)/taskInstances/(?P<task>[^/]+)/xcomEntries$"), "list_xcoms"),
+    (
+        "GET",
+        re.compile(r"^/api/v1/dags/(?P<dag_id>[^/]+)/dagRuns/(?P<run>[^/]+)/taskInstances/(?P<task>[^/]+)/xcomEntries/(?P<key>[^/]+)$"),
+        "xcom",
+    ),
+]
+
+
+class SimulatedAirflow:
+    def __init__(
+        self,
+        clock: VirtualClock,
+        default_duration: Union[float, dict] = 600,
+        durations: Dict[str, Union[float, dict]] = None,
+        max_active_runs: Dict[str, int] = None,
+        failure_rate: Dict[str, float] = None,
+        xcoms: Dict[str, object] = None,
+        seed: int = 0,
+    ) -> None:
+        """An in-process Airflow serving the REST endpoints used by the scheduler, on a virtual clock.
+
+        A triggered DagRun is queued, runs as soon as the DAG has less than max_active_runs running
+        DagRuns, and ends (success, or failed with probability failure_rate) after a sampled duration.
+        All its task instances share the state and dates of the DagRun.
+
+        Parameters
+        ----------
+        clock : VirtualClock
+            the simulated time
+        default_duration : Union[float, dict], optional
+            the DagRun duration of the DAGs not in `durations`, see DurationModel, by default 600
+        durations : Dict[str, Union[float, dict]], optional
+            dag_id -> DagRun duration, see DurationModel
+        max_active_runs : Dict[str, int], optional
+            dag_id -> the maximum number of running DagRuns, by default unlimited
+        failure_rate : Dict[str, float], optional
+            dag_id -> the probability that a DagRun fails, by default 0
+        xcoms : Dict[str, object], optional
+            "dag_id.task_id.xcom_key" -> the xcom value of the successful DagRuns
+        seed : int, optional
+            seed of the random durations and failures, by default 0
+        """
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.default_duration = DurationModel(default_duration, self.rng)
+        self.durations = {dag_id: DurationModel(spec, self.rng) for dag_id, spec in (durations or {}).items()}
+        self.max_active_runs = max_active_runs or {}
+        self.failure_rate = failure_rate or {}
+        self.xcoms = {tuple(k.rsplit(".", 2)): v for k, v in (xcoms or {}).items()}
+
+        self.dag_runs: Dict[str, List[dict]] = {}
+        self._by_id: Dict[Tuple[str, str], dict] = {}
+        self._queued: Dict[str, List[dict]] = {}
+        self._running: Dict[str, int] = {}
+        self._ends: List[Tuple[float, int, str, str]] = []  # heap of (end time, seq, dag_id, dag_run_id)
+        self._seq = 0
+        self.num_requests: Dict[str, int] = {}
+        self.num_posted = 0
+
+    # ---- the REST API ----
+    async def __call__(self, method: str, url: str, data=None) -> Tuple[int, dict]:
+        path, query = urlsplit(url).path, urlsplit(url).query
+        if method == "GET" and query:
+            data = dict(parse_qsl(query))
+        for route_method, pattern, name in _ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                self.num_requests[name] = self.num_requests.get(name, 0) + 1
+                return getattr(self, name)(data=data, **match.groupdict())
+        return 404, {"title": "Not Found", "detail": f"{method} {path}"}
+
+    def dag(self, dag_id: str, data=None) -> Tuple[int, dict]:
+        return 200, {"dag_id": dag_id, "is_paused": False}
+
+    def list_dag_runs(self, dag_id: str, data=None) -> Tuple[int, dict]:
+        dag_runs = [{k: v for k, v in dr.items() if not k.startswith("_")} for dr in self.dag_runs.get(dag_id, [])]
+        return 200, {"dag_runs": dag_runs, "total_entries": len(dag_runs)}
+
+    def list_dag_runs_bulk(self, data=None) -> Tuple[int, dict]:
+        data = data or {}
+        states = data.get("states")
+        dag_runs = [
+            {k: v for k, v in dr.items() if not k.startswith("_")}
+            for dag_id in data.get("dag_ids", list(self.dag_runs))
+            for dr in self.dag_runs.get(dag_id, [])
+            if not states or dr["state"] in states
+        ]
+        offset, limit = data.get("page_offset", 0), data.get("page_limit", 100)
+        return 200, {"dag_runs": dag_runs[offset:offset + limit], "total_entries": len(dag_runs)}
+
+    def post_dag_run(self, dag_id: str, data=None) -> Tuple[int, dict]:
+        data = data or {}
+        self._seq += 1
+        dag_run_id = data.get("dag_run_id") or f"manual__{self.clock.isoformat()}__{self._seq}"
+        if (dag_id, dag_run_id) in self._by_id:
+            return 409, {"title": "Conflict", "detail": f"DAGRun with DAG ID: '{dag_id}' and DAGRun ID: '{dag_run_id}' already exists"}
+        dag_run = {
+            "dag_id": dag_id,
+            "dag_run_id": dag_run_id,
+            "state": "queued",
+            "conf": copy.deepcopy(data.get("conf", {})),
+            "logical_date": self.clock.isoformat(),
+            "execution_date": self.clock.isoformat(),
+            "start_date": None,
+            "end_date": None,
+            "_queued_at": self.clock.now,
+        }
+        self.dag_runs.setdefault(dag_id, []).append(dag_run)
+        self._by_id[(dag_id, dag_run_id)] = dag_run
+        self._queued.setdefault(dag_id, []).append(dag_run)
+        self.num_posted += 1
+        self._start_queued(dag_id, self.clock.now)
+        return 200, {k: v for k, v in dag_run.items() if not k.startswith("_")}
+
+    def task_instance(self, dag_id: str, run: str, task: str, data=None) -> Tuple[int, dict]:
+        dag_run = self._by_id.get((dag_id, run))
+        if dag_run is None:
+            return 404, {"title": "DAG Run not found"}
+        state = None if dag_run["state"] == "queued" else dag_run["state"]
+        return 200, {
+            "dag_id": dag_id,
+            "dag_run_id": run,
+            "task_id": task,
+            "state": state,
+            "start_date": dag_run["start_date"],
+            "end_date": dag_run["end_date"],
+            "try_number": 1,
+            "map_index": -1,
+        }
+
+    def xcom(self, dag_id: str, run: str, task: str, key: str, data=None) -> Tuple[int, dict]:
+        dag_run = self._by_id.get((dag_id, run))
+        value = self.xcoms.get((dag_id, task, key))
+        if dag_run is None or dag_run["state"] != "success" or value is None:
+            return 404, {"title": "XCom entry not found"}
+        return 200, {"dag_id": dag_id, "dag_run_id": run, "task_id": task, "key": key, "value": str(value)}
+
+    def list_xcoms(self, dag_id: str, run: str, task: str, data=None) -> Tuple[int, dict]:
+        """the entries (without their value) of the successful DagRuns (of `run`, or of all of them if "~"),
+        of the xcom_key of the query if any"""
+        data = data or {}
+        entries = [
+            {
+                "dag_id": dag_id, "dag_run_id": dr["dag_run_id"], "task_id": task, "key": key, "map_index": -1,
+                "execution_date": dr["execution_date"], "timestamp": dr["end_date"],
+            }
+            for (xcom_dag_id, xcom_task, key) in self.xcoms
+            if (xcom_dag_id, xcom_task) == (dag_id, task) and data.get("xcom_key", key) == key
+            for dr in self.dag_runs.get(dag_id, [])
+            if dr["state"] == "success" and run in ("~", dr["dag_run_id"])
+        ]
+        offset, limit = int(data.get("offset", 0)), int(data.get("limit", 100))
+        return 200, {"xcom_entries": entries[offset:offset + limit], "total_entries": len(entries)}
+
+    # ---- the simulated time ----
+    def _start_queued(self, dag_id: str, t: float) -> None:
+        limit = self.max_active_runs.get(dag_id)
+        queued = self._queued.get(dag_id, [])
+        while queued and (limit is None or self._running.get(dag_id, 0) < limit):
+            dag_run = queued.pop(0)
+            start = max(t, dag_run["_queued_at"])
+            dag_run["state"] = "running"
+            dag_run["start_date"] = self.clock.isoformat(start)
+            dag_run["_start"] = start
+            self._running[dag_id] = self._running.get(dag_id, 0) + 1
+            duration = self.durations.get(dag_id, self.default_duration).sample()
+            self._seq += 1
+            heapq.heappush(self._ends, (start + duration, self._seq, dag_id, dag_run["dag_run_id"]))
+
+    def advance(self, now: float) -> int:
+        """end the DagRuns (and start the queued ones) up to `now`, in the order of their end times,
+        returns the number of ended DagRuns"""
+        num_ended = 0
+        while self._ends and self._ends[0][0] <= now:
+            end, _, dag_id, dag_run_id = heapq.heappop(self._ends)
+            dag_run = self._by_id[(dag_id, dag_run_id)]
+            failed = self.rng.random() < self.failure_rate.get(dag_id, 0)
+            dag_run["state"] = "failed" if failed else "success"
+            dag_run["end_date"] = self.clock.isoformat(end)
+            dag_run["_end"] = end
+            self._running[dag_id] -= 1
+            self._start_queued(dag_id, end)
+            num_ended += 1
+        return num_ended
+
+    @property
+    def next_end(self) -> float:
+        return self._ends[0][0] if self._ends else None
+
+    @property
+    def num_pending(self) -> int:
+        return len(self._ends) + sum(len(q) for q in self._queued.values())
+
+
+class Simulation:
+    def __init__(
+        self,
+        batches: List[Batch],
+        airflow: SimulatedAirflow,
+        cycle_interval: float = None,
+        bulk_fetch: bool = False,
+        refresh_policy: RefreshPolicy = None,
+    ) -> None:
+        """Run the watchers of `batches` in a Coordinator against `airflow`, on its virtual clock
+
+        Parameters
+        ----------
+        batches : List[Batch]
+            the batches, created with api_url=SIMULATED_API_URL
+        airflow : SimulatedAirflow
+            the simulated Airflow
+        cycle_interval : float, optional
+            the coordinator cycle interval, by default the smallest watch_interval
+        bulk_fetch : bool, optional
+            see Coordinator, by default False
+        refresh_policy : RefreshPolicy, optional
+            see Coordinator, by default None
+        """
+        self.airflow = airflow
+        self.clock = airflow.clock
+        self.coordinator = Coordinator(cycle_interval=cycle_interval, bulk_fetch=bulk_fetch, refresh_policy=refresh_policy)
+        for batch in batches:
+            self.coordinator.add_batch(batch)
+        self.num_cycles = 0
+
+    async def run(self, max_time: float = 30 * 24 * 3600) -> "SimulationReport":
+        """simulate until nothing is queued or running and no watcher would trigger anymore, or `max_time`
+
+        Between two changes (a trigger or the end of a DagRun), the watchers see the same state, so once
+        every watcher has ticked since the last change without triggering, the clock jumps to the first
+        cycle after the next DagRun ends.
+        """
+        interval = self.coordinator.interval
+        stale = set()  # the watchers that have not seen the last change yet
+        previous_transport = ar._transport
+        ar.set_transport(self.airflow)
+        try:
+            while self.clock.now <= max_time:
+                if self.airflow.advance(self.clock.now) or self.num_cycles == 0:
+                    stale = {id(w) for w in self.coordinator.watchers}
+                num_posted = self.airflow.num_posted
+                ticked = await self.coordinator.run_cycle(now=self.clock.now)
+                self.num_cycles += 1
+                if self.airflow.num_posted != num_posted:
+                    stale = {id(w) for w in self.coordinator.watchers}
+                else:
+                    stale -= {id(w) for w in ticked}
+
+                next_end = self.airflow.next_end
+                if stale:
+                    self.clock.advance(interval)
+                elif next_end is None:
+                    break  # nothing will change anymore
+                else:
+                    self.clock.advance(max(math.ceil((next_end - self.clock.now) / interval), 1) * interval)
+        finally:
+            ar.set_transport(previous_transport)
+        return SimulationReport(self)
+
+
+class SimulationReport:
+    def __init__(self, simulation: Simulation) -> None:
+        """throughput, makespan and per-DAG utilization of a finished simulation"""
+        airflow = simulation.airflow
+        watchers = simulation.coordinator.watchers
+        ends = [dr["_end"] for runs in airflow.dag_runs.values() for dr in runs if "_end" in dr]
+        self.makespan = max(ends, default=0.0)
+        self.num_cycles = simulation.num_cycles
+        self.num_requests = dict(airflow.num_requests)
+
+        capacity = {}
+        for w in watchers:
+            capacity[w.dag_id] = capacity.get(w.dag_id, 0) + getattr(w, "max_running_dag_runs", 0)
+        upstream = set().union(*[w.upstream_dag_ids for w in watchers]) if watchers else set()
+        self.terminal_dag_ids = sorted({w.dag_id for w in watchers} - upstream)
+
+        self.dags = {}
+        for dag_id in sorted(set(capacity) | set(airflow.dag_runs)):
+            runs = airflow.dag_runs.get(dag_id, [])
+            done = [dr for dr in runs if "_end" in dr]
+            started = [dr for dr in runs if "_start" in dr]
+            busy = sum(dr.get("_end", self.makespan) - dr["_start"] for dr in started)
+            concurrency = busy / self.makespan if self.makespan > 0 else 0.0
+            self.dags[dag_id] = {
+                "triggered": len(runs),
+                "success": sum(dr["state"] == "success" for dr in runs),
+                "failed": sum(dr["state"] == "failed" for dr in runs),
+                "mean_wait": sum(dr["_start"] - dr["_queued_at"] for dr in started) / len(started) if started else 0.0,
+                "mean_duration": sum(dr["_end"] - dr["_start"] for dr in done) / len(done) if done else 0.0,
+                "mean_concurrency": concurrency,
+                "utilization": concurrency / capacity[dag_id] if capacity.get(dag_id) else 0.0,
+            }
+        completed = sum(self.dags[d]["success"] for d in self.terminal_dag_ids)
+        self.completed_scenes = completed
+        self.throughput = completed / (self.makespan / 3600) if self.makespan > 0 else 0.0
+
+    def to_text(self) -> str:
+        lines = [
+            f"makespan: {timedelta(seconds=round(self.makespan))} ({self.num_cycles} cycles)",
+            f"throughput: {self.throughput:.1f} scenes/hour ({self.completed_scenes} scenes through {', '.join(self.terminal_dag_ids)})",
+            f"{'dag_id':<32}{'triggered':>10}{'success':>9}{'failed':>8}{'wait(s)':>10}{'run(s)':>10}{'conc':>7}{'util':>7}",
+        ]
+        for dag_id, s in self.dags.items():
+            lines.append(
+                f"{dag_id:<32}{s['triggered']:>10}{s['success']:>9}{s['failed']:>8}{s['mean_wait']:>10.0f}"
+                f"{s['mean_duration']:>10.0f}{s['mean_concurrency']:>7.2f}{s['utilization']:>7.0%}"
+            )
+        lines.append(f"requests: {self.num_requests}")
+        return "\n".join(lines)
+
+
+def override_scene_lists(cfg: dict, num_scenes: int) -> dict:
+    """replace the scene lists of the StaticSceneListSensors with `num_scenes` generated scenes"""
+    cfg = copy.deepcopy(cfg)
+    scene_list = [{"scene_id": f"scene_{i:06d}"} for i in range(num_scenes)]
+    for wc in cfg["watchers"]:
+        for scfg in wc["upstream"]:
+            if scfg["class"].endswith("StaticSceneListSensor"):
+                scfg["args"] = {"scene_list": scene_list}
+    return cfg
+
+
+async def simulate(
+    batch_configs: List[Path], sim_cfg: dict = None, num_scenes: int = None, cycle_interval: float = None,
+    max_time: float = 30 * 24 * 3600, seed: int = 0, bulk_fetch: bool = False, refresh_policy: RefreshPolicy = None,
+) -> SimulationReport:
+    sim_cfg = dict(sim_cfg or {})
+    airflow = SimulatedAirflow(VirtualClock(), seed=sim_cfg.pop("seed", seed), **sim_cfg)
+    batches = []
+    for path in batch_configs:
+        cfg = load_batch_config(path)
+        if num_scenes is not None:
+            cfg = override_scene_lists(cfg, num_scenes)
+        batches.append(Batch(Path(path).stem, cfg, SIMULATED_API_URL, {}))
+    simulation = Simulation(batches, airflow, cycle_interval=cycle_interval, bulk_fetch=bulk_fetch, refresh_policy=refresh_policy)
+    return await simulation.run(max_time=max_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="simulate batch configs against a simulated Airflow")
+    parser.add_argument("batch_config", type=Path, nargs="+", help="path to batch config file(s)")
+    parser.add_argument("--sim-config", type=Path, default=None, help="durations etc. of the simulated Airflow, see the module doc")
+    parser.add_argument("--scenes", type=int, default=None, help="replace the static scene lists with this number of scenes")
+    parser.add_argument("--cycle-interval", type=float, default=None, help="by default the smallest watch_interval")
+    parser.add_argument("--max-time", type=float, default=30 * 24 * 3600, help="simulated time limit (in seconds)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bulk-fetch", action="store_true", help="see --bulk-fetch of main.py")
+    parser.add_argument("--refresh-policy", nargs="*", default=None, metavar="KEY=SECONDS", help="see --refresh-policy of main.py")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    setup_logging(args.log_level, enqueue=False)
+    sim_cfg = {}
+    if args.sim_config:
+        with open(args.sim_config) as f:
+            sim_cfg = yaml.safe_load(f)
+    report = asyncio.run(
+        simulate(
+            args.batch_config, sim_cfg, args.scenes, args.cycle_interval, args.max_time, args.seed, args.bulk_fetch,
+            RefreshPolicy.parse(args.refresh_policy) if args.refresh_policy is not None else None,
+        )
+    )
+    print(report.to_text())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
-from typing import Any, List
+from typing import Any, Awaitable, Callable, Hashable, List, Set
 import importlib
 
+from .fetch_plan import FetchPlan
+
 
 class UpstreamSensor:
+    fetch_plan: FetchPlan = None  # the FetchPlan of the watcher, set by `create_sensor`
+
     async def sense(self, state: str = None) -> Any:
         """sense the state of the upstream
 
@@ -27,12 +31,30 @@ class UpstreamSensor:
     def query_key_values(self) -> List[str]:
         raise NotImplementedError
 
+    @property
+    def upstream_dag_ids(self) -> Set[str]:
+        """the dag_ids whose DagRuns are read by the sensor"""
+        dag_id = getattr(self, "dag_id", None)
+        return {dag_id} if dag_id is not None else set()
+
+    def planned_fetches(self) -> List[Hashable]:
+        """the keys of the fetches made by `sense`, see FetchPlan"""
+        return []
+
+    async def fetch(self, key: Hashable, fetch: Callable[[], Awaitable]):
+        """`await fetch()` through the FetchPlan of the watcher (if any), which shares it with the other sensors"""
+        if self.fetch_plan is None:
+            return await fetch()
+        return await self.fetch_plan.fetch(key, fetch)
+
     def __repr__(self) -> str:
         return str(self.query_key_values)
 
 
-def create_sensor(api_url, batch_id, cookies, scfg) -> UpstreamSensor:
+def create_sensor(api_url, batch_id, cookies, scfg, fetch_plan: FetchPlan = None) -> UpstreamSensor:
     module, cls = scfg.pop("class").rsplit(".", 1)
     sensor_cls = getattr(importlib.import_module(module), cls)
     sensor = sensor_cls(api_url, batch_id, cookies, **scfg["args"])
+    if fetch_plan is not None:
+        fetch_plan.add(sensor)
     return sensor
@@ -1,4 +1,5 @@
-from typing import List
+from functools import partial
+from typing import Hashable, List
 
 import pandas as pd
 from pandas.core.api import DataFrame as DataFrame
@@ -42,9 +43,13 @@ class DagSensor(UpstreamSensor):
         self.dag_id = dag_id
         self.cookies = cookies
 
+    def planned_fetches(self) -> List[Hashable]:
+        return [("dag_runs", self.dag_id)]
+
     async def sense(self, state: str = None) -> pd.DataFrame:
-        dag_run_df = await get_dag_runs(
-            self.api_url, self.batch_id, self.dag_id, self.cookies, to_dataframe=True, flatten_conf=True
+        dag_run_df = await self.fetch(
+            ("dag_runs", self.dag_id),
+            partial(get_dag_runs, self.api_url, self.batch_id, self.dag_id, self.cookies, to_dataframe=True, flatten_conf=True),
         )
 
         if len(dag_run_df) == 0:
@@ -1,7 +1,9 @@
-from typing import List
+from functools import partial
+from typing import Hashable, List, Set
 
 import pandas as pd
 
+from ..helpers.compute import run_compute
 from .xcom_query import XComQuery
 
 
@@ -25,6 +27,13 @@ class Expandable:
         self.expand_by = XComQuery(**expand_by)
         assert 'base_scene_id_keys' in kwargs, "base_scene_id_keys should be provided for Expandable"
 
+    @property
+    def upstream_dag_ids(self) -> Set[str]:
+        return super().upstream_dag_ids | {self.expand_by.dag_id}
+
+    def planned_fetches(self) -> List[Hashable]:
+        return super().planned_fetches() + self.expand_by.planned_fetches(self.base_scene_id_keys, state="success")
+
     async def sense(self, state: str = None) -> pd.DataFrame:
         raw_df = await super().sense(state=state)
         expanded_df = await self.expand(raw_df)
@@ -32,11 +41,21 @@ class Expandable:
 
     async def expand(self, df: pd.DataFrame) -> List[dict]:
         """The expansion will based on the same batch_id and scene_id_keys, expand the dag_run by the xcom values"""
-        xcom_expanded_df = await self.expand_by.query(self.api_url, self.batch_id, self.cookies, state="success", base_scene_id_keys=self.base_scene_id_keys)
+        xcom_expanded_df = await self.fetch(
+            self.expand_by.fetch_key(self.base_scene_id_keys, state="success"),
+            partial(
+                self.expand_by.query, self.api_url, self.batch_id, self.cookies, state="success",
+                base_scene_id_keys=self.base_scene_id_keys, fetch_plan=self.fetch_plan,
+            ),
+        )
         
         if len(xcom_expanded_df) == 0:
             return pd.DataFrame([])
         
-        merged_df = pd.merge(df, xcom_expanded_df, how="inner", on=self.base_scene_id_keys).reset_index(drop=True)
-        # merged_df.loc[:, self.expand_by.refer_name] = merged_df[self.expand_by.refer_name].astype("object")
-        return merged_df
+        return await run_compute(expand_dataframe, df, xcom_expanded_df, self.base_scene_id_keys)
+
+
+def expand_dataframe(df: pd.DataFrame, xcom_expanded_df: pd.DataFrame, base_scene_id_keys: List[str]) -> pd.DataFrame:
+    """Expand each record in `df` to the records in `xcom_expanded_df` sharing the same `base_scene_id_keys`"""
+    merged_df = pd.merge(df, xcom_expanded_df, how="inner", on=base_scene_id_keys).reset_index(drop=True)
+    return merged_df
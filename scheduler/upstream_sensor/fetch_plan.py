@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Hashable, List
+import asyncio
+
+from loguru import logger
+
+
+class FetchPlan:
+    def __init__(self, name: str = None) -> None:
+        """The fetches of the upstream sensors of one watcher, compiled when the sensors are created (`add`).
+
+        Each sensor declares the fetches its `sense` makes (`UpstreamSensor.planned_fetches`), e.g. the DagRuns
+        of a DAG, the TaskInstances of a task or the XCom values of an XComQuery. The fetches declared by more
+        than one sensor are issued once per tick (`tick`) and their result is shared, so a DagSensor and a
+        TaskSensor on the same DAG, or an Expandable sensor whose XComQuery reads an upstream DAG, read the
+        DagRuns once, and each of them only projects the shared result.
+
+        The shared results must not be modified in place.
+
+        Parameters
+        ----------
+        name : str, optional
+            used in the logs
+        """
+        self.name = name
+        self.sensors: List[object] = []
+        self.fetches: Dict[Hashable, int] = {}  # fetch key -> number of sensors declaring it
+        self.num_fetches = 0
+        self.num_shared = 0
+        self._results: Dict[Hashable, asyncio.Future] = None
+
+    def add(self, sensor) -> None:
+        sensor.fetch_plan = self
+        self.sensors.append(sensor)
+        for key in set(sensor.planned_fetches()):
+            self.fetches[key] = self.fetches.get(key, 0) + 1
+
+    def compile(self, sensors: List[object]) -> None:
+        """(re)build the plan of `sensors`, e.g. after a reload of the batch config"""
+        self.sensors, self.fetches = [], {}
+        for sensor in sensors:
+            self.add(sensor)
+        shared = {k: n for k, n in self.fetches.items() if n > 1}
+        if shared:
+            logger.debug(f"[FetchPlan {self.name}] shared fetches: {shared}")
+
+    @property
+    def shared_fetches(self) -> List[Hashable]:
+        return [k for k, n in self.fetches.items() if n > 1]
+
+    @contextmanager
+    def tick(self):
+        """Within the context, the shared fetches are issued at most once. The shared fetches still pending
+        when the context exits (the tick was cancelled) are cancelled."""
+        self._results = results = {}
+        try:
+            yield self
+        finally:
+            self._results = None
+            for future in results.values():
+                future.cancel()
+
+    async def fetch(self, key: Hashable, fetch: Callable[[], Awaitable]):
+        """`await fetch()`, or the result of the same fetch in this tick if another sensor declared it too.
+        A failed fetch is not shared, the next sensor retries it."""
+        if self._results is None or self.fetches.get(key, 0) < 2:
+            self.num_fetches += 1
+            return await fetch()
+        results = self._results
+        future = results.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fetch())
+            results[key] = future
+            self.num_fetches += 1
+        else:
+            self.num_shared += 1
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            if results.get(key) is future:
+                del results[key]
+            raise
@@ -1,7 +1,10 @@
-from typing import List
+from functools import partial
+from typing import Hashable, List, Set
 
+import numpy as np
 import pandas as pd
 
+from ..helpers.compute import run_compute
 from .xcom_query import XComQuery
 
 
@@ -25,6 +28,13 @@ class Reducible:
         self.reduce_by = XComQuery(**reduce_by)
         assert 'base_scene_id_keys' in kwargs, "base_scene_id_keys should be provided for Expandable"
 
+    @property
+    def upstream_dag_ids(self) -> Set[str]:
+        return super().upstream_dag_ids | {self.reduce_by.dag_id}
+
+    def planned_fetches(self) -> List[Hashable]:
+        return super().planned_fetches() + self.reduce_by.planned_fetches(self.base_scene_id_keys, state="success")
+
     async def sense(self, state: str = None) -> pd.DataFrame:
         raw_df = await super().sense(state=state)
         expanded_df = await self.reduce(raw_df)
@@ -32,22 +42,63 @@ class Reducible:
 
     async def reduce(self, df: pd.DataFrame) -> List[dict]:
         """The reduction will based on the same batch_id and scene_id_keys"""
-        xcom_expanded_df = await self.reduce_by.query(self.api_url, self.batch_id, self.cookies, state="success", base_scene_id_keys=self.base_scene_id_keys)
+        xcom_expanded_df = await self.fetch(
+            self.reduce_by.fetch_key(self.base_scene_id_keys, state="success"),
+            partial(
+                self.reduce_by.query, self.api_url, self.batch_id, self.cookies, state="success",
+                base_scene_id_keys=self.base_scene_id_keys, fetch_plan=self.fetch_plan,
+            ),
+        )
         
         if len(xcom_expanded_df) == 0:
             return pd.DataFrame([])
         
-        full_scene_id_keys = self.base_scene_id_keys + [self.reduce_by.refer_name]
-        _scene_id_keys = self.base_scene_id_keys[0] if len(self.base_scene_id_keys) == 1 else self.base_scene_id_keys # to prevent pandas warning
-        merged_df = pd.merge(df, xcom_expanded_df, how="outer", on=full_scene_id_keys)
-        # merged_df.loc[:, self.reduce_by.refer_name] = xcom_expanded_df[self.reduce_by.refer_name]
-
-        # critical_columns = ["batch_id", "dag_id", "task_id"]
-        # critical_columns = set(critical_columns) & set(df.columns)
-        other_columns = [c for c in merged_df.columns if c not in full_scene_id_keys + ['state', 'conf']]
-        reduced_df = merged_df.groupby(_scene_id_keys).agg({
-            **{col: lambda x: list(s)[0] if len(s:=set(x)) == 1 else s for col in other_columns},
-            'state': lambda x: 'success' if all(s == 'success' for s in x) else 'failed'
-        }).reset_index()
-        
-        return reduced_df
+        return await run_compute(
+            reduce_dataframe, df, xcom_expanded_df, self.base_scene_id_keys, self.reduce_by.refer_name
+        )
+
+
+def _reduce_values(x: list):
+    """the single value if all the values of the group are identical, otherwise the set of values"""
+    return list(s)[0] if len(s:=set(x)) == 1 else s
+
+
+def reduce_dataframe(df: pd.DataFrame, xcom_expanded_df: pd.DataFrame, base_scene_id_keys: List[str], refer_name: str) -> pd.DataFrame:
+    """Reduce the expanded records in `df` back to `base_scene_id_keys`, the reduced state is success
+    only when all the expanded records (given by `xcom_expanded_df`) are success.
+
+    For every other column, a group with a single distinct value is reduced to that value, otherwise
+    to the set of its values. Most groups are single-valued, so they are reduced with vectorized
+    groupby ops and only the remaining groups fall back to building python sets.
+    """
+    full_scene_id_keys = base_scene_id_keys + [refer_name]
+    _scene_id_keys = base_scene_id_keys[0] if len(base_scene_id_keys) == 1 else base_scene_id_keys # to prevent pandas warning
+    merged_df = pd.merge(df, xcom_expanded_df, how="outer", on=full_scene_id_keys)
+
+    other_columns = [c for c in merged_df.columns if c not in full_scene_id_keys + ['state', 'conf']]
+    grouped = merged_df.groupby(_scene_id_keys)
+    reduced_df = grouped[other_columns].first()
+
+    # `first` skips NaN and set() treats NaN/None objects as distinct values, so the groups having more
+    # than one distinct value or having any NaN are reduced with python sets as before.
+    has_nan = merged_df[other_columns].isna().groupby([merged_df[k] for k in base_scene_id_keys]).any()
+    needs_set = grouped[other_columns].nunique(dropna=False).ne(1) | has_nan
+    if needs_set.values.any():
+        group_pos = grouped.ngroup().to_numpy()  # the position of each row's group in reduced_df, -1 for NaN keys
+        for col in needs_set.columns[needs_set.any()]:
+            rows = np.flatnonzero(needs_set[col].to_numpy()[group_pos] & (group_pos >= 0))
+            rows = rows[np.argsort(group_pos[rows], kind="stable")]
+            pos = group_pos[rows]
+            col_values = merged_df[col].iloc[rows].tolist()
+            bounds = np.flatnonzero(np.diff(pos)) + 1
+            values = reduced_df[col].to_numpy(dtype=object, copy=True)
+            for start, end in zip([0, *bounds], [*bounds, len(rows)]):
+                values[pos[start]] = _reduce_values(col_values[start:end])
+            # the dtype is inferred from the reduced values like the pure python groupby aggregation does, e.g.
+            # numeric columns stay numeric if no set is produced, and an all-null column (None / NaN) is float64
+            reduced_df[col] = pd.Series(values, index=reduced_df.index).infer_objects()
+
+    is_success = merged_df['state'].eq('success').groupby([merged_df[k] for k in base_scene_id_keys]).all()
+    reduced_df['state'] = np.where(is_success.to_numpy(), 'success', 'failed').astype(object)
+
+    return reduced_df.reset_index()
@@ -1,13 +1,76 @@
-from typing import List
+from pathlib import Path
+from typing import Dict, List
+import os
 
 import pandas as pd
+from loguru import logger
 
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, only needed to load parquet scene lists
+    pq = None
+
+from ..helpers.compute import run_compute
+from ..helpers.done_set import get_done_set
+from ..helpers.memory import compact_dtypes, intern_scene_keys
 from .base import UpstreamSensor
 
 
+SCENE_LIST_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".parquet": "parquet", ".pq": "parquet"}
+PARQUET_REQUIRES_PYARROW = "pyarrow is required to load parquet scene lists (pip install pyarrow)"
+SCENE_LIST_DTYPES = {"int": "int64", "float": "float64", "str": "object", "bool": "bool"}
+
+
+def load_scene_list(path: str, fmt: str, dtypes: Dict[str, str] = None, chunksize: int = 100000) -> pd.DataFrame:
+    """Load a scene list file, each row (record) is a scene, e.g. {"scene_id": "20231102_1213"}. The dtypes are not
+    guessed from the values: the CSV columns are strings (like the scene_id values of the DagRun confs, so "000123"
+    stays "000123"), the JSONL and Parquet ones keep the types of the file, unless given in `dtypes`.
+
+    Parameters
+    ----------
+    path : str
+        path to the scene list file
+    fmt : str
+        Valid choices: ["csv", "jsonl", "parquet"]
+    dtypes : Dict[str, str], optional
+        column -> "str", "int", "float" or "bool", by default None
+    chunksize : int, optional
+        number of rows parsed at a time for the text formats, by default 100000
+
+    Returns
+    -------
+    pd.DataFrame
+        the scene list
+    """
+    if fmt == "csv":
+        chunks = pd.read_csv(path, memory_map=True, dtype=str, chunksize=chunksize)
+    elif fmt == "jsonl":
+        chunks = pd.read_json(path, lines=True, dtype=False, convert_dates=False, chunksize=chunksize)
+    elif fmt == "parquet":
+        if pq is None:
+            raise ImportError(PARQUET_REQUIRES_PYARROW)
+        chunks = [pq.read_table(path, memory_map=True).to_pandas()]
+    else:
+        raise ValueError(f"unsupported scene list format: {fmt}")
+    chunks = list(chunks)
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame([])
+    if dtypes:
+        df = df.astype({k: SCENE_LIST_DTYPES[v] for k, v in dtypes.items() if k in df.columns})
+    return df
+
+
 class StaticSceneListSensor(UpstreamSensor):
-    def __init__(self, api_url: str, batch_id: str, cookies: dict, scene_list: List[dict] = None) -> None:
-        """_summary_
+    def __init__(
+        self,
+        api_url: str,
+        batch_id: str,
+        cookies: dict,
+        scene_list: List[dict] = None,
+        scene_list_path: str = None,
+        scene_list_format: str = None,
+        scene_list_dtypes: Dict[str, str] = None,
+    ) -> None:
+        """A sensor of a predefined scene list, every scene of the list is considered success.
 
         Parameters
         ----------
@@ -15,18 +78,78 @@ class StaticSceneListSensor(UpstreamSensor):
             the batch_id that is interested about, for example "baidu_integration_test"
         scene_list : List[dict]
             predefined scene list
+        scene_list_path : str
+            path to a CSV, JSONL or Parquet file of the scene list, used instead of `scene_list`.
+            The file is loaded once and reloaded only when it changes. Parquet requires pyarrow.
+        scene_list_format : str, optional
+            Valid choices: ["csv", "jsonl", "parquet"], by default inferred from the suffix of `scene_list_path`
+        scene_list_dtypes : Dict[str, str], optional
+            the dtypes ("str", "int", "float" or "bool") of the columns of `scene_list_path` that should match non-string
+            values of the DagRun confs, e.g. {"split_id": "int"}. By default the CSV columns are strings, and the JSONL
+            and Parquet ones keep the types of the file.
         """
         super().__init__()
+        assert (scene_list is None) != (scene_list_path is None), "exactly one of scene_list and scene_list_path should be provided"
         self.api_url = api_url
         self.batch_id = batch_id
         self.scene_list = scene_list
+        self.scene_list_path = scene_list_path
+        if scene_list_path is not None:
+            scene_list_format = scene_list_format or SCENE_LIST_FORMATS.get(Path(scene_list_path).suffix.lower())
+            assert scene_list_format in ["csv", "jsonl", "parquet"], f"can not decide the format of {scene_list_path}"
+            assert scene_list_format != "parquet" or pq is not None, PARQUET_REQUIRES_PYARROW
+        self.scene_list_format = scene_list_format
+        assert all(v in SCENE_LIST_DTYPES for v in (scene_list_dtypes or {}).values()), \
+            f"scene_list_dtypes should be in {list(SCENE_LIST_DTYPES)}"
+        self.scene_list_dtypes = scene_list_dtypes
 
-    async def sense(self, state: str = None) -> pd.DataFrame:
-        scene_list_df = pd.DataFrame.from_records(self.scene_list)
+        self._scene_list_df = None
+        self._file_signature = None
+        self.scene_keys = frozenset()
+        self._pending = (None, None, None)  # (scene list, DoneSet version, the scenes of the list that are not done)
+
+    def _build(self, scene_list_df: pd.DataFrame) -> None:
+        scene_id_keys = list(scene_list_df.columns)
         scene_list_df.loc[:, "batch_id"] = self.batch_id
         scene_list_df.loc[:, "state"] = "success"
-        if state:
-            scene_list_df = scene_list_df[scene_list_df.state == state].reset_index(drop=True)
+        self._scene_list_df = compact_dtypes(scene_list_df)
+        self.scene_keys = frozenset(intern_scene_keys(scene_list_df, scene_id_keys)) if scene_id_keys else frozenset()
+
+    async def load(self) -> pd.DataFrame:
+        """Build the scene list DataFrame on the first call, and reload the file only when its mtime or size changes.
+        The returned DataFrame is shared between calls, so it must not be modified.
+        """
+        if self.scene_list_path is None:
+            if self._scene_list_df is None:
+                self._build(pd.DataFrame.from_records(self.scene_list))
+            return self._scene_list_df
+
+        stat = os.stat(self.scene_list_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature != self._file_signature:
+            scene_list_df = await run_compute(
+                load_scene_list, self.scene_list_path, self.scene_list_format, self.scene_list_dtypes
+            )
+            self._build(scene_list_df)
+            self._file_signature = signature
+            logger.info(f"[StaticSceneListSensor] Loaded {len(scene_list_df)} scenes from {self.scene_list_path}")
+        return self._scene_list_df
+
+    async def sense(self, state: str = None) -> pd.DataFrame:
+        """The scenes of the list that are not done. The DataFrame is shared between the ticks (not copied), so the
+        callers must not modify it."""
+        scene_list_df = await self.load()
+        done_set = get_done_set(self.batch_id)
+        if done_set is not None:
+            # filtered again only when the list is reloaded or more scenes are done. A set lookup per scene, run
+            # inline rather than sending the DoneSet to the compute executor
+            source, version, pending = self._pending
+            if source is not scene_list_df or version != done_set.version:
+                pending = done_set.drop_done_df(scene_list_df)
+                self._pending = (scene_list_df, done_set.version, pending)
+            scene_list_df = pending
+        if state and state != "success":
+            scene_list_df = scene_list_df.iloc[:0]
         return scene_list_df
 
     @property
@@ -1,8 +1,10 @@
-from typing import List
+from functools import partial
+from typing import Hashable, List
 
 import pandas as pd
 
 from ..helpers.airflow_api import get_dag_runs, get_task_instance
+from ..helpers.memory import compact_dtypes
 from .base import UpstreamSensor
 from .expandable import Expandable
 from .reducible import Reducible
@@ -37,20 +39,21 @@ class TaskSensor(UpstreamSensor):
         self.task_id = task_id
         self.cookies = cookies
 
+    def planned_fetches(self) -> List[Hashable]:
+        return [("dag_runs", self.dag_id), ("task_instances", self.dag_id, self.task_id)]
+
     async def sense(self, state: str = None) -> pd.DataFrame:
-        dag_run_df = await get_dag_runs(self.api_url, self.batch_id, self.dag_id, self.cookies, to_dataframe=True, flatten_conf=True)
+        dag_run_df = await self.fetch(
+            ("dag_runs", self.dag_id),
+            partial(get_dag_runs, self.api_url, self.batch_id, self.dag_id, self.cookies, to_dataframe=True, flatten_conf=True),
+        )
 
         if len(dag_run_df) == 0:
             return pd.DataFrame([])
 
-        task_instances = []
-        for dag_run_id in dag_run_df["dag_run_id"]:
-            task_instances.append(
-                await get_task_instance(
-                    self.api_url, self.dag_id, dag_run_id, self.task_id, self.cookies, to_dataframe=True
-                )
-            )
-        task_instance_df = pd.concat(task_instances).reset_index(drop=True)
+        task_instance_df = await self.fetch(
+            ("task_instances", self.dag_id, self.task_id), partial(self.get_task_instances, dag_run_df["dag_run_id"].tolist())
+        )
 
         assert len(dag_run_df) == len(task_instance_df), "#taskInstances should match #dagRuns"
 
@@ -58,12 +61,25 @@ class TaskSensor(UpstreamSensor):
         if state is not None:
             status_df = status_df[status_df.task_instance_state == state].reset_index(drop=True)
         status_df.loc[:, "state"] = status_df.task_instance_state
+        if "end_date_y" in status_df:
+            # the completion time of the upstream is the one of the task, not of the whole DagRun
+            status_df.loc[:, "end_date"] = status_df.end_date_y
         # status_df.loc[:, "state"] = status_df.apply(
         #     lambda x: x.dag_run_state if pd.isnull(x.task_instance_state) else x.task_instance_state, axis=1
         # )
 
         return status_df
 
+    async def get_task_instances(self, dag_run_ids: List[str]) -> pd.DataFrame:
+        task_instances = []
+        for dag_run_id in dag_run_ids:
+            task_instances.append(
+                await get_task_instance(
+                    self.api_url, self.dag_id, dag_run_id, self.task_id, self.cookies, to_dataframe=True
+                )
+            )
+        return compact_dtypes(pd.concat(task_instances).reset_index(drop=True))
+
     @property
     def query_key_values(self) -> list[str]:
         return {"batch_id": self.batch_id, "dag_id": self.dag_id, "task_id": self.task_id}
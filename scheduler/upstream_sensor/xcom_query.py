@@ -1,11 +1,13 @@
-from typing import List
+from functools import partial
+from typing import Hashable, List
 from dataclasses import dataclass
 
 import pandas as pd
 
-from ..helpers.airflow_api import get_dag_runs, get_xcom
-from ..helpers.base import extract_values
-from ..helpers.aiohttp_requests import Non200Response
+from ..helpers.airflow_api import get_dag_runs, get_xcoms
+from ..helpers.base import extract_values_batch
+from ..helpers.compute import run_compute
+from .fetch_plan import FetchPlan
 
 
 @dataclass
@@ -15,42 +17,67 @@ class XComQuery:
     xcom_key: str
     refer_name: str
 
-    async def query(self, api_url: str, batch_id: str, cookies: dict, base_scene_id_keys: List[str] = None, state: str = None) -> pd.DataFrame:
-        expand_dag_run_df = await get_dag_runs(
-            api_url, batch_id, self.dag_id, cookies, to_dataframe=True, flatten_conf=True
-        )
+    def planned_fetches(self, base_scene_id_keys: List[str] = None, state: str = None) -> List[Hashable]:
+        """the fetches of `query`, see FetchPlan"""
+        return [("dag_runs", self.dag_id), self.fetch_key(base_scene_id_keys, state)]
+
+    def fetch_key(self, base_scene_id_keys: List[str] = None, state: str = None) -> Hashable:
+        return ("xcoms", self.dag_id, self.task_id, self.xcom_key, self.refer_name, tuple(base_scene_id_keys or ()), state)
+
+    async def query(
+        self, api_url: str, batch_id: str, cookies: dict, base_scene_id_keys: List[str] = None, state: str = None,
+        fetch_plan: FetchPlan = None,
+    ) -> pd.DataFrame:
+        fetch_dag_runs = partial(get_dag_runs, api_url, batch_id, self.dag_id, cookies, to_dataframe=True, flatten_conf=True)
+        if fetch_plan is None:
+            expand_dag_run_df = await fetch_dag_runs()
+        else:
+            expand_dag_run_df = await fetch_plan.fetch(("dag_runs", self.dag_id), fetch_dag_runs)
 
         if len(expand_dag_run_df) == 0:
             return pd.DataFrame([])
 
-        xcom_values_list = []
-        valid_index = []
-        for idx, row in expand_dag_run_df.iterrows():
-            try:
-                xcom = await get_xcom(
-                    api_url,
-                    row.dag_id,
-                    row.dag_run_id,
-                    self.task_id,
-                    cookies,
-                    xcom_key=self.xcom_key,
-                    to_dataframe=False,
-                )
-            except Non200Response as e:
-                continue
-            assert len(xcom) == 1
-            xcom_values = extract_values(xcom[0]["value"])
-            xcom_values_list.append(xcom_values)
-            valid_index.append(idx)
-
-        expand_dag_run_df = expand_dag_run_df.loc[valid_index, :]
-        expand_dag_run_df.loc[:, self.refer_name] = xcom_values_list
-        expand_dag_run_df = expand_dag_run_df.explode(self.refer_name, ignore_index=True)
-        expand_dag_run_df.drop(expand_dag_run_df[expand_dag_run_df[self.refer_name].isnull()].index, inplace=True)
-
-        if state is not None:
-            expand_dag_run_df = expand_dag_run_df[expand_dag_run_df.dag_run_state == state].reset_index(drop=True)
+        # the xcom values of all the DagRuns in one bulk request, the DagRuns without the xcom are skipped
+        run_columns = [c for c in ("dag_run_id", "execution_date", "logical_date", "end_date") if c in expand_dag_run_df.columns]
+        dag_runs = expand_dag_run_df[run_columns].assign(state=expand_dag_run_df.dag_run_state, batch_id=batch_id)
+        xcoms = await get_xcoms(
+            api_url,
+            self.dag_id,
+            dag_runs.to_dict("records"),
+            self.task_id,
+            cookies,
+            xcom_key=self.xcom_key,
+        )
+        valid_index, raw_values = [], []
+        for idx, dag_run_id in zip(expand_dag_run_df.index, expand_dag_run_df.dag_run_id):
+            if dag_run_id in xcoms:
+                valid_index.append(idx)
+                raw_values.append(xcoms[dag_run_id])
 
         output_columns = base_scene_id_keys + [self.refer_name]
 
-        return expand_dag_run_df[output_columns]
+        return await run_compute(
+            explode_xcom_values, expand_dag_run_df, valid_index, raw_values, self.refer_name, output_columns, state
+        )
+
+
+def explode_xcom_values(
+    expand_dag_run_df: pd.DataFrame,
+    valid_index: List[int],
+    raw_values: List[str],
+    refer_name: str,
+    output_columns: List[str],
+    state: str = None,
+) -> pd.DataFrame:
+    """Parse the xcom values of the valid DagRuns (in one batch), attach them as column `refer_name` and
+    explode it into one row per value"""
+    xcom_values_list = extract_values_batch(raw_values)
+    expand_dag_run_df = expand_dag_run_df.loc[valid_index, :]
+    expand_dag_run_df.loc[:, refer_name] = xcom_values_list
+    expand_dag_run_df = expand_dag_run_df.explode(refer_name, ignore_index=True)
+    expand_dag_run_df.drop(expand_dag_run_df[expand_dag_run_df[refer_name].isnull()].index, inplace=True)
+
+    if state is not None:
+        expand_dag_run_df = expand_dag_run_df[expand_dag_run_df.dag_run_state == state].reset_index(drop=True)
+
+    return expand_dag_run_df[output_columns]
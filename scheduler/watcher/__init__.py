@@ -1,2 +1,3 @@
 from .base import BaseWatcher, WatchResult
-from .restapi_watcher import RestAPIWatcher
\ No newline at end of file
+from .restapi_watcher import RestAPIWatcher
+from .coordinator import Coordinator
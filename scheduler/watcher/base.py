@@ -1,23 +1,29 @@
-from typing import Any
+from typing import Any, List, Set
 import asyncio
 import importlib
-import traceback
+import math
+import random
+import zlib
 
 from loguru import logger
 
 from ..upstream_sensor.base import create_sensor
+from ..upstream_sensor.fetch_plan import FetchPlan
 
 
 class WatchResult:
     def __init__(self) -> None:
         self.action = "unset"
         self.context = {}
+        self.contexts = []  # when more than one scene is triggered in a watch, `context` is the first one
 
     # def __setattr__(self, __name: str, __value: Any) -> None:
-    #     if __name == "action" and __value not in ["trigger", "unset", "error", "watch"]:
+    #     if __name == "action" and __value not in ["trigger", "unset", "error", "watch", "timeout"]:
     #         raise ValueError("Invalid action")
     
     def __repr__(self) -> str:
+        if len(self.contexts) > 1:
+            return f"WatchResult(action={self.action}, contexts={self.contexts})"
         return f"WatchResult(action={self.action}, context={self.context})"
 
 
@@ -30,22 +36,132 @@ class BaseWatcher:
             time interval (in seconds) between each watch, by default 10
         """
         self.watch_interval = watch_interval
+        # the schedule of `run`, see `set_schedule`
+        self.phase: float = None
+        self.jitter = 0.0
+        self.fixed_rate = False
+        # see `set_deadline`
+        self.tick_deadline: float = None
+        self.skip_stale = False
+        self.num_ticks = 0
+        self.num_timeouts = 0
+        self.num_overruns = 0
+        self.num_skipped = 0
+        self.last_tick_duration = 0.0
+        self.max_tick_duration = 0.0
+
+    def set_schedule(self, phase: float = None, jitter: float = 0.0, fixed_rate: bool = False) -> None:
+        """
+        Parameters
+        ----------
+        phase : float, optional
+            time (in seconds) before the first watch, within [0, watch_interval), so that the watchers sharing
+            the same watch_interval do not all hit Airflow at the same moment (see `stagger_phases`),
+            by default None (one watch_interval)
+        jitter : float, optional
+            each watch is delayed by a random time in [0, jitter) seconds, by default 0
+        fixed_rate : bool, optional
+            if True, the watches start every watch_interval (the duration of the watch is accounted for,
+            and a watch that overruns its slot skips the missed ones), otherwise each watch starts
+            watch_interval after the end of the previous one, by default False
+        """
+        assert phase is None or phase >= 0, "phase should be non-negative"
+        assert jitter >= 0, "jitter should be non-negative"
+        self.phase = phase
+        self.jitter = jitter
+        self.fixed_rate = fixed_rate
+
+    def set_deadline(self, deadline: float = None, skip_stale: bool = False) -> None:
+        """
+        Parameters
+        ----------
+        deadline : float, optional
+            time (in seconds) after which a watch is cancelled, with its outstanding sensor requests, and nothing is
+            triggered from it (its decisions would be based on stale data), by default None (no deadline)
+        skip_stale : bool, optional
+            if True, a watch that starts more than one watch_interval after its slot (the event loop or the previous
+            watch fell behind) is skipped, so the watcher catches up with its cadence, by default False
+        """
+        assert deadline is None or deadline > 0, "deadline should be positive"
+        self.tick_deadline = deadline
+        self.skip_stale = skip_stale
+
+    def tick_stats(self) -> dict:
+        """the number of ticks, of ticks cancelled at their deadline, of ticks longer than watch_interval and of
+        skipped stale ticks, and the last / max tick durations"""
+        return {
+            "ticks": self.num_ticks,
+            "timeouts": self.num_timeouts,
+            "overruns": self.num_overruns,
+            "skipped": self.num_skipped,
+            "last_duration": round(self.last_tick_duration, 3),
+            "max_duration": round(self.max_tick_duration, 3),
+        }
+
+    def next_start(self, previous: float, now: float) -> float:
+        """the (loop) time of the next watch, `previous` being the scheduled start of the last one"""
+        if not self.fixed_rate:
+            return now + self.watch_interval
+        missed = max(math.ceil((now - previous) / self.watch_interval), 1)
+        return previous + missed * self.watch_interval
 
     async def run(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time() + (self.watch_interval if self.phase is None else self.phase)
         while True:
-            # sleep for some time
-            await asyncio.sleep(self.watch_interval)
+            # sleep until the next slot, the jitter does not shift the slots
+            delay = start - loop.time()
+            if self.jitter > 0:
+                delay += random.uniform(0, self.jitter)
+            await asyncio.sleep(max(delay, 0))
+            if self.skip_stale and loop.time() - start >= self.watch_interval + self.jitter:
+                self.num_skipped += 1
+                logger.warning(f"[Watcher {getattr(self, 'dag_id', None)}] skipped a stale tick, {loop.time() - start:.1f}s late")
+                start = self.next_start(start, loop.time())
+                continue
 
             # start to process
-            _dag_id = getattr(self, 'dag_id', None)
+            await self.tick()
+            start = self.next_start(start, loop.time())
+
+    async def tick(self) -> WatchResult:
+        """watch once and trigger if needed, errors are logged rather than raised"""
+        _dag_id = getattr(self, 'dag_id', None)
+        result = WatchResult()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.num_ticks += 1
+        try:
             try:
-                result = await self.watch()
-                logger.info(f"[Watcher {_dag_id}] Watch result: {result}")
-                if result.action == "trigger":
-                    await self.trigger(result.context)
-            except Exception as e:
-                logger.error(f"[Watcher {_dag_id}] err_msg: {e}")
-                traceback.print_exc()
+                # the watch runs in its own task, cancelled (with the sensor requests it awaits) at the deadline
+                result = await asyncio.wait_for(self.watch(), self.tick_deadline)
+            except asyncio.TimeoutError:
+                if self.tick_deadline is None or loop.time() - started < self.tick_deadline:
+                    raise  # a timeout of a request, not the deadline
+                self.num_timeouts += 1
+                result.action = "timeout"
+                logger.warning(f"[Watcher {_dag_id}] watch cancelled after its {self.tick_deadline}s deadline")
+                return result
+            # the repr of the result is only built if INFO is enabled
+            logger.opt(lazy=True).info("[Watcher {}] Watch result: {}", lambda: _dag_id, lambda: result)
+            if result.action == "trigger":
+                for context in result.contexts or [result.context]:
+                    await self.trigger(context)
+        except Exception as e:
+            result.action = "error"
+            # the traceback goes through the logger (and its queue) rather than straight to stderr
+            logger.exception(f"[Watcher {_dag_id}] err_msg: {e}")
+        finally:
+            self.last_tick_duration = loop.time() - started
+            self.max_tick_duration = max(self.max_tick_duration, self.last_tick_duration)
+            if self.last_tick_duration > self.watch_interval:
+                self.num_overruns += 1
+        return result
+
+    @property
+    def upstream_dag_ids(self) -> Set[str]:
+        """the dag_ids that the watcher depends on"""
+        return set()
 
     async def watch(self) -> WatchResult:
         raise NotImplementedError
@@ -54,14 +170,43 @@ class BaseWatcher:
         raise NotImplementedError
 
 
+def stagger_phases(watchers: List[BaseWatcher], mode: str = "spread") -> None:
+    """Set the phase of the watchers that have none
+
+    Parameters
+    ----------
+    watchers : List[BaseWatcher]
+        the watchers
+    mode : str, optional
+        "spread": the watchers with the same watch_interval are evenly spread over it, in order,
+        "hash": the phase is derived from the batch_id and dag_id of the watcher, so it is stable
+        across restarts and batch reloads, by default "spread"
+    """
+    assert mode in ("spread", "hash"), f"unknown stagger mode: {mode}"
+    by_interval = {}
+    for w in watchers:
+        if w.phase is None:
+            by_interval.setdefault(w.watch_interval, []).append(w)
+    for interval, group in by_interval.items():
+        for i, w in enumerate(group):
+            if mode == "spread":
+                w.phase = i * interval / len(group)
+            else:
+                key = f"{getattr(w, 'batch_id', None)}/{getattr(w, 'dag_id', None)}"
+                w.phase = zlib.crc32(key.encode()) / 2**32 * interval
+
+
 def create_watcher(api_url: str, batch_id: str, cookies: dict, wcfg: dict):
     module, cls = wcfg.pop("class").rsplit(".", 1)
     watcher_cls = getattr(importlib.import_module(module), cls)
+    # the sensors of the watcher share their identical fetches
+    fetch_plan = FetchPlan(name=wcfg.get("dag_id"))
     watcher = watcher_cls(
         api_url,
         batch_id,
         cookies,
-        [create_sensor(api_url, batch_id, cookies, s) for s in wcfg.pop("upstream")],
+        [create_sensor(api_url, batch_id, cookies, s, fetch_plan=fetch_plan) for s in wcfg.pop("upstream")],
         **wcfg,
     )
+    watcher.fetch_plan = fetch_plan
     return watcher
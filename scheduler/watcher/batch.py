@@ -0,0 +1,213 @@
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+import copy
+import json
+
+import yaml
+from loguru import logger
+
+from ..helpers.done_set import DoneSet, get_done_set, set_done_set
+from ..upstream_sensor.base import UpstreamSensor, create_sensor
+from .base import BaseWatcher, create_watcher
+from .pool import parse_pools
+
+
+BATCH_CONFIG_SUFFIXES = (".yml", ".yaml")
+
+
+def load_batch_config(path: Path) -> dict:
+    with open(path, "r") as f:
+        return yaml.safe_load(f)
+
+
+def scan_batch_configs(paths: Iterable[Path] = (), dirs: Iterable[Path] = ()) -> Dict[str, Path]:
+    """Find the batch config files, the batch_id of each file is its stem
+
+    Parameters
+    ----------
+    paths : Iterable[Path], optional
+        batch config files, the ones that do not exist (any more) are skipped
+    dirs : Iterable[Path], optional
+        directories of batch config files (*.yml, *.yaml)
+
+    Returns
+    -------
+    Dict[str, Path]
+        batch_id -> path of the batch config
+    """
+    found = {}
+    for d in dirs:
+        if Path(d).is_dir():
+            found.update({p.stem: p for p in sorted(Path(d).iterdir()) if p.suffix in BATCH_CONFIG_SUFFIXES})
+    found.update({Path(p).stem: Path(p) for p in paths if Path(p).is_file()})
+    return found
+
+
+def file_signature(path: Path) -> Tuple[int, int]:
+    """(mtime_ns, size) of the file, to tell whether it has changed since it was loaded"""
+    stat = Path(path).stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _canonical(cfg) -> str:
+    return json.dumps(cfg, sort_keys=True, default=str)
+
+
+class Batch:
+    def __init__(
+        self, batch_id: str, cfg: dict, api_url: str, cookies: dict, path: Path = None, state_dir: Path = None
+    ) -> None:
+        """The watchers of a batch config
+
+        Parameters
+        ----------
+        batch_id : str
+            the batch_id, for example "baidu_integration_test"
+        cfg : dict
+            the batch config, see batch/dry_run.yml. The optional `pools` section declares the capacity
+            pools referenced by the watchers, see pool.py
+        api_url : str
+            api endpoint url
+        cookies : dict
+            cookies for authentication
+        path : Path, optional
+            the file that the config is loaded from
+        state_dir : Path, optional
+            if given, the scenes done by the terminal watchers of the batch are retired, and persisted to
+            {state_dir}/{batch_id}.done.jsonl, see helpers.done_set, by default None
+        """
+        self.batch_id = batch_id
+        self.cfg = cfg
+        self.api_url = api_url
+        self.cookies = cookies
+        self.path = path
+        self.signature = file_signature(path) if path is not None else None
+        self.pools = parse_pools(cfg.get("pools"))
+        self.watchers: List[BaseWatcher] = [
+            create_watcher(api_url, batch_id, cookies, copy.deepcopy(wc)) for wc in cfg["watchers"]
+        ]
+        self.state_dir = Path(state_dir) if state_dir is not None else None
+        self.done_set: DoneSet = None
+        self._bind_done_set()
+
+    @classmethod
+    def from_file(cls, path: Path, api_url: str, cookies: dict, state_dir: Path = None) -> "Batch":
+        return cls(Path(path).stem, load_batch_config(path), api_url, cookies, path=Path(path), state_dir=state_dir)
+
+    def is_modified(self) -> bool:
+        """whether the config file has changed since it was (re)loaded"""
+        return self.path is not None and self.path.is_file() and file_signature(self.path) != self.signature
+
+    def reload(self, cfg: dict = None) -> Dict[str, List[str]]:
+        """Apply a new version of the batch config to the running watchers, touching only what changed.
+
+        The watchers are matched by dag_id:
+
+        * new dag_ids are created and dropped dag_ids are removed
+        * a watcher whose class changed is recreated
+        * a watcher whose upstream changed gets new sensors, the sensors whose config is unchanged are reused
+          (with their loaded scene lists and other in-memory state)
+        * the other options (max_running_dag_runs, scene_id_keys, ...) are applied by `watcher.reconfigure`
+
+        The new config is validated completely before any watcher is touched, so an invalid config leaves
+        the batch as it was.
+
+        Parameters
+        ----------
+        cfg : dict, optional
+            the new batch config, by default reloaded from `self.path`
+
+        Returns
+        -------
+        Dict[str, List[str]]
+            the dag_ids that were "added", "removed", "recreated", "reconfigured" and "unchanged"
+        """
+        signature = None
+        if cfg is None:
+            signature = file_signature(self.path)
+            cfg = load_batch_config(self.path)
+        assert isinstance(cfg, dict) and isinstance(cfg.get("watchers"), list), "invalid batch config, `watchers` should be a list"
+        pools = parse_pools(cfg.get("pools"))
+
+        old_cfgs = {wc["dag_id"]: wc for wc in self.cfg["watchers"]}
+        current = {w.dag_id: w for w in self.watchers}
+        changes = {k: [] for k in ["added", "removed", "recreated", "reconfigured", "unchanged"]}
+
+        # build everything first, then swap, so that a failure does not leave a half-reloaded batch
+        plans = []
+        for wc in cfg["watchers"]:
+            dag_id, old = wc["dag_id"], old_cfgs.get(wc["dag_id"])
+            watcher = current.get(dag_id)
+            if watcher is None or old is None:
+                plans.append(("added", create_watcher(self.api_url, self.batch_id, self.cookies, copy.deepcopy(wc)), None))
+            elif _canonical(wc) == _canonical(old):
+                plans.append(("unchanged", watcher, None))
+            elif wc["class"] != old["class"] or not hasattr(watcher, "validate_options"):
+                plans.append(("recreated", create_watcher(self.api_url, self.batch_id, self.cookies, copy.deepcopy(wc)), None))
+            else:
+                options = {k: v for k, v in copy.deepcopy(wc).items() if k not in ("class", "upstream", "dag_id")}
+                # only validated here, the running watcher is only touched once all is valid
+                watcher.validate_options(**options)
+                sensors = self._reuse_sensors(watcher.upstream_sensors, old["upstream"], wc["upstream"])
+                plans.append(("reconfigured", watcher, (options, sensors)))
+
+        for change, watcher, update in plans:
+            if update is not None:
+                options, sensors = update
+                watcher.reconfigure(**options)
+                watcher.upstream_sensors = sensors
+                if getattr(watcher, "fetch_plan", None) is not None:
+                    watcher.fetch_plan.compile(sensors)  # the new sensors join the plan, the removed ones leave it
+            changes[change].append(watcher.dag_id)
+        changes["removed"] = sorted(set(current) - {w.dag_id for _, w, _ in plans})
+
+        self.watchers = [w for _, w, _ in plans]
+        self.cfg = cfg
+        self.pools = pools
+        if signature is not None:
+            self.signature = signature
+        self._bind_done_set()
+        logger.info(f"[Batch {self.batch_id}] Reloaded: { {k: v for k, v in changes.items() if v and k != 'unchanged'} }")
+        return changes
+
+    def terminal_watchers(self) -> List[BaseWatcher]:
+        """the watchers whose DAG is not read by any other watcher of the batch"""
+        upstream = set().union(*[w.upstream_dag_ids for w in self.watchers])
+        return [w for w in self.watchers if getattr(w, "dag_id", None) not in upstream]
+
+    def _bind_done_set(self) -> None:
+        """(re)bind the DoneSet of the batch to its terminal watchers, which report the scenes that succeeded"""
+        if self.state_dir is None:
+            return
+        terminals = [w for w in self.terminal_watchers() if hasattr(w, "scene_id_keys")]
+        keys = {tuple(w.scene_id_keys) for w in terminals}
+        if len(keys) != 1:
+            logger.warning(f"[Batch {self.batch_id}] the terminal watchers do not share their scene_id_keys, no scene is retired")
+            self.done_set = None
+        elif self.done_set is None or tuple(self.done_set.scene_id_keys) != next(iter(keys)):
+            path = self.state_dir / f"{self.batch_id}.done.jsonl"
+            self.done_set = DoneSet(next(iter(keys)), [w.dag_id for w in terminals], path)
+        else:
+            self.done_set.terminal_dag_ids = {w.dag_id for w in terminals}
+        for w in self.watchers:
+            w.done_set = self.done_set if w in terminals else None
+        if self.done_set is not None:
+            set_done_set(self.batch_id, self.done_set)
+        elif get_done_set(self.batch_id) is not None:
+            set_done_set(self.batch_id, None)
+
+    def _reuse_sensors(
+        self, sensors: List[UpstreamSensor], old_cfgs: List[dict], new_cfgs: List[dict]
+    ) -> List[UpstreamSensor]:
+        """the sensors of `new_cfgs`, reusing the ones in `sensors` (created from `old_cfgs`) whose config is unchanged"""
+        reusable = {}
+        for sensor, scfg in zip(sensors, old_cfgs):
+            reusable.setdefault(_canonical(scfg), []).append(sensor)
+        return [
+            reusable[key].pop(0) if reusable.get(key) else create_sensor(self.api_url, self.batch_id, self.cookies, copy.deepcopy(scfg))
+            for scfg in new_cfgs
+            for key in [_canonical(scfg)]
+        ]
+
+    def __repr__(self) -> str:
+        return f"Batch({self.batch_id}, watchers={[getattr(w, 'dag_id', None) for w in self.watchers]})"
@@ -0,0 +1,353 @@
+from typing import Dict, List, Set
+import asyncio
+import math
+import time
+
+from loguru import logger
+
+from ..helpers.airflow_api import fetch_dag_runs, get_data_source, request_dag_runs_bulk
+from ..helpers.dag_run_cache import DagRunCache, use_dag_run_cache
+from ..helpers.dag_state import DagStateStore, RefreshPolicy
+from ..helpers.done_set import get_done_set, set_done_set
+from ..helpers.memory import scene_key_table
+from .base import BaseWatcher, stagger_phases
+from .batch import Batch
+from .pool import CapacityPool
+
+
+def build_dependency_graph(watchers: List[BaseWatcher]) -> Dict[int, Set[int]]:
+    """Build the cross-DAG dependency graph of the watchers
+
+    Returns
+    -------
+    Dict[int, Set[int]]
+        index of watcher -> indices of the watchers it depends on, i.e. the watchers of the
+        same batch whose dag_id is read by any of its upstream sensors
+    """
+    by_dag_id = {}
+    for i, watcher in enumerate(watchers):
+        by_dag_id.setdefault((getattr(watcher, "batch_id", None), getattr(watcher, "dag_id", None)), set()).add(i)
+    return {
+        i: set().union(*[by_dag_id.get((getattr(watcher, "batch_id", None), d), set()) for d in watcher.upstream_dag_ids]) - {i}
+        for i, watcher in enumerate(watchers)
+    }
+
+
+def topological_order(graph: Dict[int, Set[int]]) -> List[int]:
+    """Kahn's algorithm, ties are broken by the original order. The nodes in a dependency
+    cycle (which should not exist in a sane batch config) are appended in the original order.
+    """
+    indegree = {n: len(deps) for n, deps in graph.items()}
+    dependents = {n: [] for n in graph}
+    for n, deps in graph.items():
+        for d in deps:
+            dependents[d].append(n)
+
+    order = []
+    ready = sorted(n for n, deg in indegree.items() if deg == 0)
+    while ready:
+        n = ready.pop(0)
+        order.append(n)
+        for m in dependents[n]:
+            indegree[m] -= 1
+            if indegree[m] == 0:
+                ready.append(m)
+        ready.sort()
+
+    if len(order) < len(graph):
+        cyclic = sorted(set(graph) - set(order))
+        logger.warning(f"[Coordinator] dependency cycle detected among watchers {cyclic}")
+        order.extend(cyclic)
+    return order
+
+
+class Coordinator:
+    def __init__(
+        self,
+        watchers: List[BaseWatcher] = None,
+        cycle_interval: float = None,
+        bulk_fetch: bool = False,
+        refresh_policy: RefreshPolicy = None,
+        stagger: str = None,
+        fixed_rate: bool = False,
+        tick_deadline: float = None,
+        skip_stale: bool = False,
+    ) -> None:
+        """Runs all the watchers in one loop instead of one independent loop per watcher.
+
+        In each cycle, the DagRuns of every DAG referenced by the watchers are fetched once
+        (concurrently) into a shared DagRunCache, then the due watchers tick in topological
+        order of the cross-DAG dependency graph, so the state observed upstream in this cycle
+        is seen by all the downstream watchers in the same cycle. After a watcher triggers,
+        its own DAG is re-fetched by the next reader.
+
+        The capacity pools declared by the batches are shared by name across batches, their occupied
+        slots are counted once per cycle from the prefetched DagRuns.
+
+        Batches can be added and removed at any time, the DagRuns of a DAG shared by several
+        batches are fetched once and split by conf.batch_id locally.
+
+        Parameters
+        ----------
+        watchers : List[BaseWatcher], optional
+            the watchers that do not belong to any Batch
+        cycle_interval : float, optional
+            time interval (in seconds) between each cycle, by default the smallest watch_interval.
+            Each watcher ticks in the first cycle after its own watch_interval has elapsed.
+        bulk_fetch : bool, optional
+            if True, the DagRuns of all the DAGs of an endpoint are prefetched with one paginated query
+            (POST /api/v1/dags/~/dagRuns/list) instead of one request per DAG, by default False
+        refresh_policy : RefreshPolicy, optional
+            if set, the DagRuns of each DAG are kept across cycles (see helpers.dag_state) and only the hot DAGs
+            are refreshed every cycle, the quiescent ones are refreshed at the (longer) intervals of the policy.
+            By default None, every DAG is refreshed every cycle
+        stagger : str, optional
+            if set, the phase of the watchers that have none is set with `stagger_phases(watchers, stagger)`, a
+            watcher ticks for the first time in the first cycle after its phase, so the watchers whose watch_interval
+            spans several cycles are spread over them, by default None (every watcher ticks in the first cycle)
+        fixed_rate : bool, optional
+            if True, the cycles start every cycle interval whatever their duration (an overrunning cycle skips the
+            missed slots), otherwise each cycle starts one interval after the end of the previous one, by default False
+        tick_deadline : float, optional
+            if set, the deadline of the watches of every watcher, see `BaseWatcher.set_deadline`, by default None
+        skip_stale : bool, optional
+            if True, a cycle that starts more than one cycle interval after its slot is skipped, by default False
+        """
+        self.loose_watchers = list(watchers or [])
+        self.batches: Dict[str, Batch] = {}
+        self.cycle_interval = cycle_interval
+        self.bulk_fetch = bulk_fetch
+        self.dag_state = DagStateStore(refresh_policy) if refresh_policy is not None else None
+        self.stagger = stagger
+        self.fixed_rate = fixed_rate
+        self.tick_deadline = tick_deadline
+        self.skip_stale = skip_stale
+        self.num_cycles = 0
+        self.num_skipped_cycles = 0
+        self._last_tick = {}
+        self._first_seen = {}  # the first cycle each watcher with a phase was seen in
+        self.pools: Dict[str, CapacityPool] = {}
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        self.watchers = self.loose_watchers + [w for b in self.batches.values() for w in b.watchers]
+        self.graph = build_dependency_graph(self.watchers)
+        self.order = [self.watchers[i] for i in topological_order(self.graph)]
+        self._last_tick = {id(w): t for w in self.watchers if (t := self._last_tick.get(id(w))) is not None}
+        self._first_seen = {id(w): t for w in self.watchers if (t := self._first_seen.get(id(w))) is not None}
+        if self.stagger is not None:
+            stagger_phases(self.watchers, self.stagger)
+        if self.tick_deadline is not None:
+            for w in self.watchers:
+                w.set_deadline(self.tick_deadline, w.skip_stale)
+        self._bind_pools()
+
+    def _bind_pools(self) -> None:
+        """(re)create the pools declared by the batches, keeping the existing ones, and bind them to the watchers"""
+        slots = {}
+        for batch in self.batches.values():
+            for name, n in batch.pools.items():
+                if name in slots and slots[name] != n:
+                    logger.warning(f"[Coordinator] pool {name} is declared with {slots[name]} and {n} slots, using {n}")
+                slots[name] = n
+        pools = {name: self.pools.get(name) or CapacityPool(name, n) for name, n in slots.items()}
+        members = {name: [] for name in pools}
+        for name, pool in pools.items():
+            pool.slots = slots[name]
+        for w in self.watchers:
+            if not hasattr(w, "pool_name"):
+                continue
+            w.pool = pools.get(w.pool_name)
+            if w.pool_name is not None and w.pool is None:
+                logger.warning(f"[Coordinator] pool {w.pool_name} of watcher {w.dag_id} is not declared, ignored")
+            elif w.pool is not None:
+                members[w.pool_name].append((w.api_url, w.dag_id, w.cookies))
+        for name, pool in pools.items():
+            pool.set_members(members[name])
+        self.pools = pools
+
+    def add_batch(self, batch: Batch) -> None:
+        """add (or replace) a batch, its watchers start to tick in the next cycle"""
+        self.batches[batch.batch_id] = batch
+        self._rebuild()
+        logger.info(f"[Coordinator] Added {batch}")
+
+    def remove_batch(self, batch_id: str) -> Batch:
+        batch = self.batches.pop(batch_id, None)
+        self._rebuild()
+        if batch is not None:
+            if batch.done_set is not None and get_done_set(batch_id) is batch.done_set:
+                set_done_set(batch_id, None)
+            # what the data source keeps in memory for its DagRuns, e.g. the XCom values of the RestDataSource
+            get_data_source().forget_batch(batch_id)
+            # forget the scene keys of the removed batch, the ones of the other batches held by their watchers
+            # (ledgers, readiness, ...) are interned again on their next tick
+            scene_key_table.retain(key for b in self.batches.values() if b.done_set is not None for key in b.done_set)
+            logger.info(f"[Coordinator] Removed {batch}")
+        return batch
+
+    def reload_batch(self, batch_id: str, cfg: dict = None) -> Dict[str, List[str]]:
+        """apply a new config to a running batch, see `Batch.reload`. The watchers that are kept keep their schedule."""
+        changes = self.batches[batch_id].reload(cfg)
+        self._rebuild()
+        return changes
+
+    @property
+    def interval(self) -> float:
+        if self.cycle_interval is not None:
+            return self.cycle_interval
+        return min((w.watch_interval for w in self.watchers), default=10)
+
+    def _is_due(self, watcher: BaseWatcher, now: float) -> bool:
+        last = self._last_tick.get(id(watcher))
+        # tolerate a small scheduling jitter so that watchers with watch_interval == cycle interval tick every cycle
+        tolerance = 0.05 * self.interval
+        if last is None:
+            phase = getattr(watcher, "phase", None)
+            return phase is None or now - self._first_seen.setdefault(id(watcher), now) >= phase - tolerance
+        return now - last >= watcher.watch_interval - tolerance
+
+    @staticmethod
+    def _dag_ids_to_prefetch(watchers: List[BaseWatcher], pools: List[CapacityPool] = ()) -> Dict[tuple, Set[str]]:
+        """(api_url, cookies) -> the dag_ids read by the watchers (and counted by the pools) with that endpoint"""
+        dag_ids = {}
+        for w in watchers:
+            if getattr(w, "api_url", None) is None:
+                continue
+            key = (w.api_url, tuple(sorted((w.cookies or {}).items())))
+            dag_ids.setdefault(key, set()).update(w.upstream_dag_ids | {w.dag_id})
+        for pool in pools:
+            for api_url, dag_id, cookies in pool.members:
+                dag_ids.setdefault((api_url, tuple(sorted((cookies or {}).items()))), set()).add(dag_id)
+        return dag_ids
+
+    @staticmethod
+    def _pools_of(watchers: List[BaseWatcher]) -> List[CapacityPool]:
+        pools = {id(w.pool): w.pool for w in watchers if getattr(w, "pool", None) is not None}
+        return list(pools.values())
+
+    async def prefetch(
+        self, cache: DagRunCache, watchers: List[BaseWatcher], pools: List[CapacityPool] = (), now: float = None
+    ) -> None:
+        """fetch the DagRuns of all the DAGs referenced by the watchers concurrently, failures are left to the watchers.
+        With a refresh policy, the DAGs that are not due for a refresh are read from the DagStateStore instead."""
+        to_prefetch = self._dag_ids_to_prefetch(watchers, pools)
+        if self.dag_state is not None:
+            now = time.monotonic() if now is None else now
+            to_prefetch = self._reuse_quiescent(cache, to_prefetch, now)
+        if self.bulk_fetch:
+            coros = [self._prefetch_bulk(cache, api_url, dag_ids, dict(cookies)) for (api_url, cookies), dag_ids in to_prefetch.items()]
+        else:
+            coros = [
+                fetch_dag_runs(api_url, dag_id, dict(cookies))
+                for (api_url, cookies), dag_ids in to_prefetch.items()
+                for dag_id in sorted(dag_ids)
+            ]
+        with use_dag_run_cache(cache):
+            results = await asyncio.gather(*coros, return_exceptions=True)
+        for exc in results:
+            if isinstance(exc, Exception):
+                logger.warning(f"[Coordinator] prefetch failed: {exc}")
+        if self.dag_state is not None:
+            for (api_url, _), dag_ids in to_prefetch.items():
+                for dag_id in dag_ids:
+                    if (api_url, dag_id) in cache:
+                        self.dag_state.update(api_url, dag_id, await cache.get(api_url, dag_id, None), now)
+
+    def _reuse_quiescent(self, cache: DagRunCache, to_prefetch: Dict[tuple, Set[str]], now: float) -> Dict[tuple, Set[str]]:
+        """put the stored DagRuns of the DAGs that are not due into the cache, returns the DAGs to fetch"""
+        due = {}
+        for (api_url, cookies), dag_ids in to_prefetch.items():
+            for dag_id in dag_ids:
+                if self.dag_state.is_due(api_url, dag_id, now):
+                    due.setdefault((api_url, cookies), set()).add(dag_id)
+                else:
+                    cache.put(api_url, dag_id, self.dag_state.get(api_url, dag_id).dag_runs)
+                    self.dag_state.num_reused += 1
+        return due
+
+    def _update_dag_state(self, now: float) -> None:
+        """re-tier the DAGs after the ticks, a DAG is waited on if a watcher reading it has ready scenes queued
+        or triggers a hot DAG, the DAGs that are no longer referenced are forgotten"""
+        referenced = {
+            (api_url, dag_id)
+            for (api_url, _), dag_ids in self._dag_ids_to_prefetch(self.watchers, self.pools.values()).items()
+            for dag_id in dag_ids
+        }
+        self.dag_state.forget(self.dag_state.keys() - referenced)
+        waited_on = set()
+        for w in self.watchers:
+            if getattr(w, "api_url", None) is None:
+                continue
+            state = self.dag_state.get(w.api_url, w.dag_id)
+            if len(getattr(w, "ready_queue", ())) > 0 or (state is not None and state.tier == "hot"):
+                waited_on.update((w.api_url, d) for d in w.upstream_dag_ids)
+        tiers = self.dag_state.classify(now, waited_on)
+        logger.debug(f"[Coordinator] DAG activity: {', '.join(f'{t} {sorted(d)}' for t, d in tiers.items())}")
+
+    @staticmethod
+    async def _prefetch_bulk(cache: DagRunCache, api_url: str, dag_ids: Set[str], cookies: dict) -> None:
+        """one query for all the `dag_ids`, split per DAG into the cache"""
+        dag_runs = await request_dag_runs_bulk(api_url, dag_ids, cookies)
+        for dag_id, runs in dag_runs.items():
+            cache.put(api_url, dag_id, runs)
+
+    async def run_cycle(self, now: float = None) -> List[BaseWatcher]:
+        """tick the due watchers, returns them"""
+        now = time.monotonic() if now is None else now
+        due = [w for w in self.order if self._is_due(w, now)]
+        if not due:
+            return due
+        self.num_cycles += 1
+
+        cache = DagRunCache()
+        pools = self._pools_of(due)
+        with use_dag_run_cache(cache):
+            await self.prefetch(cache, due, pools, now)
+            ledgers = {}
+            for w in self.watchers:
+                if getattr(w, "ledger", None) is not None:
+                    ledgers.setdefault((w.api_url, w.dag_id), []).append(w.ledger)
+            for pool in pools:
+                try:
+                    await pool.refresh(ledgers)
+                except Exception as e:
+                    # without an up-to-date count, admit nothing to the pool in this cycle
+                    pool.occupied, pool.acquired = pool.slots, 0
+                    logger.warning(f"[Coordinator] failed to refresh {pool}: {e}")
+            for watcher in due:
+                self._last_tick[id(watcher)] = now
+                result = await watcher.tick()
+                if result.action == "trigger":
+                    cache.invalidate([watcher.dag_id])
+                    if self.dag_state is not None:
+                        self.dag_state.touch(watcher.api_url, watcher.dag_id, now)
+            # the fetches left behind by the watches cancelled at their deadline
+            num_cancelled = cache.cancel_pending()
+            if num_cancelled:
+                logger.debug(f"[Coordinator] cancelled {num_cancelled} pending fetches")
+        if self.dag_state is not None:
+            self._update_dag_state(now)
+        return due
+
+    def tick_stats(self) -> Dict[str, dict]:
+        """batch_id/dag_id -> the tick statistics of the watcher, see `BaseWatcher.tick_stats`"""
+        return {f"{getattr(w, 'batch_id', None)}/{getattr(w, 'dag_id', None)}": w.tick_stats() for w in self.watchers}
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        start = loop.time() + self.interval
+        while True:
+            await asyncio.sleep(max(start - loop.time(), 0))
+            if self.skip_stale and loop.time() - start >= self.interval:
+                self.num_skipped_cycles += 1
+                logger.warning(f"[Coordinator] skipped a stale cycle, {loop.time() - start:.1f}s late")
+            else:
+                await self.run_cycle()
+            if self.fixed_rate:
+                missed = max(math.ceil((loop.time() - start) / self.interval), 1)
+                if missed > 1:
+                    logger.debug(f"[Coordinator] the cycle overran {missed - 1} slot(s)")
+                start += missed * self.interval
+            else:
+                start = loop.time() + self.interval
@@ -0,0 +1,53 @@
+from typing import Dict, Iterable, Optional, Set, Tuple
+import time
+
+from loguru import logger
+
+
+class TriggerLedger:
+    def __init__(self, ttl: float = 600, name: str = None) -> None:
+        """The DagRuns triggered by a watcher that have not shown up in the DagRun list of Airflow yet.
+
+        Between a trigger and the next poll that sees the new DagRun (which may be stale or paginated),
+        the scenes in the ledger count as existing and running, so they are neither triggered twice nor
+        left out of max_running_dag_runs. An entry is dropped once its scene is seen, or after `ttl`
+        seconds (e.g. the DagRun was deleted, or never made it to the list).
+
+        Parameters
+        ----------
+        ttl : float, optional
+            time (in seconds) after which an entry that never showed up is dropped, by default 600
+        name : str, optional
+            used in the logs
+        """
+        self.ttl = ttl
+        self.name = name
+        self._entries: Dict[tuple, Tuple[Optional[str], float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, scene_key: tuple) -> bool:
+        return scene_key in self._entries
+
+    def keys(self) -> Set[tuple]:
+        return set(self._entries)
+
+    def record(self, scene_key: tuple, dag_run_id: str = None, now: float = None) -> None:
+        self._entries[scene_key] = (dag_run_id, time.monotonic() if now is None else now)
+
+    def reconcile(self, seen_scene_keys: Iterable[tuple], now: float = None) -> None:
+        """drop the entries whose scene is in the DagRun list, and the expired ones"""
+        now = time.monotonic() if now is None else now
+        seen_scene_keys = set(seen_scene_keys)
+        for scene_key, (dag_run_id, issued_at) in list(self._entries.items()):
+            if scene_key in seen_scene_keys:
+                del self._entries[scene_key]
+            elif now - issued_at > self.ttl:
+                del self._entries[scene_key]
+                logger.warning(f"[Ledger {self.name}] DagRun {dag_run_id} of scene {scene_key} has not shown up in {self.ttl}s, dropped")
+
+    def unseen(self, dag_run_ids: Iterable[str]) -> int:
+        """the number of entries whose DagRun is not in `dag_run_ids`"""
+        dag_run_ids = set(dag_run_ids)
+        return sum(dag_run_id is None or dag_run_id not in dag_run_ids for dag_run_id, _ in self._entries.values())
@@ -0,0 +1,92 @@
+from typing import Dict, Iterable, List, Tuple, Union
+
+from loguru import logger
+
+from ..helpers.airflow_api import fetch_dag_runs
+
+
+POOL_STATES = ("queued", "running")
+
+
+def parse_pools(cfg: Union[dict, None]) -> Dict[str, int]:
+    """Parse the `pools` section of a batch config
+
+    Parameters
+    ----------
+    cfg : Union[dict, None]
+        pool name -> number of slots, or pool name -> {"slots": number of slots}, for example
+        {"gpu_cluster": 8, "cpu_cluster": {"slots": 32}}
+
+    Returns
+    -------
+    Dict[str, int]
+        pool name -> number of slots
+    """
+    pools = {}
+    for name, spec in (cfg or {}).items():
+        slots = spec["slots"] if isinstance(spec, dict) else spec
+        assert isinstance(slots, int) and slots >= 0, f"invalid number of slots of pool {name}: {slots}"
+        pools[name] = slots
+    return pools
+
+
+class CapacityPool:
+    def __init__(self, name: str, slots: int) -> None:
+        """A named capacity shared by the watchers referencing it, e.g. the DAGs running on the same GPU cluster.
+
+        Each cycle, the coordinator counts the queued / running DagRuns (of all batches) of the member DAGs
+        from the DagRuns it has already fetched (`refresh`), then the watchers admit their triggers against
+        the free slots (`has_capacity`) and take a slot for each trigger (`acquire`) until the next refresh.
+
+        Parameters
+        ----------
+        name : str
+            the name of the pool, referenced by the `pool` option of the watchers
+        slots : int
+            the maximum number of queued and running DagRuns of all the member DAGs together
+        """
+        self.name = name
+        self.slots = slots
+        self.members: List[Tuple[str, str, dict]] = []  # (api_url, dag_id, cookies) of the member DAGs
+        self.occupied = 0
+        self.acquired = 0
+
+    @property
+    def available(self) -> int:
+        return max(self.slots - self.occupied - self.acquired, 0)
+
+    def has_capacity(self, slots: int = 1) -> bool:
+        return self.available >= slots
+
+    def acquire(self, slots: int = 1) -> None:
+        self.acquired += slots
+
+    def set_members(self, members: Iterable[Tuple[str, str, dict]]) -> None:
+        unique = {}
+        for api_url, dag_id, cookies in members:
+            unique.setdefault((api_url, dag_id), (api_url, dag_id, cookies))
+        self.members = list(unique.values())
+
+    async def refresh(self, ledgers: Dict[Tuple[str, str], list] = None) -> None:
+        """Recount the occupied slots, reading the DagRuns through the DagRunCache in use (if any),
+        so no extra API call is made when the coordinator has prefetched them in this cycle.
+
+        Parameters
+        ----------
+        ledgers : Dict[Tuple[str, str], list], optional
+            (api_url, dag_id) -> the TriggerLedgers of the watchers of that DAG, the triggered DagRuns
+            that are not in the DagRun list yet take a slot too
+        """
+        ledgers = ledgers or {}
+        occupied = 0
+        for api_url, dag_id, cookies in self.members:
+            dag_runs = await fetch_dag_runs(api_url, dag_id, cookies)
+            occupied += sum(dr["state"] in POOL_STATES for dr in dag_runs)
+            dag_run_ids = {dr["dag_run_id"] for dr in dag_runs}
+            occupied += sum(ledger.unseen(dag_run_ids) for ledger in ledgers.get((api_url, dag_id), []))
+        self.occupied = occupied
+        self.acquired = 0
+        logger.debug(f"[Pool {self.name}] {self.occupied}/{self.slots} slots occupied")
+
+    def __repr__(self) -> str:
+        return f"CapacityPool({self.name}, occupied={self.occupied}+{self.acquired}/{self.slots})"
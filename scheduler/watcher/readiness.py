@@ -0,0 +1,108 @@
+from typing import Dict, FrozenSet, List, Set, Tuple
+
+import pandas as pd
+
+from ..helpers.compute import run_compute
+from ..helpers.memory import intern_scene_key, intern_scene_keys
+
+
+def success_scene_keys(success_df: pd.DataFrame, scene_id_keys: List[str], query_key_values: dict) -> FrozenSet[tuple]:
+    """The interned keys of the scenes that have a row of `success_df` (the success records of one sensor)
+    matching `query_key_values`, i.e. the scenes for which that upstream is success"""
+    if len(success_df) == 0 or any(k not in success_df.columns for k in [*scene_id_keys, *query_key_values]):
+        return frozenset()
+    mask = pd.Series(True, index=success_df.index)
+    for k, v in query_key_values.items():
+        mask &= success_df[k] == v
+    for k in scene_id_keys:
+        mask &= success_df[k].notna()
+    return frozenset(intern_scene_keys(success_df[mask], scene_id_keys))
+
+
+def success_key_changes(
+    success_df: pd.DataFrame, scene_id_keys: List[str], query_key_values: dict, previous: FrozenSet[tuple]
+) -> Tuple[FrozenSet[tuple], Set[tuple], Set[tuple]]:
+    """`success_scene_keys` of `success_df`, and the keys that were added / removed since `previous`.
+    O(the records of the sensor), so it is run with run_compute, off the event loop"""
+    success_keys = success_scene_keys(success_df, scene_id_keys, query_key_values)
+    return success_keys, set(success_keys - previous), set(previous - success_keys)
+
+
+class ReadinessEngine:
+    def __init__(self, num_sensors: int) -> None:
+        """The ready scenes of a watcher, maintained incrementally across ticks.
+
+        Each scene that is success for at least one upstream sensor has a bitmask of the sensors it is success for,
+        and is ready once every bit is set. Each tick, the success scenes of each sensor are rebuilt from its records
+        and diffed against the previous tick, which is O(the records of the sensor) and runs in the compute executor
+        (`update_from_df`, skipped when the sensor returns the same DataFrame, e.g. a static scene list). Only the
+        scenes that turned success (new runs) or stopped being success (cleared or re-run) then update their bitmask
+        on the event loop (`apply`), in O(changes), instead of the ready scenes being joined from all the records.
+
+        Parameters
+        ----------
+        num_sensors : int
+            the number of upstream sensors
+        """
+        self.num_sensors = num_sensors
+        self.full_mask = (1 << num_sensors) - 1
+        self.masks: Dict[tuple, int] = {}
+        self.ready: Set[tuple] = set()
+        self._success: List[FrozenSet[tuple]] = [frozenset()] * num_sensors
+        self._sources: List[object] = [None] * num_sensors  # the DataFrame each success set was read from
+
+    def update(self, i: int, success_keys: FrozenSet[tuple]) -> Tuple[Set[tuple], Set[tuple]]:
+        """Set the success scenes of sensor `i`
+
+        Returns
+        -------
+        Tuple[Set[tuple], Set[tuple]]
+            the scenes that became ready, and the ones that are no longer ready
+        """
+        previous = self._success[i]
+        if success_keys is previous:
+            return set(), set()
+        return self.apply(i, success_keys, success_keys - previous, previous - success_keys)
+
+    def apply(
+        self, i: int, success_keys: FrozenSet[tuple], added: Set[tuple], removed: Set[tuple]
+    ) -> Tuple[Set[tuple], Set[tuple]]:
+        """Set the success scenes of sensor `i`, `added` and `removed` being their changes since the previous tick,
+        see `update`"""
+        bit = 1 << i
+        newly_ready, no_longer_ready = set(), set()
+        for key in added:
+            mask = self.masks.get(key, 0) | bit
+            self.masks[key] = mask
+            if mask == self.full_mask:
+                self.ready.add(key)
+                newly_ready.add(key)
+        for key in removed:
+            mask = self.masks[key] & ~bit
+            if mask:
+                self.masks[key] = mask
+            else:
+                del self.masks[key]
+            if key in self.ready:
+                self.ready.discard(key)
+                no_longer_ready.add(key)
+        self._success[i] = success_keys
+        return newly_ready, no_longer_ready
+
+    async def update_from_df(
+        self, i: int, success_df: pd.DataFrame, scene_id_keys: List[str], query_key_values: dict
+    ) -> Tuple[Set[tuple], Set[tuple]]:
+        """`update` with the success records of sensor `i`, the DataFrame that the sensor returned in the
+        previous tick (e.g. a static scene list) is not read again"""
+        if success_df is self._sources[i]:
+            return set(), set()
+        self._sources[i] = success_df
+        success_keys, added, removed = await run_compute(
+            success_key_changes, success_df, scene_id_keys, query_key_values, self._success[i]
+        )
+        # the keys built by a process executor come back as copies
+        added = {intern_scene_key(key) for key in added}
+        return self.apply(i, success_keys, added, removed)
+
+    def __len__(self) -> int:
+        return len(self.ready)
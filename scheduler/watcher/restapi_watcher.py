@@ -1,4 +1,5 @@
-from typing import List
+from contextlib import nullcontext
+from typing import Dict, List, Set, Union
 import time
 
 import pandas as pd
@@ -6,8 +7,16 @@ from loguru import logger
 
 from ..helpers.base import is_in_df
 from ..helpers.airflow_api import get_dag_runs, trigger_dag
+from ..helpers.compute import run_compute
+from ..helpers.done_set import get_done_set
+from ..helpers.memory import intern_scene_key, intern_scene_keys
 from ..upstream_sensor.base import UpstreamSensor
 from .base import BaseWatcher, WatchResult
+from .ledger import TriggerLedger
+from .readiness import ReadinessEngine
+from .scheduling import (
+    ReadyQueue, SchedulingPolicy, compute_sort_key_changes, compute_sort_keys, create_scheduling_policy, fair_share
+)
 
 
 class RestAPIWatcher(BaseWatcher):
@@ -25,6 +34,12 @@ class RestAPIWatcher(BaseWatcher):
         max_running_dag_runs: int = 3,
         triggered_dag_run_id_style: str = "timestamp",
         watch_interval: int = 10,
+        scheduling_policy: Union[str, dict] = None,
+        fair_share_weight: float = None,
+        pool: str = None,
+        max_triggers_per_tick: int = 1,
+        trigger_ledger_ttl: float = 600,
+        incremental_readiness: bool = False,
         **kwargs,
     ) -> None:
         """__init__ of RestAPIWatcher
@@ -59,27 +74,129 @@ class RestAPIWatcher(BaseWatcher):
             Valid choices: ["timestamp", "scene_id_keys", "scene_id_keys_with_time", "batch_id_scene_id_keys_with_time"], by default "scene_id_keys_with_time"
         watch_interval : int
             time interval (in seconds) between each watch, by default 10
+        scheduling_policy : Union[str, dict], optional
+            the order in which the ready scenes are triggered, "lexicographic" (by scene_id_keys), "fifo"
+            (by upstream end_date) or "priority" (by a field of the upstream conf), or a dict like
+            {"name": "priority", "field": "urgency"}, see scheduling.py. By default "lexicographic".
+        fair_share_weight : float, optional
+            if provided, share the triggers of dag_id with the other batches that set it, in proportion
+            to the weights, by default None (no fair share)
+        pool : str, optional
+            name of the capacity pool (declared in the `pools` section of the batch config) that each
+            triggered DagRun takes a slot of, on top of max_running_dag_runs, by default None
+        max_triggers_per_tick : int, optional
+            the maximum number of scenes triggered in each watch, by default 1
+        trigger_ledger_ttl : float, optional
+            time (in seconds) for which a triggered DagRun that does not show up in the DagRun list yet
+            is counted as existing and running, by default 600, see ledger.py
+        incremental_readiness : bool, optional
+            if True, the ready scenes are maintained across ticks from the changes of the success scenes
+            of each upstream sensor, instead of being recomputed from all of them, by default False, see readiness.py
         """
         super().__init__(watch_interval=watch_interval)
+        self.scheduling_policy = None
+        self.readiness = None  # the ReadinessEngine of self.upstream_sensors, if incremental_readiness
+        self.fetch_plan = None  # the FetchPlan of self.upstream_sensors, set by `create_watcher`
+        self.ready_queue = ReadyQueue()
+        self._ready_keys: Dict[tuple, tuple] = {}  # the keys of the ready scenes -> their keys in the DagRun conf
+        self._ready_conf_keys: Dict[tuple, tuple] = {}  # the reverse of _ready_keys
+        self._sort_keys: Dict[tuple, tuple] = {}  # the keys of the ready scenes -> their sort keys
+        self.pool = None  # the CapacityPool named `pool_name`, bound by the Coordinator
+        self.ledger = TriggerLedger(name=dag_id)
+        self.done_set = None  # the DoneSet of the batch if the watcher is a terminal one, bound by the Batch
 
-        # check the input's validity
-        assert len(scene_id_keys) > 0, "scene_id_keys should not be empty"
+        self.batch_id = batch_id
+        self.api_url = api_url
+        self.dag_id = dag_id
+        self.upstream_sensors = upstream_sensors
+        self.cookies = cookies
+        self.reconfigure(
+            fixed_dag_run_conf=fixed_dag_run_conf,
+            scene_id_keys=scene_id_keys,
+            scene_id_dtypes=scene_id_dtypes,
+            max_running_dag_runs=max_running_dag_runs,
+            triggered_dag_run_id_style=triggered_dag_run_id_style,
+            watch_interval=watch_interval,
+            scheduling_policy=scheduling_policy,
+            fair_share_weight=fair_share_weight,
+            pool=pool,
+            max_triggers_per_tick=max_triggers_per_tick,
+            trigger_ledger_ttl=trigger_ledger_ttl,
+            incremental_readiness=incremental_readiness,
+        )
+
+    @staticmethod
+    def validate_options(
+        *,
+        scene_id_keys: List[str] = None,
+        scene_id_dtypes: List[str] = None,
+        triggered_dag_run_id_style: str = "timestamp",
+        scheduling_policy: Union[str, dict] = None,
+        fair_share_weight: float = None,
+        max_triggers_per_tick: int = 1,
+        **kwargs,
+    ) -> SchedulingPolicy:
+        """Check the options of `reconfigure` without touching any watcher, returns the scheduling policy they define.
+        Used by the hot reload to validate a whole batch config before applying it.
+        """
+        assert scene_id_keys and len(scene_id_keys) > 0, "scene_id_keys should not be empty"
         assert not scene_id_dtypes or len(scene_id_keys) == len(scene_id_dtypes), "scene_id_keys and scene_id_dtypes should have the same length"
         assert triggered_dag_run_id_style in ["timestamp", "scene_id_keys", "scene_id_keys_with_time", "batch_id_scene_id_keys_with_time"], "invalid triggered_dag_run_id_style"
+        assert fair_share_weight is None or fair_share_weight > 0, "fair_share_weight should be positive"
+        assert max_triggers_per_tick >= 1, "max_triggers_per_tick should be at least 1"
         # assert len(upstream_sensors) == len(
         #     {u.dag_id for u in upstream_sensors}
         # ), "the same dag_id appears more than once in upstream definition."
+        return create_scheduling_policy(scheduling_policy)
 
-        self.batch_id = batch_id
-        self.api_url = api_url
-        self.dag_id = dag_id
+    def reconfigure(
+        self,
+        *,
+        fixed_dag_run_conf: dict = None,
+        scene_id_keys: List[str] = None,
+        scene_id_dtypes: List[str] = None,
+        max_running_dag_runs: int = 3,
+        triggered_dag_run_id_style: str = "timestamp",
+        watch_interval: int = 10,
+        scheduling_policy: Union[str, dict] = None,
+        fair_share_weight: float = None,
+        pool: str = None,
+        max_triggers_per_tick: int = 1,
+        trigger_ledger_ttl: float = 600,
+        incremental_readiness: bool = False,
+        **kwargs,
+    ) -> None:
+        """(Re)set the configurable attributes, see __init__ for the parameters. Used by __init__ and
+        by the hot reload of the batch config, so that a running watcher keeps its sensors and state.
+        """
+        # check the input's validity
+        policy = self.validate_options(
+            scene_id_keys=scene_id_keys,
+            scene_id_dtypes=scene_id_dtypes,
+            triggered_dag_run_id_style=triggered_dag_run_id_style,
+            scheduling_policy=scheduling_policy,
+            fair_share_weight=fair_share_weight,
+            max_triggers_per_tick=max_triggers_per_tick,
+        )
+
+        if not incremental_readiness or scene_id_keys != getattr(self, "scene_id_keys", None):
+            self.readiness = None
+        if self.readiness is None or policy != self.scheduling_policy or scene_id_dtypes != getattr(self, "scene_id_dtypes", None):
+            # the ready scenes are diffed from scratch in the next tick, and ranked by the new policy
+            self._ready_keys, self._ready_conf_keys, self._sort_keys = {}, {}, {}
+            self.ready_queue = ReadyQueue()
+        self.incremental_readiness = incremental_readiness
         self.scene_id_keys = scene_id_keys
         self.scene_id_dtypes = scene_id_dtypes
         self.fixed_dag_run_conf = fixed_dag_run_conf
-        self.upstream_sensors = upstream_sensors
         self.max_running_dag_runs = max_running_dag_runs
         self.triggered_dag_run_id_style = triggered_dag_run_id_style
-        self.cookies = cookies
+        self.watch_interval = watch_interval
+        self.fair_share_weight = fair_share_weight
+        self.pool_name = pool
+        self.max_triggers_per_tick = max_triggers_per_tick
+        self.ledger.ttl = trigger_ledger_ttl
+        self.scheduling_policy = policy
 
     def __repr__(self) -> str:
         return f"RestAPIWatcher({self.dag_id})"
@@ -91,25 +208,83 @@ class RestAPIWatcher(BaseWatcher):
         _map = {'int': int, 'float': float, 'str': str, 'bool': bool}
         return {k: _map[self.scene_id_dtypes[i]](v) for i, (k, v) in enumerate(scene.items())}
 
+    @property
+    def upstream_dag_ids(self) -> Set[str]:
+        return set().union(*[sensor.upstream_dag_ids for sensor in self.upstream_sensors])
+
+    def scene_key(self, scene: dict) -> tuple:
+        """The interned tuple of the scene_id_values of a scene"""
+        return intern_scene_key(scene[k] for k in self.scene_id_keys)
+
+    @property
+    def fair_share_key(self) -> tuple:
+        return (self.api_url, self.dag_id)
+
     async def watch(self) -> WatchResult:
-        logger.info(f"[Watcher {self.dag_id}] Start watching..")
-        ready_scenes = await self.get_all_upstream_ready_scenes()
+        logger.debug(f"[Watcher {self.dag_id}] Start watching..")
+        success_df_list = await self.sense_upstream()
+        await self.update_ready_keys(success_df_list)
+        changed_sort_keys = await self.update_sort_keys(success_df_list)
         existing_scenes = await self.get_existing_scenes()
+        existing_scene_keys = {self.scene_key(e) for e in existing_scenes}
+        if self.done_set is not None:
+            self.done_set.report(self.dag_id, [self.scene_key(e) for e in existing_scenes if e["state"] == "success"])
+        # the DagRuns of the done scenes are not listed any more, they must not be triggered again
+        done_set = get_done_set(self.batch_id)
+
+        # the triggered DagRuns that are not in the list yet count as existing and running
+        self.ledger.reconcile(existing_scene_keys)
         running_scenes = [s for s in existing_scenes if s["state"] == "running"]
-        trigger_quota = self.max_running_dag_runs - len(running_scenes)
+        trigger_quota = self.max_running_dag_runs - len(running_scenes) - len(self.ledger)
+
+        # queue the ready scenes that are not triggered yet, ranked by the scheduling policy. The keys are compared
+        # as they are in the conf of the triggered DagRuns, and only the scenes that changed are pushed / discarded
+        candidates = self._ready_conf_keys.keys() - existing_scene_keys - self.ledger.keys()
+        queue = self.ready_queue
+        for skey in queue.keys() - candidates:
+            queue.discard(skey)
+        for key, sort_key in changed_sort_keys.items():
+            skey = self._ready_keys.get(key)
+            if skey in queue:
+                queue.push(skey, dict(zip(self.scene_id_keys, key)), sort_key)
+        for skey in candidates - queue.keys():
+            if done_set is not None and done_set.is_done(dict(zip(self.scene_id_keys, skey))):
+                continue
+            key = self._ready_conf_keys[skey]
+            queue.push(skey, dict(zip(self.scene_id_keys, key)), self._sort_keys.get(key, ()))
+        queue.compact()
+        if self.fair_share_weight is not None:
+            fair_share.report(
+                self.fair_share_key, self.batch_id, len(self.ready_queue) > 0 and trigger_quota > 0, self.fair_share_weight
+            )
+
         result = WatchResult()
-        if len(ready_scenes) == 0 or trigger_quota <= 0:
+        if len(self._ready_keys) == 0 or trigger_quota <= 0:
             result.action = "watch"
             return result
+        if len(self.ready_queue) == 0:
+            return result
 
-        # trigger the first scene that meets the requirement
-        for ready_scene in ready_scenes:
-            has_been_triggered = [e for e in existing_scenes if all(e[k] == ready_scene[k] for k in self.scene_id_keys)]
-            if len(has_been_triggered) == 0 and trigger_quota > 0:
-                result.action = "trigger"
-                result.context = self.convert_dtypes(ready_scene)
+        num_triggers = min(trigger_quota, self.max_triggers_per_tick)
+        if self.fair_share_weight is not None:
+            if not fair_share.may_trigger(self.fair_share_key, self.batch_id):
+                logger.info(f"[Watcher {self.dag_id}] Batch {self.batch_id} is ahead of its fair share, deferring.")
+                result.action = "watch"
+                return result
+            if fair_share.is_contended(self.fair_share_key, self.batch_id):
+                num_triggers = 1  # one at a time, so that the other batches get their turn
+        if self.pool is not None:
+            if not self.pool.has_capacity():
+                logger.info(f"[Watcher {self.dag_id}] {self.pool} is full, deferring.")
+                result.action = "watch"
                 return result
-        
+            num_triggers = min(num_triggers, self.pool.available)
+
+        # trigger the first scenes in the order of the scheduling policy
+        result.action = "trigger"
+        while len(result.contexts) < num_triggers and len(self.ready_queue) > 0:
+            result.contexts.append(self.convert_dtypes(self.ready_queue.pop()))
+        result.context = result.contexts[0]
         return result
 
     async def trigger(self, context: dict) -> None:
@@ -127,34 +302,123 @@ class RestAPIWatcher(BaseWatcher):
         elif self.triggered_dag_run_id_style == "batch_id_scene_id_keys_with_time":
             dag_run_id = f"batch_id:{self.batch_id}__" + "__".join([f"{k}:{v}" for k, v in context.items()]) + f"__{time.time()}"
         status, json_data = await trigger_dag(self.api_url, self.dag_id, self.cookies, dag_conf=dag_conf, dag_run_id=dag_run_id)
+        if "dag_run_id" not in json_data:  # the DAG is paused, nothing was triggered
+            logger.opt(lazy=True).debug("[Watcher {}] Response from Airflow {}", lambda: self.dag_id, lambda: json_data)
+            return
+        self.ledger.record(self.scene_key(context), json_data["dag_run_id"])
+        if self.fair_share_weight is not None:
+            fair_share.record_trigger(self.fair_share_key, self.batch_id, self.fair_share_weight)
+        if self.pool is not None:
+            self.pool.acquire()
         logger.info(f"[Watcher {self.dag_id}] Triggered DAG.")
-        logger.info(f"[Watcher {self.dag_id}] Response from Airflow {json_data}")
+        logger.opt(lazy=True).debug("[Watcher {}] Response from Airflow {}", lambda: self.dag_id, lambda: json_data)
 
-    async def get_all_upstream_ready_scenes(self) -> List[dict]:
+    async def sense_upstream(self) -> List[pd.DataFrame]:
+        """the success records of each upstream sensor"""
+        with self.fetch_plan.tick() if self.fetch_plan is not None else nullcontext():
+            return [await sensor.sense(state="success") for sensor in self.upstream_sensors]
+
+    async def get_all_upstream_ready_scenes(self, with_sort_keys: bool = False) -> List[dict]:
         """Get all the ready scene's
 
+        Parameters
+        ----------
+        with_sort_keys : bool, optional
+            if True, return (scene, sort key of the scheduling policy) pairs, by default False
+
         Returns
         -------
         List[dict]
             list of upstream ready conf
         """
-        ready_scenes = []
+        success_df_list = await self.sense_upstream()
+        success_df = None
+        if self.incremental_readiness:
+            ready_scenes = [dict(zip(self.scene_id_keys, key)) for key in await self.update_readiness(success_df_list)]
+        else:
+            success_df = pd.concat(success_df_list).reset_index(drop=True)
+            if len(success_df) == 0:
+                return []
+            ready_scenes = await run_compute(
+                find_ready_scenes, success_df, self.scene_id_keys, [snr.query_key_values for snr in self.upstream_sensors]
+            )
+        if not with_sort_keys:
+            return ready_scenes
 
-        success_df_list = [await sensor.sense(state="success") for sensor in self.upstream_sensors]
-        success_df = pd.concat(success_df_list).reset_index(drop=True)
+        sort_keys = {}
+        if type(self.scheduling_policy) is not SchedulingPolicy and ready_scenes:
+            if success_df is None:
+                success_df = pd.concat(success_df_list).reset_index(drop=True)
+            policy = self.scheduling_policy
+            sort_keys = await run_compute(compute_sort_keys, policy.name, policy.params, success_df, self.scene_id_keys)
+        return [(scene, sort_keys.get(self.scene_key(scene), ())) for scene in ready_scenes]
 
-        if len(success_df) == 0:
-            return []
+    async def update_ready_keys(self, success_df_list: List[pd.DataFrame]) -> None:
+        """Update the keys of the ready scenes (and their keys in the DagRun conf) from the success records of the
+        upstream sensors: from the scenes that the ReadinessEngine reports as changed if incremental_readiness,
+        otherwise by diffing all the ready scenes"""
+        if self.incremental_readiness:
+            changed = set()
+            ready = await self.update_readiness(success_df_list, changed)
+        else:
+            success_df = pd.concat(success_df_list).reset_index(drop=True)
+            ready_scenes = []
+            if len(success_df) > 0:
+                ready_scenes = await run_compute(
+                    find_ready_scenes, success_df, self.scene_id_keys, [snr.query_key_values for snr in self.upstream_sensors]
+                )
+            ready = {self.scene_key(scene) for scene in ready_scenes}
+            changed = ready ^ self._ready_keys.keys()
+        for key in changed:
+            if key in ready:
+                if key not in self._ready_keys:
+                    scene = dict(zip(self.scene_id_keys, key))
+                    skey = self.scene_key(self.convert_dtypes(scene)) if self.scene_id_dtypes else key
+                    self._ready_keys[key] = skey
+                    self._ready_conf_keys[skey] = key
+            else:
+                skey = self._ready_keys.pop(key, None)
+                if skey is not None:
+                    self._ready_conf_keys.pop(skey, None)
 
-        _scene_id_keys = self.scene_id_keys[0] if len(self.scene_id_keys) == 1 else self.scene_id_keys # to prevent pandas warning
-        for skeys, subdf in success_df.groupby(_scene_id_keys):
-            if isinstance(skeys, str):
-                skeys = [skeys]
-            num_success = sum([is_in_df(snr.query_key_values, subdf) for snr in self.upstream_sensors])
-            if num_success == len(self.upstream_sensors):
-                ready_scenes.append({k: v for k, v in zip(self.scene_id_keys, skeys)})
+    async def update_sort_keys(self, success_df_list: List[pd.DataFrame]) -> Dict[tuple, tuple]:
+        """Update the sort keys of the ready scenes by the scheduling policy, returns the ones that changed"""
+        if type(self.scheduling_policy) is SchedulingPolicy or not self._ready_keys:
+            changed = {k: () for k in self._sort_keys}
+            self._sort_keys = {}
+            return changed
+        success_df = pd.concat(success_df_list).reset_index(drop=True)
+        policy = self.scheduling_policy
+        self._sort_keys, changed = await run_compute(
+            compute_sort_key_changes, policy.name, policy.params, success_df, self.scene_id_keys, self._sort_keys
+        )
+        return changed
 
-        return ready_scenes
+    async def update_readiness(self, success_df_list: List[pd.DataFrame], changed: Set[tuple] = None) -> Set[tuple]:
+        """Apply the success records of each upstream sensor to the ReadinessEngine, returns the keys of the ready scenes,
+        and adds the scenes that became ready or are no longer ready to `changed` (if given).
+        The engine is rebuilt when the sensors change (e.g. by a reload of the batch config).
+        """
+        sensors = list(self.upstream_sensors)
+        if self.readiness is None or len(sensors) != len(self._readiness_sensors) or any(
+            a is not b for a, b in zip(sensors, self._readiness_sensors)
+        ):
+            if self.readiness is not None and changed is not None:
+                changed.update(self.readiness.ready)
+            self.readiness = ReadinessEngine(len(sensors))
+            self._readiness_sensors = sensors
+        changes = [0, 0]
+        for i, (sensor, success_df) in enumerate(zip(sensors, success_df_list)):
+            newly_ready, no_longer_ready = await self.readiness.update_from_df(
+                i, success_df, self.scene_id_keys, sensor.query_key_values
+            )
+            changes[0] += len(newly_ready)
+            changes[1] += len(no_longer_ready)
+            if changed is not None:
+                changed.update(newly_ready, no_longer_ready)
+        if any(changes):
+            logger.debug(f"[Watcher {self.dag_id}] {changes[0]} scenes became ready, {changes[1]} no longer ready")
+        return self.readiness.ready
 
     async def get_existing_scenes(self) -> List[dict]:
         """Get all the existing scenes of self.dag_id
@@ -170,8 +434,37 @@ class RestAPIWatcher(BaseWatcher):
             return []
 
         existing_scenes = []
-        for i, row in dag_run_df.iterrows():
-            scn = {k: v for k, v in zip(self.scene_id_keys, row[self.scene_id_keys].values)}
-            scn["state"] = row["dag_run_state"]
+        for skey, state in zip(intern_scene_keys(dag_run_df, self.scene_id_keys), dag_run_df["dag_run_state"].tolist()):
+            scn = dict(zip(self.scene_id_keys, skey))
+            scn["state"] = state
             existing_scenes.append(scn)
         return existing_scenes
+
+
+def find_ready_scenes(success_df: pd.DataFrame, scene_id_keys: List[str], query_key_values_list: List[dict]) -> List[dict]:
+    """Find the scenes in `success_df` that every upstream (given by its `query_key_values`) is success
+
+    Parameters
+    ----------
+    success_df : pd.DataFrame
+        the concatenated success records of all the upstream sensors
+    scene_id_keys : List[str]
+        The keys that determines a scene.
+    query_key_values_list : List[dict]
+        `query_key_values` of each upstream sensor
+
+    Returns
+    -------
+    List[dict]
+        list of ready scenes
+    """
+    ready_scenes = []
+    _scene_id_keys = scene_id_keys[0] if len(scene_id_keys) == 1 else scene_id_keys # to prevent pandas warning
+    for skeys, subdf in success_df.groupby(_scene_id_keys):
+        if isinstance(skeys, str):
+            skeys = [skeys]
+        num_success = sum([is_in_df(qkv, subdf) for qkv in query_key_values_list])
+        if num_success == len(query_key_values_list):
+            ready_scenes.append({k: v for k, v in zip(scene_id_keys, skeys)})
+
+    return ready_scenes
@@ -0,0 +1,276 @@
+from typing import Dict, Hashable, KeysView, List, Optional, Tuple, Union
+import heapq
+import itertools
+import math
+import time
+
+import pandas as pd
+
+from ..helpers.memory import intern_scene_keys
+
+
+class SchedulingPolicy:
+    """Decides the order in which the ready scenes of a watcher are triggered.
+
+    A policy maps every ready scene to a sort key (smaller first), computed from the
+    success records of the upstream sensors. Ties are broken by the scene key, so the
+    default policy (an empty sort key) triggers in lexicographic order of the scene keys.
+    """
+
+    name = "lexicographic"
+
+    @property
+    def params(self) -> dict:
+        """the arguments that recreate the policy, see `compute_sort_keys`"""
+        return {}
+
+    def sort_keys(self, success_df: pd.DataFrame, scene_id_keys: List[str]) -> Dict[tuple, tuple]:
+        """scene key -> sort key of every scene in `success_df`, the missing scenes sort as ()"""
+        return {}
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and vars(self) == vars(other)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({vars(self)})"
+
+
+class _ColumnPolicy(SchedulingPolicy):
+    """a policy ranking each scene by an aggregate of one column of its upstream success records"""
+
+    column = None
+
+    def values(self, success_df: pd.DataFrame) -> pd.Series:
+        raise NotImplementedError
+
+    def to_sort_key(self, value: float) -> tuple:
+        raise NotImplementedError
+
+    def sort_keys(self, success_df: pd.DataFrame, scene_id_keys: List[str]) -> Dict[tuple, tuple]:
+        if len(success_df) == 0 or self.column not in success_df:
+            return {}
+        skeys = pd.Series(intern_scene_keys(success_df, scene_id_keys), index=success_df.index, dtype=object)
+        per_scene = self.values(success_df).groupby(skeys).max()
+        return {skey: self.to_sort_key(value) for skey, value in per_scene.items()}
+
+
+class FIFOPolicy(_ColumnPolicy):
+    """First in, first out: the scene whose upstreams completed the earliest goes first.
+    The completion time of a scene is the latest end_date among its upstream success records,
+    the scenes without end_date (e.g. from a static scene list) go last.
+    """
+
+    name = "fifo"
+
+    def __init__(self, column: str = "end_date") -> None:
+        self.column = column
+
+    @property
+    def params(self) -> dict:
+        return {"column": self.column}
+
+    def values(self, success_df: pd.DataFrame) -> pd.Series:
+        # the reduced sensors may hold a set of dates in a cell, only the plain strings are considered
+        column = success_df[self.column].astype(object)
+        dates = pd.to_datetime(column.where(column.map(type) == str), utc=True, errors="coerce")
+        return (dates - pd.Timestamp(0, tz="UTC")).dt.total_seconds()
+
+    def to_sort_key(self, value: float) -> tuple:
+        return (math.isnan(value), 0.0 if math.isnan(value) else value)
+
+
+class PriorityPolicy(_ColumnPolicy):
+    """The scene with the highest priority goes first, the priority is a field of the upstream DagRun's conf
+    (the highest one among the upstreams of the scene), and `default` if it is missing or not a number.
+    """
+
+    name = "priority"
+
+    def __init__(self, field: str = "priority", default: float = 0) -> None:
+        self.column = field
+        self.default = default
+
+    @property
+    def params(self) -> dict:
+        return {"field": self.column, "default": self.default}
+
+    def values(self, success_df: pd.DataFrame) -> pd.Series:
+        column = success_df[self.column].astype(object)
+        return pd.to_numeric(column.where(column.map(lambda v: isinstance(v, (int, float, str)))), errors="coerce")
+
+    def to_sort_key(self, value: float) -> tuple:
+        return (-(self.default if math.isnan(value) else value),)
+
+
+SCHEDULING_POLICIES = {cls.name: cls for cls in [SchedulingPolicy, FIFOPolicy, PriorityPolicy]}
+
+
+def create_scheduling_policy(cfg: Union[str, dict, SchedulingPolicy, None]) -> SchedulingPolicy:
+    """Create a policy from the `scheduling_policy` option of a watcher
+
+    Parameters
+    ----------
+    cfg : Union[str, dict, SchedulingPolicy, None]
+        the name of the policy ("lexicographic", "fifo" or "priority"), or a dict of
+        {"name": <name>, **args}, for example {"name": "priority", "field": "urgency"}.
+        None means the default policy (lexicographic).
+    """
+    if isinstance(cfg, SchedulingPolicy):
+        return cfg
+    if cfg is None:
+        cfg = SchedulingPolicy.name
+    args = {}
+    if isinstance(cfg, dict):
+        args = {k: v for k, v in cfg.items() if k != "name"}
+        cfg = cfg.get("name")
+    assert cfg in SCHEDULING_POLICIES, f"invalid scheduling_policy {cfg}, choose from {sorted(SCHEDULING_POLICIES)}"
+    return SCHEDULING_POLICIES[cfg](**args)
+
+
+def compute_sort_keys(name: str, params: dict, success_df: pd.DataFrame, scene_id_keys: List[str]) -> Dict[tuple, tuple]:
+    """`SchedulingPolicy.sort_keys` of the policy `name` created from `params`, a module-level function for
+    `run_compute`, so that only the name and params of the policy are sent to a process executor"""
+    return create_scheduling_policy({"name": name, **params}).sort_keys(success_df, scene_id_keys)
+
+
+def compute_sort_key_changes(
+    name: str, params: dict, success_df: pd.DataFrame, scene_id_keys: List[str], previous: Dict[tuple, tuple]
+) -> Tuple[Dict[tuple, tuple], Dict[tuple, tuple]]:
+    """`compute_sort_keys`, and the sort keys that changed since `previous` (() for the scenes that have none any more),
+    so that only the scenes re-ranked are pushed again to the ReadyQueue"""
+    sort_keys = compute_sort_keys(name, params, success_df, scene_id_keys)
+    changed = {k: v for k, v in sort_keys.items() if previous.get(k) != v}
+    changed.update((k, ()) for k in previous.keys() - sort_keys.keys())
+    return sort_keys, changed
+
+
+class ReadyQueue:
+    def __init__(self) -> None:
+        """A priority queue of the ready (and not yet triggered) scenes of a watcher, kept across ticks.
+
+        Each tick, the watcher `push`es the scenes that became ready (or were re-ranked) and `discard`s the ones
+        that are gone (triggered or no longer ready), which are dropped lazily from the heap, so the scenes that
+        did not change stay in the heap untouched and each `pop` is O(log n).
+        """
+        self._heap: List[list] = []
+        self._entries: Dict[tuple, list] = {}
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, scene_key: tuple) -> bool:
+        return scene_key in self._entries
+
+    def keys(self) -> KeysView:
+        """the keys of the queued scenes (a view)"""
+        return self._entries.keys()
+
+    def push(self, scene_key: tuple, scene: dict, sort_key: tuple = ()) -> None:
+        entry = self._entries.get(scene_key)
+        if entry is not None:
+            if entry[0] == sort_key:
+                entry[3] = scene
+                return
+            entry[-1] = False  # re-ranked, the stale entry is skipped when it reaches the top
+        entry = [sort_key, scene_key, next(self._counter), scene, True]
+        self._entries[scene_key] = entry
+        heapq.heappush(self._heap, entry)
+
+    def discard(self, scene_key: tuple) -> None:
+        entry = self._entries.pop(scene_key, None)
+        if entry is not None:
+            entry[-1] = False
+
+    def sync(self, scenes: Dict[tuple, dict], sort_keys: Dict[tuple, tuple] = None) -> None:
+        """make the queue hold exactly `scenes` (scene key -> scene), ranked by `sort_keys`"""
+        sort_keys = sort_keys or {}
+        for scene_key in [k for k in self._entries if k not in scenes]:
+            self.discard(scene_key)
+        for scene_key, scene in scenes.items():
+            self.push(scene_key, scene, sort_keys.get(scene_key, ()))
+        self.compact()
+
+    def compact(self) -> None:
+        """drop the stale entries when they are most of the heap"""
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [e for e in self._heap if e[-1]]
+            heapq.heapify(self._heap)
+
+    def peek(self) -> Optional[dict]:
+        while self._heap and not self._heap[0][-1]:
+            heapq.heappop(self._heap)
+        return self._heap[0][3] if self._heap else None
+
+    def pop(self) -> Optional[dict]:
+        scene = self.peek()
+        if scene is not None:
+            entry = heapq.heappop(self._heap)
+            del self._entries[entry[1]]
+        return scene
+
+
+class FairShare:
+    def __init__(self, stale_after: float = 60) -> None:
+        """Weighted fair share of the triggers of a DAG between the batches that trigger it.
+
+        Each batch has a virtual time, advanced by 1 / weight on each trigger. A batch may trigger
+        only when no other *backlogged* batch (one that has ready scenes and free quota, as reported
+        in its last tick) is behind it by a full trigger, so the triggers are split in proportion to
+        the weights while there is contention, and a batch alone can use all the capacity. A batch
+        joining (or coming back) starts at the smallest virtual time of the others, so it does not
+        get the capacity it has not asked for in the past.
+
+        Parameters
+        ----------
+        stale_after : float, optional
+            time (in seconds) after which the backlog reported by a batch is ignored, e.g. when it has been removed
+        """
+        self.stale_after = stale_after
+        self._vtime: Dict[Hashable, Dict[str, float]] = {}
+        self._backlogged: Dict[Hashable, Dict[str, Tuple[float, float]]] = {}
+
+    def _min_vtime(self, key: Hashable, exclude: str, now: float) -> Optional[float]:
+        backlogged = self._backlogged.get(key, {})
+        vtimes = [
+            self._vtime[key][b] for b, (t, _) in backlogged.items() if b != exclude and now - t <= self.stale_after
+        ]
+        return min(vtimes, default=None)
+
+    def report(self, key: Hashable, batch_id: str, backlogged: bool, weight: float = 1.0, now: float = None) -> None:
+        """called by each watcher in each tick, `backlogged` means it has scenes to trigger and free quota"""
+        now = time.monotonic() if now is None else now
+        vtimes = self._vtime.setdefault(key, {})
+        backlog = self._backlogged.setdefault(key, {})
+        if backlogged:
+            if batch_id not in backlog:
+                others = self._min_vtime(key, batch_id, now)
+                vtimes[batch_id] = max(vtimes.get(batch_id, 0.0), others if others is not None else 0.0)
+            backlog[batch_id] = (now, weight)
+        else:
+            backlog.pop(batch_id, None)
+            vtimes.setdefault(batch_id, 0.0)
+
+    def may_trigger(self, key: Hashable, batch_id: str, now: float = None) -> bool:
+        now = time.monotonic() if now is None else now
+        others = self._min_vtime(key, batch_id, now)
+        if others is None:
+            return True
+        weight = self._backlogged.get(key, {}).get(batch_id, (now, 1.0))[1]
+        return self._vtime.get(key, {}).get(batch_id, 0.0) < others + 1.0 / weight
+
+    def is_contended(self, key: Hashable, batch_id: str, now: float = None) -> bool:
+        """whether other batches are backlogged on the same DAG"""
+        return self._min_vtime(key, batch_id, time.monotonic() if now is None else now) is not None
+
+    def record_trigger(self, key: Hashable, batch_id: str, weight: float = 1.0) -> None:
+        vtimes = self._vtime.setdefault(key, {})
+        vtimes[batch_id] = vtimes.get(batch_id, 0.0) + 1.0 / weight
+
+    def shares(self, key: Hashable) -> Dict[str, float]:
+        """the virtual time of each batch, for observability"""
+        return dict(self._vtime.get(key, {}))
+
+
+# shared by all the watchers of the process, keyed by (api_url, dag_id)
+fair_share = FairShare()
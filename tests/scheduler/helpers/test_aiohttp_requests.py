@@ -1,5 +1,6 @@
 import pytest
 import aiohttp
+from aiohttp import web
 
 from scheduler.helpers import aiohttp_requests as ar
 from scheduler.helpers.aiohttp_requests import async_retry
@@ -72,3 +73,109 @@ async def test_no_retry_needed():
     mock_function.counter = 0
     status, message = await mock_function_with_retry(0)  # should succeed on first attempt
     assert status == 200 and message == "Success"
+
+
+def test_project():
+    json_data = {"dag_runs": [{"dag_id": "a", "note": "x" * 100, "conf": {}}], "total_entries": 1}
+    assert ar.project(json_data, ["dag_id", "conf"], records_key="dag_runs") == {
+        "dag_runs": [{"dag_id": "a", "conf": {}}],
+        "total_entries": 1,
+    }
+    assert ar.project({"task_id": "t", "rendered_fields": {}}, ["task_id", "state"]) == {"task_id": "t"}
+
+
+@pytest.mark.asyncio
+async def test_get_fast_json(aiohttp_server):
+    async def dag_runs(request):
+        return web.json_response({"dag_runs": [{"dag_id": "a", "note": "x", "state": "success"}], "total_entries": 1})
+
+    app = web.Application()
+    app.router.add_get("/dagRuns", dag_runs)
+    server = await aiohttp_server(app)
+    url = str(server.make_url("/dagRuns"))
+
+    ar.enable_fast_json()
+    try:
+        status, result = await ar.get(url, fields=["dag_id", "state"], records_key="dag_runs")
+    finally:
+        ar.enable_fast_json(False)
+    assert status == 200
+    assert result == {"dag_runs": [{"dag_id": "a", "state": "success"}], "total_entries": 1}
+
+    status, result = await ar.get(url, fields=["dag_id", "state"], records_key="dag_runs")
+    assert result["dag_runs"][0]["note"] == "x"
+    await ar.close_session()
+
+
+@pytest.mark.asyncio
+async def test_get_response_cache(aiohttp_server):
+    requests = []
+
+    async def task_instance(request):
+        requests.append(dict(request.headers))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+        return web.json_response({"task_id": "t", "state": "success"}, headers={"ETag": '"v1"'})
+
+    async def dag(request):
+        requests.append(dict(request.headers))
+        return web.json_response({"dag_id": "d", "is_paused": False})
+
+    app = web.Application()
+    app.router.add_get("/taskInstances/t", task_instance)
+    app.router.add_get("/dags/d", dag)
+    server = await aiohttp_server(app)
+
+    cache = ar.enable_response_cache(16, ttl={"/dags/[^/]+$": 60})
+    try:
+        for _ in range(3):
+            status, ti = await ar.get(str(server.make_url("/taskInstances/t")))
+            assert status == 200 and ti == {"task_id": "t", "state": "success"}
+            status, dag_info = await ar.get(str(server.make_url("/dags/d")))
+            assert status == 200 and dag_info == {"dag_id": "d", "is_paused": False}
+    finally:
+        ar.enable_response_cache(None)
+    assert len(requests) == 4  # the task instance is revalidated each time, the dag is served from the cache
+    assert "If-None-Match" not in requests[0] and requests[2]["If-None-Match"] == '"v1"'
+    assert cache.stats()["revalidations"] == 2 and cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+    await ar.close_session()
+
+
+@pytest.mark.asyncio
+async def test_revalidation_replay(aiohttp_server, tmp_path):
+    from scheduler.helpers.replay import ReplayServer
+
+    served_304 = []
+
+    async def task_instance(request):
+        if request.headers.get("If-None-Match") == '"v1"' or request.query.get("stale"):
+            served_304.append(request.path)
+            return web.Response(status=304)
+        return web.json_response({"task_id": "t", "state": "success"}, headers={"ETag": '"v1"'})
+
+    app = web.Application()
+    app.router.add_get("/taskInstances/t", task_instance)
+    server = await aiohttp_server(app)
+    url = str(server.make_url("/taskInstances/t"))
+
+    path = tmp_path / "airflow.jsonl"
+    ar.enable_response_cache(16)
+    ar.start_recording(path)
+    try:
+        live = [await ar.get(url) for _ in range(3)]
+    finally:
+        ar.stop_recording()
+        ar.enable_response_cache(None)
+    assert len(served_304) == 2
+
+    # the revalidated responses are replayed as the 200 they stand for, also to a scheduler without cache
+    replay = ReplayServer(path)
+    replay_server = await aiohttp_server(replay.make_app())
+    replay_url = str(replay_server.make_url("/taskInstances/t"))
+    assert [await ar.get(replay_url) for _ in range(3)] == live
+
+    # a 304 that revalidates nothing is not decoded, it is retried and then raised
+    with pytest.raises(ar.Non200Response) as e:
+        await ar.get(url + "?stale=1")
+    assert e.value.status == 304 and len(served_304) == 5
+    await ar.close_session()
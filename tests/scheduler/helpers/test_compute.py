@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+import pytest
+import pandas as pd
+
+from scheduler.helpers.compute import configure_compute, shutdown_compute, run_compute, LoopLagMonitor
+
+
+def groupby_count(df):
+    return df.groupby("scene_id").size().to_dict()
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({"scene_id": ["a", "a", "b"], "state": ["success", "failed", "success"]})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["inline", "thread", "process"])
+async def test_run_compute(kind, df):
+    configure_compute(kind, max_workers=1)
+    try:
+        assert await run_compute(groupby_count, df) == {"a": 2, "b": 1}
+    finally:
+        shutdown_compute()
+
+
+@pytest.mark.asyncio
+async def test_run_compute_keeps_loop_responsive():
+    configure_compute("thread", max_workers=1)
+    monitor = LoopLagMonitor(interval=0.01, report_every=0)
+    monitor_task = asyncio.create_task(monitor.run())
+    try:
+        await run_compute(time.sleep, 0.3)
+    finally:
+        monitor_task.cancel()
+        shutdown_compute()
+    assert monitor.num_samples > 5
+    assert monitor.max_lag < 0.2
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor_detects_blocking():
+    monitor = LoopLagMonitor(interval=0.01, report_every=0)
+    monitor_task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.02)
+    time.sleep(0.2)  # block the event loop
+    await asyncio.sleep(0.02)
+    monitor_task.cancel()
+    assert monitor.max_lag >= 0.15
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from scheduler.helpers.dag_run_cache import DagRunCache, current_dag_run_cache, use_dag_run_cache
+
+
+@pytest.mark.asyncio
+async def test_dag_run_cache_coalesces_fetches():
+    num_calls = 0
+
+    async def fetch():
+        nonlocal num_calls
+        num_calls += 1
+        await asyncio.sleep(0.01)
+        return [{"dag_run_id": "r1"}]
+
+    cache = DagRunCache()
+    results = await asyncio.gather(*[cache.get("url", "dag_a", fetch) for _ in range(5)])
+    assert results == [[{"dag_run_id": "r1"}]] * 5
+    assert await cache.get("url", "dag_a", fetch) == [{"dag_run_id": "r1"}]
+    assert num_calls == 1
+    assert ("url", "dag_a") in cache
+
+    cache.invalidate(["dag_a"])
+    await cache.get("url", "dag_a", fetch)
+    assert num_calls == 2
+
+
+@pytest.mark.asyncio
+async def test_dag_run_cache_does_not_cache_failures():
+    async def fail():
+        raise RuntimeError("boom")
+
+    async def fetch():
+        return []
+
+    cache = DagRunCache()
+    with pytest.raises(RuntimeError):
+        await cache.get("url", "dag_a", fail)
+    assert ("url", "dag_a") not in cache
+    assert await cache.get("url", "dag_a", fetch) == []
+
+
+@pytest.mark.asyncio
+async def test_use_dag_run_cache():
+    assert current_dag_run_cache() is None
+    with use_dag_run_cache(DagRunCache()) as cache:
+        assert current_dag_run_cache() is cache
+        assert await asyncio.create_task(_current()) is cache
+    assert current_dag_run_cache() is None
+
+
+async def _current():
+    return current_dag_run_cache()
+
+
+@pytest.mark.asyncio
+async def test_dag_run_cache_get_batch():
+    num_calls = 0
+
+    async def fetch():
+        nonlocal num_calls
+        num_calls += 1
+        return [
+            {"dag_run_id": "r1", "conf": {"batch_id": "b1"}},
+            {"dag_run_id": "r2", "conf": {"batch_id": "b2"}},
+            {"dag_run_id": "r3", "conf": {}},
+        ]
+
+    cache = DagRunCache()
+    assert [r["dag_run_id"] for r in await cache.get_batch("url", "dag_a", "b1", fetch)] == ["r1"]
+    assert [r["dag_run_id"] for r in await cache.get_batch("url", "dag_a", "b2", fetch)] == ["r2"]
+    assert [r["dag_run_id"] for r in await cache.get_batch("url", "dag_a", None, fetch)] == ["r3"]
+    assert await cache.get_batch("url", "dag_a", "b3", fetch) == []
+    assert num_calls == 1
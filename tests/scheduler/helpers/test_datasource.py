@@ -0,0 +1,218 @@
+import json
+import pickle
+import sqlite3
+
+import pytest
+
+from scheduler.helpers import aiohttp_requests as ar
+from scheduler.helpers.airflow_api import (
+    RestDataSource, SQLDataSource, get_dag_runs, get_task_instance, get_xcom, get_xcoms, request_dag_runs_bulk,
+    set_data_source
+)
+from scheduler.helpers.aiohttp_requests import Non200Response
+from scheduler.simulator import SIMULATED_API_URL, SimulatedAirflow, VirtualClock
+
+# the columns of the Airflow 2 metadata tables that are read, with their indices
+SCHEMA = """
+CREATE TABLE dag_run (
+    id INTEGER PRIMARY KEY, dag_id VARCHAR(250) NOT NULL, run_id VARCHAR(250) NOT NULL, state VARCHAR(50),
+    conf BLOB, execution_date TIMESTAMP NOT NULL, start_date TIMESTAMP, end_date TIMESTAMP,
+    UNIQUE (dag_id, run_id)
+);
+CREATE INDEX dag_id_state ON dag_run (dag_id, state);
+CREATE TABLE task_instance (
+    task_id VARCHAR(250) NOT NULL, dag_id VARCHAR(250) NOT NULL, run_id VARCHAR(250) NOT NULL,
+    map_index INTEGER NOT NULL DEFAULT -1, start_date TIMESTAMP, end_date TIMESTAMP, state VARCHAR(20),
+    try_number INTEGER, PRIMARY KEY (dag_id, task_id, run_id, map_index)
+);
+CREATE TABLE xcom (
+    dag_run_id INTEGER NOT NULL, task_id VARCHAR(250) NOT NULL, map_index INTEGER NOT NULL DEFAULT -1,
+    key VARCHAR(512) NOT NULL, dag_id VARCHAR(250) NOT NULL, run_id VARCHAR(250) NOT NULL, value BLOB,
+    timestamp TIMESTAMP NOT NULL, PRIMARY KEY (dag_run_id, task_id, map_index, key)
+);
+CREATE INDEX idx_xcom_task_instance ON xcom (dag_id, task_id, run_id, map_index);
+"""
+
+
+@pytest.fixture
+def metadata_db(tmp_path):
+    path = tmp_path / "airflow.db"
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    dag_runs = [
+        (1, "a", "r1", "success", {"batch_id": "b1", "scene_id": "s1"}, "2024-01-01 00:00:00", "2024-01-01 00:00:01", "2024-01-01 00:10:00"),
+        (2, "a", "r2", "running", {"batch_id": "b2", "scene_id": "s2"}, "2024-01-02 00:00:00", "2024-01-02 00:00:01", None),
+        (3, "b", "r3", "queued", None, "2024-01-03 00:00:00", None, None),
+    ]
+    connection.executemany(
+        "INSERT INTO dag_run VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(i, d, r, s, pickle.dumps(c) if c is not None else None, e, sd, ed) for i, d, r, s, c, e, sd, ed in dag_runs],
+    )
+    connection.execute("INSERT INTO task_instance VALUES ('t', 'a', 'r1', -1, '2024-01-01 00:00:02', '2024-01-01 00:09:00', 'success', 1)")
+    connection.execute(
+        "INSERT INTO xcom VALUES (1, 't', -1, 'return_value', 'a', 'r1', ?, '2024-01-01 00:09:00')",
+        (json.dumps([{"frame": 1}, {"frame": 2}]).encode(),),
+    )
+    connection.commit()
+    connection.close()
+
+    # the conf are pickled as by Airflow 2
+    data_source = SQLDataSource.from_url(f"sqlite:///{path}", allow_pickle=True)
+    set_data_source(data_source)
+    yield data_source
+    set_data_source(None)
+    data_source.connection.close()
+
+
+@pytest.mark.asyncio
+async def test_sql_data_source(metadata_db):
+    dag_runs = await get_dag_runs("http://unused", "b1", "a", {})
+    assert dag_runs == [
+        {
+            "dag_id": "a",
+            "dag_run_id": "r1",
+            "state": "success",
+            "conf": {"batch_id": "b1", "scene_id": "s1"},
+            "logical_date": "2024-01-01T00:00:00+00:00",
+            "execution_date": "2024-01-01T00:00:00+00:00",
+            "start_date": "2024-01-01T00:00:01+00:00",
+            "end_date": "2024-01-01T00:10:00+00:00",
+        }
+    ]
+    df = await get_dag_runs("http://unused", "b2", "a", {}, to_dataframe=True, flatten_conf=True)
+    assert df[["dag_run_id", "dag_run_state", "scene_id"]].values.tolist() == [["r2", "running", "s2"]]
+
+    bulk = await request_dag_runs_bulk("http://unused", ["a", "b", "c"], {}, states=["running", "queued"])
+    assert {dag_id: [dr["dag_run_id"] for dr in runs] for dag_id, runs in bulk.items()} == {"a": ["r2"], "b": ["r3"], "c": []}
+    bulk = await request_dag_runs_bulk("http://unused", ["a", "b"], {}, execution_date_gte="2024-01-02T00:00:00+00:00")
+    assert [dr["dag_run_id"] for dr in bulk["a"] + bulk["b"]] == ["r2", "r3"]
+
+    ti = await get_task_instance("http://unused", "a", "r1", "t", {})
+    assert (ti["task_instance_state"], ti["end_date"], ti["try_number"]) == ("success", "2024-01-01T00:09:00+00:00", 1)
+    with pytest.raises(Non200Response):
+        await get_task_instance("http://unused", "a", "r2", "t", {})
+
+    xcom = await get_xcom("http://unused", "a", "r1", "t", {})
+    assert xcom[0]["value"] == "[{'frame': 1}, {'frame': 2}]"
+    with pytest.raises(Non200Response):
+        await get_xcom("http://unused", "a", "r1", "t", {}, xcom_key="missing")
+    assert await get_xcoms("http://unused", "a", [{"dag_run_id": "r1"}, {"dag_run_id": "r2"}], "t", {}) == {
+        "r1": "[{'frame': 1}, {'frame': 2}]"
+    }
+
+
+@pytest.mark.asyncio
+async def test_sql_data_source_conf_and_chunks(tmp_path):
+    path = tmp_path / "airflow.db"
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    # more DAGs and DagRuns than the SQLite limit of bound variables
+    connection.executemany(
+        "INSERT INTO dag_run VALUES (?, ?, ?, 'success', ?, '2024-01-01 00:00:00', NULL, NULL)",
+        [(i, f"d{i % 1200}", f"r{i}", json.dumps({"scene_id": f"s{i}"}).encode()) for i in range(2400)],
+    )
+    connection.executemany(
+        "INSERT INTO xcom VALUES (?, 't', -1, 'return_value', 'd0', ?, ?, '2024-01-01 00:00:00')",
+        [(i, f"r{i}", json.dumps(i).encode()) for i in range(2000)],
+    )
+    connection.execute("INSERT INTO dag_run VALUES (9999, 'p', 'r', 'success', ?, '2024-01-01 00:00:00', NULL, NULL)",
+                       (pickle.dumps({"scene_id": "s"}),))
+    connection.commit()
+    connection.close()
+
+    data_source = SQLDataSource.from_url(f"sqlite:///{path}")
+    try:
+        bulk = await data_source.dag_runs_bulk("http://unused", [f"d{i}" for i in range(1200)], {}, states=["success"])
+        assert len(bulk) == 1200 and all(len(runs) == 2 for runs in bulk.values())
+        assert [dr["conf"]["scene_id"] for dr in bulk["d7"]] == ["s7", "s1207"]
+        assert data_source.num_queries == 2
+
+        dag_runs = [{"dag_run_id": f"r{i}"} for i in range(2400)]
+        values = await data_source.xcoms_bulk("http://unused", "d0", dag_runs, "t", "return_value", {})
+        assert len(values) == 2000 and values["r1999"] == "1999"
+
+        # the pickled conf are not decoded unless explicitly allowed
+        with pytest.raises(ValueError, match="pickled"):
+            await data_source.dag_runs("http://unused", "p", {})
+    finally:
+        data_source.connection.close()
+    data_source = SQLDataSource.from_url(f"sqlite:///{path}", allow_pickle=True)
+    try:
+        assert (await data_source.dag_runs("http://unused", "p", {}))[0]["conf"] == {"scene_id": "s"}
+    finally:
+        data_source.connection.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("entries_by", ["dag_run_id", "execution_date", None])
+async def test_rest_xcoms_bulk(entries_by):
+    airflow = SimulatedAirflow(
+        VirtualClock(), default_duration=10, xcoms={"a.t.return_value": [1, 2], "a.t.other": 3}
+    )
+    for i in range(5):
+        airflow.clock.now = i
+        airflow.post_dag_run("a", {"dag_run_id": f"r{i}"})
+    airflow.advance(12)  # r0, r1 and r2 are success
+
+    async def transport(method, url, data=None):
+        if "/dagRuns/~/" not in url:
+            return await airflow(method, url, data)
+        if entries_by is None:  # the ~ wildcard is not supported
+            return 404, {"title": "Not Found"}
+        status, json_data = await airflow(method, url, data)
+        if entries_by == "execution_date":  # the entries of the older Airflow versions
+            json_data["xcom_entries"] = [{k: v for k, v in e.items() if k != "dag_run_id"} for e in json_data["xcom_entries"]]
+        return status, json_data
+
+    data_source = RestDataSource(xcom_page_limit=2)
+    set_data_source(data_source)
+    ar.set_transport(transport)
+    try:
+        dag_runs = await get_dag_runs(SIMULATED_API_URL, None, "a", {})
+        xcoms = await get_xcoms(SIMULATED_API_URL, "a", dag_runs, "t", {}, max_concurrency=2)
+        assert xcoms == {f"r{i}": "[1, 2]" for i in range(3)}
+        # the finished DagRuns are not read again, the running ones are listed one by one
+        xcoms = await get_xcoms(SIMULATED_API_URL, "a", dag_runs, "t", {})
+        assert len(xcoms) == 3
+        airflow.advance(13.5)  # r3 is success
+        dag_runs = await get_dag_runs(SIMULATED_API_URL, None, "a", {})
+        xcoms = await get_xcoms(SIMULATED_API_URL, "a", dag_runs, "t", {})
+        assert xcoms == {f"r{i}": "[1, 2]" for i in range(4)}
+        # the values of the DagRuns that are gone are dropped
+        xcoms = await get_xcoms(SIMULATED_API_URL, "a", dag_runs[1:], "t", {})
+        assert xcoms == {f"r{i}": "[1, 2]" for i in range(1, 4)}
+    finally:
+        ar.set_transport(None)
+        set_data_source(None)
+    if entries_by is not None:
+        # 2 pages of the entries of the return_value key, then the 2 + 2 + 1 unfinished DagRuns listed one by one
+        assert airflow.num_requests["list_xcoms"] == 2 + 2 + 2 + 1 and airflow.num_requests["xcom"] == 3 + 1
+        assert sorted(data_source._xcom_values[(SIMULATED_API_URL, "a", "t", "return_value")]) == ["r1", "r2", "r3", "r4"]
+    else:
+        assert "list_xcoms" not in airflow.num_requests and airflow.num_requests["xcom"] == 2 * (3 + 2 * 3) + (4 + 3) + (3 + 3)
+
+
+@pytest.mark.asyncio
+async def test_rest_xcoms_forget_batch():
+    airflow = SimulatedAirflow(VirtualClock(), default_duration=10, xcoms={"a.t.return_value": 1})
+    for i in range(4):
+        airflow.post_dag_run("a", {"dag_run_id": f"r{i}", "conf": {"batch_id": f"b{i % 2}"}})
+    airflow.advance(12)
+
+    data_source = RestDataSource()
+    set_data_source(data_source)
+    ar.set_transport(airflow)
+    try:
+        for batch_id in ["b0", "b1"]:
+            dag_runs = await get_dag_runs(SIMULATED_API_URL, batch_id, "a", {})
+            dag_runs = [{**dr, "batch_id": batch_id} for dr in dag_runs]
+            assert len(await get_xcoms(SIMULATED_API_URL, "a", dag_runs, "t", {})) == 2
+    finally:
+        ar.set_transport(None)
+        set_data_source(None)
+    # the values of a removed batch are dropped, then the cache of the key once it is empty
+    cache_key = (SIMULATED_API_URL, "a", "t", "return_value")
+    data_source.forget_batch("b0")
+    assert sorted(data_source._xcom_values[cache_key]) == ["r1", "r3"]
+    data_source.forget_batch("b1")
+    assert data_source._xcom_values == {} and data_source._xcom_list_pages == {}
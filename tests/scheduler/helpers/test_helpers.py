@@ -1,6 +1,7 @@
 import pandas as pd
+import pytest
 
-from scheduler.helpers.base import async_read_cookie_session, is_in_df, extract_values
+from scheduler.helpers.base import async_read_cookie_session, is_in_df, extract_values, extract_values_batch
 
 async def test_async_read_cookie_session():
     result = await async_read_cookie_session("conf/cookie_session")
@@ -44,5 +45,13 @@ def test_extract_values():
     assert extract_values('[{"split_map": 0, "obj_id": 100},{"split_map": 1, "obj_id": 200}]') == [0, 1]
     assert extract_values("[{'split_map': 0, 'obj_id': 100},{'split_map': 1, 'obj_id': 200}]") == [0, 1]
 
+
+def test_extract_values_batch():
+    inputs = ['[{"split_map": 0},{"split_map": 1}]', "[0,2]", "[{'split_map': 3, 'obj_id': 100}]"]
+    assert extract_values_batch(inputs) == [extract_values(i) for i in inputs] == [[0, 1], [0, 2], [3]]
+    assert extract_values_batch([]) == []
+    with pytest.raises(AssertionError):
+        extract_values_batch(["[0]", "[]"])
+
 # def test_read_cookie_session():
 #     assert read_cookie_session() == "b9c867dc-5319-4ad4-97e0-6474260b10de.x5LW6WQ0sSpk_vARkCsQzQfpXDE"
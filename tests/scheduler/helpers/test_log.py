@@ -0,0 +1,32 @@
+import json
+import sys
+
+from loguru import logger
+
+from scheduler.helpers.log import RateLimitFilter, setup_logging
+
+
+def test_rate_limit_filter():
+    lines = []
+    handler_id = logger.add(lines.append, level="DEBUG", format="{message}", filter=RateLimitFilter(max_records=2, interval=60))
+    try:
+        for i in range(5):
+            logger.info(f"tick {i}")
+        logger.warning("kept")
+    finally:
+        logger.remove(handler_id)
+    assert [line.strip() for line in lines] == ["tick 0", "tick 1", "kept"]
+
+
+def test_setup_logging_json():
+    lines = []
+    setup_logging("INFO", json=True, enqueue=False, sink=lines.append)
+    try:
+        calls = []
+        logger.opt(lazy=True).debug("skipped {}", lambda: calls.append(1))
+        logger.opt(lazy=True).info("result {}", lambda: {"scene_id": "s1"})
+    finally:
+        logger.remove()
+        logger.add(sys.stderr)
+    assert calls == []
+    assert [json.loads(line)["record"]["message"] for line in lines] == ["result {'scene_id': 's1'}"]
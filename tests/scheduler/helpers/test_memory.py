@@ -0,0 +1,41 @@
+import pandas as pd
+
+from scheduler.helpers import memory
+from scheduler.helpers.memory import SceneKeyTable, compact_dtypes, intern_scene_keys
+
+
+def test_scene_key_table():
+    table = SceneKeyTable()
+    a = table.intern(("".join(["scn", "_001"]), 1))
+    b = table.intern(["scn_001", 1])
+    assert a is b
+    assert len(table) == 1
+    assert ("scn_001", 1) in table
+
+    table.intern(("scn_002", 1))
+    table.retain([("scn_001", 1), ("scn_003", 1)])
+    assert len(table) == 1 and table.intern(("scn_001", 1)) is a
+
+
+def test_intern_scene_keys():
+    df1 = pd.DataFrame({"scene_id": ["s1", "s2"], "split_id": [0, 1]})
+    df2 = pd.DataFrame({"scene_id": ["s2"], "split_id": [1]})
+    keys1 = intern_scene_keys(df1, ["scene_id", "split_id"])
+    keys2 = intern_scene_keys(df2, ["scene_id", "split_id"])
+    assert keys1 == [("s1", 0), ("s2", 1)]
+    assert keys1[1] is keys2[0]
+    assert intern_scene_keys(pd.DataFrame([]), ["scene_id"]) == []
+
+
+def test_compact_dtypes():
+    df = pd.DataFrame({"dag_id": ["a", "a"], "state": ["success", "failed"], "scene_id": ["s1", "s2"]})
+    assert compact_dtypes(df.copy()).dtypes.tolist() == [object] * 3
+    memory.enable_compact_dtypes()
+    try:
+        compacted = compact_dtypes(df.copy())
+    finally:
+        memory.enable_compact_dtypes(False)
+    assert compacted.dag_id.dtype == "category"
+    assert compacted.state.dtype == "category"
+    assert compacted.scene_id.dtype == object
+    assert compacted[compacted.state == "success"].scene_id.tolist() == ["s1"]
@@ -0,0 +1,152 @@
+import asyncio
+import sys
+
+import pytest
+
+from scheduler.helpers.compute import configure_compute, run_compute, shutdown_compute
+from scheduler.helpers.profiler import SamplingProfiler, stop_after
+
+
+class Sensor:
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def sense(self):
+        self.profiler.sample(sys._getframe())
+
+
+class Watcher:
+    def __init__(self, profiler):
+        self.batch_id, self.dag_id = "b", "d"
+        self.upstream_sensors = [Sensor(profiler), Sensor(profiler)]
+
+    def watch(self):
+        for sensor in self.upstream_sensors:
+            sensor.sense()
+        self.upstream_sensors[0].profiler.sample(sys._getframe())
+
+
+def test_sampling_profiler(tmp_path):
+    profiler = SamplingProfiler(interval=0.01)
+    watcher = Watcher(profiler)
+    profiler.label([watcher])
+    watcher.watch()
+    assert profiler.num_samples == 3
+
+    # the samples are attributed to the watcher and the sensor frames they are in
+    assert {(w, s) for _, w, s in profiler.samples} == {("b.d", None), ("b.d", "b.d.0-Sensor"), ("b.d", "b.d.1-Sensor")}
+    lines = profiler.folded(lambda w, s: s == "b.d.1-Sensor")
+    assert len(lines) == 1 and lines[0].endswith(" 1")
+    frames = lines[0].rsplit(" ", 1)[0].split(";")
+    assert frames[-2].startswith("Watcher.watch") and frames[-1].startswith("Sensor.sense")
+
+    summary = profiler.write(tmp_path)
+    # the identical stacks of the two sensors are merged in the watcher's
+    lines = (tmp_path / "watchers" / "b.d.folded").read_text().splitlines()
+    assert sorted(line.rsplit(" ", 1)[1] for line in lines) == ["1", "2"]
+    assert sorted(p.name for p in (tmp_path / "sensors").iterdir()) == ["b.d.0-Sensor.folded", "b.d.1-Sensor.folded"]
+    assert "Sensor.sense" in summary.read_text()
+
+
+def busy(seconds):
+    import time
+
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class ComputeSensor:
+    async def sense(self):
+        await run_compute(busy, 0.3)
+
+
+class ComputeWatcher:
+    def __init__(self):
+        self.batch_id, self.dag_id = "b", "c"
+        self.upstream_sensors = [ComputeSensor()]
+
+    async def watch(self):
+        await self.upstream_sensors[0].sense()
+
+
+@pytest.mark.asyncio
+async def test_compute_samples_attributed():
+    configure_compute("thread", max_workers=1)
+    profiler = SamplingProfiler(interval=0.005)
+    watcher = ComputeWatcher()
+    profiler.label([watcher])
+    profiler.start()
+    try:
+        await watcher.watch()
+        await run_compute(busy, 0.1)  # not submitted by a watcher
+    finally:
+        profiler.stop()
+        shutdown_compute()
+    labels = {(w, s) for stack, w, s in profiler.samples if any(f.startswith("busy") for f in stack)}
+    assert ("b.c", "b.c.0-ComputeSensor") in labels and (None, None) in labels
+    assert all(stack[0].startswith("compute") for stack, w, s in profiler.samples if w == "b.c" and s is not None)
+
+
+@pytest.mark.asyncio
+async def test_stop_after():
+    ticks = []
+
+    async def tick_forever():
+        while True:
+            ticks.append(1)
+            await asyncio.sleep(0.01)
+
+    task = asyncio.create_task(tick_forever())
+    await stop_after([task], lambda: len(ticks), ticks=3)
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert len(ticks) >= 3
+
+
+@pytest.mark.asyncio
+async def test_profile_written_on_sigterm(aiohttp_server, tmp_path):
+    import signal
+    from pathlib import Path
+
+    from aiohttp import web
+
+    requests = []
+
+    async def dag_runs(request):
+        requests.append(request.path)
+        return web.json_response({"dag_runs": [], "total_entries": 0})
+
+    app = web.Application()
+    app.router.add_get("/api/v1/dags/d/dagRuns", dag_runs)
+    airflow = await aiohttp_server(app)
+
+    (tmp_path / "cookie").write_text("secret")
+    (tmp_path / "b.yml").write_text(
+        "watchers:\n"
+        "  - dag_id: d\n"
+        "    class: scheduler.watcher.restapi_watcher.RestAPIWatcher\n"
+        "    fixed_dag_run_conf: {}\n"
+        "    scene_id_keys: [scene_id]\n"
+        "    watch_interval: 0.2\n"
+        "    upstream: []\n"
+    )
+    main = Path(__file__).parents[3] / "main.py"
+    # neither --profile-ticks nor --profile-seconds: the profile is written when the scheduler is stopped
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, str(main), "--batch-config", str(tmp_path / "b.yml"), "--cookie-session-path",
+        str(tmp_path / "cookie"), "--api-url", str(airflow.make_url("")).rstrip("/"), "--profile", str(tmp_path / "prof"),
+        "--log-level", "WARNING", stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(200):
+            if len(requests) >= 3:
+                break
+            await asyncio.sleep(0.05)
+        assert len(requests) >= 3
+        process.send_signal(signal.SIGTERM)
+        assert await asyncio.wait_for(process.wait(), 20) == 0
+    finally:
+        if process.returncode is None:
+            process.kill()
+    assert (tmp_path / "prof" / "summary.txt").exists() and (tmp_path / "prof" / "all.folded").exists()
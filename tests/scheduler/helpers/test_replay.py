@@ -0,0 +1,98 @@
+import pytest
+from aiohttp import web
+
+from scheduler.helpers import aiohttp_requests as ar
+from scheduler.helpers.replay import ReplayServer, load_recording
+
+
+@pytest.mark.asyncio
+async def test_record_and_replay(aiohttp_server, tmp_path):
+    runs = []
+
+    async def dag_runs(request):
+        return web.json_response({"dag_runs": list(runs), "total_entries": len(runs)})
+
+    async def post_run(request):
+        run = {"dag_run_id": f"run_{len(runs)}", "state": "queued", "conf": (await request.json())["conf"]}
+        runs.append(run)
+        return web.json_response(run)
+
+    app = web.Application()
+    app.router.add_get("/api/v1/dags/a/dagRuns", dag_runs)
+    app.router.add_post("/api/v1/dags/a/dagRuns", post_run)
+    airflow = await aiohttp_server(app)
+    url = str(airflow.make_url("/api/v1/dags/a/dagRuns"))
+
+    path = tmp_path / "airflow.jsonl.gz"
+    recorder = ar.start_recording(path)
+    try:
+        live = [await ar.get(url, cookies={"session": "secret"})]
+        live.append(await ar.post(url, {"conf": {"scene_id": "s1"}}))
+        live.append(await ar.get(url))
+    finally:
+        ar.stop_recording()
+    assert recorder.num_records == 3
+    assert ("GET", "/api/v1/dags/a/dagRuns") in load_recording(path)
+
+    replay = ReplayServer(path)
+    server = await aiohttp_server(replay.make_app())
+    url = str(server.make_url("/api/v1/dags/a/dagRuns"))
+    for _ in range(2):
+        replayed = [await ar.get(url), await ar.post(url, {"conf": {"scene_id": "s1"}}), await ar.get(url)]
+        assert replayed == live
+        replay.reset()
+
+    with pytest.raises(ar.Non200Response):
+        await ar.get(str(server.make_url("/api/v1/dags/b/dagRuns")))
+    assert replay.misses == {("GET", "/api/v1/dags/b/dagRuns"): 3}
+    await ar.close_session()
+
+
+@pytest.mark.asyncio
+async def test_recording_survives_sigterm(aiohttp_server, tmp_path):
+    import asyncio
+    import signal
+    import sys
+    from pathlib import Path
+
+    requests = []
+
+    async def dag_runs(request):
+        requests.append(request.path)
+        return web.json_response({"dag_runs": [], "total_entries": 0})
+
+    app = web.Application()
+    app.router.add_get("/api/v1/dags/d/dagRuns", dag_runs)
+    airflow = await aiohttp_server(app)
+
+    (tmp_path / "cookie").write_text("secret")
+    (tmp_path / "b.yml").write_text(
+        "watchers:\n"
+        "  - dag_id: d\n"
+        "    class: scheduler.watcher.restapi_watcher.RestAPIWatcher\n"
+        "    fixed_dag_run_conf: {}\n"
+        "    scene_id_keys: [scene_id]\n"
+        "    watch_interval: 0.2\n"
+        "    upstream: []\n"
+    )
+    path = tmp_path / "airflow.jsonl.gz"
+    main = Path(__file__).parents[3] / "main.py"
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, str(main), "--batch-config", str(tmp_path / "b.yml"), "--cookie-session-path",
+        str(tmp_path / "cookie"), "--api-url", str(airflow.make_url("")).rstrip("/"), "--record-http", str(path),
+        "--log-level", "WARNING", stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(200):
+            if len(requests) >= 3:
+                break
+            await asyncio.sleep(0.05)
+        assert len(requests) >= 3
+        process.send_signal(signal.SIGTERM)
+        assert await asyncio.wait_for(process.wait(), 20) == 0
+    finally:
+        if process.returncode is None:
+            process.kill()
+    # the gzip trailer is written, and the records made before SIGTERM are all there
+    recorded = load_recording(path)[("GET", "/api/v1/dags/d/dagRuns")]
+    assert len(recorded) >= 3 and all(r["status"] == 200 for r in recorded)
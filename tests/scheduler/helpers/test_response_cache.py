@@ -0,0 +1,28 @@
+from scheduler.helpers.response_cache import ResponseCache
+
+
+def test_response_cache():
+    cache = ResponseCache(max_entries=2, ttl={"/dags/[^/]+$": 60})
+
+    # no validators and no TTL: not cached
+    cache.store(("http://a/api/v1/dags/d/dagRuns", None, None), "http://a/api/v1/dags/d/dagRuns", {"dag_runs": []}, now=0)
+    assert len(cache) == 0
+
+    key = ("http://a/api/v1/dags/d", None, None)
+    cache.store(key, key[0], {"is_paused": False}, now=0)
+    entry, fresh = cache.lookup(key, now=30)
+    assert fresh and entry.json_data == {"is_paused": False}
+    assert cache.lookup(key, now=61) == (None, False)  # expired, and nothing to revalidate it with
+
+    etag_key = ("http://a/x", None, None)
+    cache.store(etag_key, etag_key[0], [1], etag='"v1"', now=0)
+    entry, fresh = cache.lookup(etag_key, now=1000)
+    assert not fresh and entry.conditional_headers() == {"If-None-Match": '"v1"'}
+    assert cache.revalidated(etag_key, etag_key[0], entry).json_data == [1]
+
+    # LRU eviction
+    cache.store(("http://a/y", None, None), "http://a/y", [2], last_modified="Mon", now=0)
+    cache.store(("http://a/z", None, None), "http://a/z", [3], last_modified="Mon", now=0)
+    assert cache.lookup(etag_key) == (None, False)
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["revalidations"] == 1
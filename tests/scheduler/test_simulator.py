@@ -0,0 +1,98 @@
+import pytest
+
+from scheduler.helpers import aiohttp_requests as ar
+from scheduler.simulator import SIMULATED_API_URL, Simulation, SimulatedAirflow, VirtualClock
+from scheduler.watcher.batch import Batch
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("bulk_fetch", [False, True])
+async def test_simulation(bulk_fetch):
+    cfg = {
+        "watchers": [
+            {
+                "dag_id": "up",
+                "class": "scheduler.watcher.restapi_watcher.RestAPIWatcher",
+                "fixed_dag_run_conf": {},
+                "scene_id_keys": ["scene_id"],
+                "max_running_dag_runs": 2,
+                "max_triggers_per_tick": 2,
+                "upstream": [
+                    {
+                        "class": "scheduler.upstream_sensor.static_scene_list_sensor.StaticSceneListSensor",
+                        "args": {"scene_list": [{"scene_id": f"s{i}"} for i in range(4)]},
+                    }
+                ],
+            },
+            {
+                "dag_id": "down",
+                "class": "scheduler.watcher.restapi_watcher.RestAPIWatcher",
+                "fixed_dag_run_conf": {},
+                "scene_id_keys": ["scene_id"],
+                "upstream": [{"class": "scheduler.upstream_sensor.dag_sensor.DagSensor", "args": {"dag_id": "up"}}],
+            },
+        ]
+    }
+    airflow = SimulatedAirflow(VirtualClock(), default_duration=100, durations={"down": 50})
+    report = await Simulation([Batch("b", cfg, SIMULATED_API_URL, {})], airflow, bulk_fetch=bulk_fetch).run()
+    assert ar._transport is None
+    assert ("list_dag_runs_bulk" in airflow.num_requests) == bulk_fetch
+
+    assert report.dags["up"]["success"] == report.dags["down"]["success"] == 4
+    assert report.terminal_dag_ids == ["down"]
+    assert report.completed_scenes == 4
+    # two waves of 2 x 100s upstream runs (triggered on the 10s cycles), then the last 50s downstream run
+    assert 250 <= report.makespan <= 290
+    assert report.dags["up"]["utilization"] == pytest.approx(2 * 2 * 100 / (2 * report.makespan))
+    # the cycles where nothing can change are skipped
+    assert report.num_cycles < report.makespan / 10
+
+
+@pytest.mark.asyncio
+async def test_scene_retirement(tmp_path):
+    from scheduler.helpers.done_set import get_done_set, set_done_set
+
+    cfg = {
+        "watchers": [
+            {
+                "dag_id": "up",
+                "class": "scheduler.watcher.restapi_watcher.RestAPIWatcher",
+                "fixed_dag_run_conf": {},
+                "scene_id_keys": ["scene_id"],
+                "max_running_dag_runs": 4,
+                "max_triggers_per_tick": 4,
+                "upstream": [
+                    {
+                        "class": "scheduler.upstream_sensor.static_scene_list_sensor.StaticSceneListSensor",
+                        "args": {"scene_list": [{"scene_id": f"s{i}"} for i in range(4)]},
+                    }
+                ],
+            },
+            {
+                "dag_id": "down",
+                "class": "scheduler.watcher.restapi_watcher.RestAPIWatcher",
+                "fixed_dag_run_conf": {},
+                "scene_id_keys": ["scene_id"],
+                "upstream": [{"class": "scheduler.upstream_sensor.dag_sensor.DagSensor", "args": {"dag_id": "up"}}],
+            },
+        ]
+    }
+    try:
+        batch = Batch("b", cfg, SIMULATED_API_URL, {}, state_dir=tmp_path)
+        assert [w.dag_id for w in batch.terminal_watchers()] == ["down"]
+        assert get_done_set("b") is batch.done_set and batch.watchers[1].done_set is batch.done_set
+        airflow = SimulatedAirflow(VirtualClock(), default_duration=100)
+        report = await Simulation([batch], airflow).run()
+        assert report.completed_scenes == 4
+        # every scene is done once its "down" DagRun succeeded, and each was triggered only once
+        assert len(batch.done_set) == 4 and report.dags["up"]["triggered"] == 4
+        assert len((tmp_path / "b.done.jsonl").read_text().splitlines()) == 4
+
+        # after a restart, the done scenes are not triggered again, even though their DagRuns are gone
+        batch = Batch("b", cfg, SIMULATED_API_URL, {}, state_dir=tmp_path)
+        assert ("s2",) in batch.done_set
+        airflow = SimulatedAirflow(VirtualClock(), default_duration=100)
+        report = await Simulation([batch], airflow).run(max_time=600)
+        assert report.dags["up"]["triggered"] == report.dags["down"]["triggered"] == 0
+    finally:
+        set_done_set("b", None)
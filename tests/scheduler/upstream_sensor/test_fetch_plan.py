@@ -0,0 +1,56 @@
+import pytest
+
+from scheduler.helpers import aiohttp_requests as ar
+from scheduler.helpers.airflow_api import set_data_source
+from scheduler.simulator import SIMULATED_API_URL, SimulatedAirflow, VirtualClock
+from scheduler.watcher.base import create_watcher
+
+
+@pytest.mark.asyncio
+async def test_fetch_plan():
+    airflow = SimulatedAirflow(VirtualClock(), default_duration=10, xcoms={"split.split_map.return_value": [0, 1]})
+    for scene_id in ["s1", "s2"]:
+        for dag_id in ["up", "split"]:
+            airflow.post_dag_run(dag_id, {"conf": {"batch_id": "b", "scene_id": scene_id}})
+    airflow.advance(100)
+
+    wcfg = {
+        "dag_id": "down",
+        "class": "scheduler.watcher.restapi_watcher.RestAPIWatcher",
+        "fixed_dag_run_conf": {},
+        "scene_id_keys": ["scene_id", "split_id"],
+        "upstream": [
+            {
+                "class": "scheduler.upstream_sensor.dag_sensor.ExpandableDagSensor",
+                "args": {
+                    "dag_id": "up",
+                    "base_scene_id_keys": ["scene_id"],
+                    "expand_by": {"dag_id": "split", "task_id": "split_map", "xcom_key": "return_value", "refer_name": "split_id"},
+                },
+            },
+            {
+                "class": "scheduler.upstream_sensor.task_sensor.ExpandableTaskSensor",
+                "args": {
+                    "dag_id": "up",
+                    "task_id": "t",
+                    "base_scene_id_keys": ["scene_id"],
+                    "expand_by": {"dag_id": "split", "task_id": "split_map", "xcom_key": "return_value", "refer_name": "split_id"},
+                },
+            },
+        ],
+    }
+    watcher = create_watcher(SIMULATED_API_URL, "b", {}, wcfg)
+    plan = watcher.fetch_plan
+    assert all(sensor.fetch_plan is plan for sensor in watcher.upstream_sensors)
+    assert sorted(k[0] for k in plan.shared_fetches) == ["dag_runs", "dag_runs", "xcoms"]
+
+    set_data_source(None)  # without the xcom values cached by the other tests
+    ar.set_transport(airflow)
+    try:
+        ready_scenes = await watcher.get_all_upstream_ready_scenes()
+    finally:
+        ar.set_transport(None)
+    assert sorted((s["scene_id"], s["split_id"]) for s in ready_scenes) == [("s1", 0), ("s1", 1), ("s2", 0), ("s2", 1)]
+    # each DAG is listed once, and the xcoms of each split run are listed and read once, for both sensors
+    assert airflow.num_requests == {"list_dag_runs": 2, "task_instance": 2, "list_xcoms": 1, "xcom": 2}
+    assert plan.num_shared == 2
@@ -6,6 +6,7 @@ pd.set_option("display.max_columns", None)
 
 from scheduler.upstream_sensor.dag_sensor import ReducibleDagSensor
 from scheduler.upstream_sensor.task_sensor import ReducibleTaskSensor
+from scheduler.upstream_sensor.reducible import reduce_dataframe
 
 
 @pytest.fixture
@@ -106,3 +107,45 @@ async def test_reduce_when_xcom_task_not_success(cookies):
     reduced_df = await sensor.sense()
     assert isinstance(reduced_df, pd.DataFrame)
     assert len(reduced_df) == 0
+
+
+def test_reduce_dataframe():
+    df = pd.DataFrame(
+        {
+            "batch_id": ["b"] * 5,
+            "dag_id": ["dag_expandable"] * 5,
+            "dag_run_id": ["s1_0", "s1_1", "s2_0", "s2_1", "s3_0"],
+            "dag_run_state": ["success", "success", "success", "failed", "success"],
+            "scene_id": ["s1", "s1", "s2", "s2", "s3"],
+            "split_id": [0, 1, 0, 1, 0],
+            "conf": [{}] * 5,
+            "state": ["success", "success", "success", "failed", "success"],
+        }
+    )
+    xcom_expanded_df = pd.DataFrame({"scene_id": ["s1", "s1", "s2", "s2", "s3", "s3"], "split_id": [0, 1, 0, 1, 0, 1]})
+    reduced_df = reduce_dataframe(df, xcom_expanded_df, ["scene_id"], "split_id")
+    assert list(reduced_df.columns) == ["scene_id", "batch_id", "dag_id", "dag_run_id", "dag_run_state", "state"]
+    assert reduced_df.scene_id.tolist() == ["s1", "s2", "s3"]
+    assert reduced_df.batch_id.tolist()[:2] == ["b", "b"]
+    assert reduced_df.loc[2].batch_id == {"b", np.nan}
+    assert reduced_df.dag_run_id.tolist()[:2] == [{"s1_0", "s1_1"}, {"s2_0", "s2_1"}]
+    assert reduced_df.dag_run_state.tolist()[:2] == ["success", {"success", "failed"}]
+    assert reduced_df.state.tolist() == ["success", "failed", "failed"]
+
+
+def test_reduce_dataframe_all_null_column():
+    # end_date is None on the DagRuns that have not finished, and s2 has no DagRun yet (NaN after the merge)
+    df = pd.DataFrame(
+        {
+            "scene_id": ["s1", "s1"],
+            "split_id": [0, 1],
+            "conf": [{}] * 2,
+            "state": ["running"] * 2,
+            "end_date": pd.Series([None, None], dtype=object),
+        }
+    )
+    xcom_expanded_df = pd.DataFrame({"scene_id": ["s1", "s1", "s2", "s2"], "split_id": [0, 1, 0, 1]})
+    reduced_df = reduce_dataframe(df, xcom_expanded_df, ["scene_id"], "split_id")
+    # like the pure python aggregation, the all-null column is float64 NaN
+    assert reduced_df["end_date"].dtype == np.float64 and reduced_df["end_date"].isna().all()
+    assert reduced_df.state.tolist() == ["failed", "failed"]
@@ -171,6 +171,72 @@ async def test_static_scene_list_sensor():
     )
 
 
+@pytest.mark.asyncio
+async def test_static_scene_list_sensor_from_file(tmp_path):
+    csv_path = tmp_path / "scenes.csv"
+    csv_path.write_text("scene_id\nscn_001\nscn_002\n")
+    sensor = StaticSceneListSensor("http", "a_batch_id", {}, scene_list_path=str(csv_path))
+    status_df = await sensor.sense(state="success")
+    assert status_df.scene_id.tolist() == ["scn_001", "scn_002"]
+    assert status_df.batch_id.tolist() == ["a_batch_id"] * 2
+    assert sensor.scene_keys == {("scn_001",), ("scn_002",)}
+    assert await sensor.sense(state="success") is status_df  # not rebuilt while the file is unchanged
+    assert len(await sensor.sense(state="failed")) == 0
+
+    csv_path.write_text("scene_id\nscn_001\nscn_002\nscn_003\n")
+    status_df = await sensor.sense()
+    assert status_df.scene_id.tolist() == ["scn_001", "scn_002", "scn_003"]
+
+    jsonl_path = tmp_path / "scenes.jsonl"
+    jsonl_path.write_text('{"scene_id": "scn_001", "split_id": 0}\n{"scene_id": "scn_001", "split_id": 1}\n')
+    sensor = StaticSceneListSensor("http", "a_batch_id", {}, scene_list_path=str(jsonl_path))
+    status_df = await sensor.sense()
+    assert status_df[["scene_id", "split_id"]].values.tolist() == [["scn_001", 0], ["scn_001", 1]]
+
+
+@pytest.mark.asyncio
+async def test_static_scene_list_sensor_dtypes(tmp_path):
+    # the values are not guessed: the ids that look like numbers stay the strings of the DagRun confs
+    csv_path = tmp_path / "scenes.csv"
+    csv_path.write_text("scene_id,split_id\n000123,0\n20231102,1\n")
+    sensor = StaticSceneListSensor("http", "a_batch_id", {}, scene_list_path=str(csv_path))
+    status_df = await sensor.sense()
+    assert status_df[["scene_id", "split_id"]].values.tolist() == [["000123", "0"], ["20231102", "1"]]
+    assert sensor.scene_keys == {("000123", "0"), ("20231102", "1")}
+
+    sensor = StaticSceneListSensor(
+        "http", "a_batch_id", {}, scene_list_path=str(csv_path), scene_list_dtypes={"split_id": "int"}
+    )
+    assert sensor.scene_keys == frozenset()
+    await sensor.sense()
+    assert sensor.scene_keys == {("000123", 0), ("20231102", 1)}
+
+    jsonl_path = tmp_path / "scenes.jsonl"
+    jsonl_path.write_text('{"scene_id": "000123", "date": "20231102"}\n')
+    sensor = StaticSceneListSensor("http", "a_batch_id", {}, scene_list_path=str(jsonl_path))
+    status_df = await sensor.sense()
+    assert status_df[["scene_id", "date"]].values.tolist() == [["000123", "20231102"]]
+
+
+@pytest.mark.asyncio
+async def test_static_scene_list_sensor_from_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    parquet_path = tmp_path / "scenes.parquet"
+    pd.DataFrame({"scene_id": ["scn_001", "scn_002"], "split_id": [0, 1]}).to_parquet(parquet_path)
+    sensor = StaticSceneListSensor("http", "a_batch_id", {}, scene_list_path=str(parquet_path))
+    status_df = await sensor.sense(state="success")
+    assert status_df[["scene_id", "split_id"]].values.tolist() == [["scn_001", 0], ["scn_002", 1]]
+    assert sensor.scene_keys == {("scn_001", 0), ("scn_002", 1)}
+
+
+def test_static_scene_list_sensor_parquet_without_pyarrow(tmp_path, monkeypatch):
+    from scheduler.upstream_sensor import static_scene_list_sensor
+
+    monkeypatch.setattr(static_scene_list_sensor, "pq", None)
+    with pytest.raises(AssertionError, match="pyarrow is required"):
+        StaticSceneListSensor("http", "a_batch_id", {}, scene_list_path=str(tmp_path / "scenes.parquet"))
+
+
 @pytest.mark.asyncio
 async def test_get_mixed_sensor_results(cookies):
     upstream_sensors = [
@@ -0,0 +1,348 @@
+import pytest
+
+from scheduler.helpers.airflow_api import RestDataSource, set_data_source
+from scheduler.helpers.done_set import DoneSet
+from scheduler.helpers.memory import intern_scene_key, scene_key_table
+from scheduler.watcher.base import BaseWatcher, WatchResult
+from scheduler.watcher.batch import Batch, scan_batch_configs
+from scheduler.watcher.coordinator import Coordinator, build_dependency_graph, topological_order
+
+
+class StubWatcher(BaseWatcher):
+    def __init__(self, dag_id, upstream_dag_ids, ticks, watch_interval=10):
+        super().__init__(watch_interval=watch_interval)
+        self.dag_id = dag_id
+        self._upstream_dag_ids = set(upstream_dag_ids)
+        self.ticks = ticks
+
+    @property
+    def upstream_dag_ids(self):
+        return self._upstream_dag_ids
+
+    async def watch(self):
+        self.ticks.append(self.dag_id)
+        result = WatchResult()
+        result.action = "watch"
+        return result
+
+
+def test_topological_order():
+    ticks = []
+    watchers = [
+        StubWatcher("c", ["b", "a"], ticks),
+        StubWatcher("b", ["a"], ticks),
+        StubWatcher("a", [], ticks),
+        StubWatcher("d", ["external"], ticks),
+    ]
+    graph = build_dependency_graph(watchers)
+    assert graph == {0: {1, 2}, 1: {2}, 2: set(), 3: set()}
+    assert topological_order(graph) == [2, 1, 0, 3]
+    assert topological_order({0: {1}, 1: {0}, 2: set()}) == [2, 0, 1]
+
+
+@pytest.mark.asyncio
+async def test_coordinator_run_cycle():
+    ticks = []
+    watchers = [
+        StubWatcher("c", ["b"], ticks, watch_interval=10),
+        StubWatcher("b", ["a"], ticks, watch_interval=5),
+        StubWatcher("a", [], ticks, watch_interval=5),
+    ]
+    coordinator = Coordinator(watchers)
+    assert coordinator.interval == 5
+
+    await coordinator.run_cycle(now=0)
+    assert ticks == ["a", "b", "c"]
+    await coordinator.run_cycle(now=5)
+    assert ticks == ["a", "b", "c", "a", "b"]
+    await coordinator.run_cycle(now=10)
+    assert ticks == ["a", "b", "c", "a", "b", "a", "b", "c"]
+
+
+def test_scan_batch_configs(tmp_path):
+    (tmp_path / "batch_a.yml").write_text("watchers: []\n")
+    (tmp_path / "batch_b.yaml").write_text("watchers: []\n")
+    (tmp_path / "notes.txt").write_text("")
+    extra = tmp_path / "extra" / "batch_c.yml"
+    extra.parent.mkdir()
+    extra.write_text("watchers: []\n")
+    found = scan_batch_configs([extra, tmp_path / "missing.yml"], [tmp_path])
+    assert found == {"batch_a": tmp_path / "batch_a.yml", "batch_b": tmp_path / "batch_b.yaml", "batch_c": extra}
+
+
+@pytest.mark.asyncio
+async def test_coordinator_add_remove_batch():
+    batch_a = Batch("batch_a", {"watchers": []}, "http://airflow", {})
+    batch_a.watchers = [StubWatcher("b", ["a"], [], watch_interval=5), StubWatcher("a", [], [], watch_interval=5)]
+    for w in batch_a.watchers:
+        w.batch_id = "batch_a"
+    batch_b = Batch("batch_b", {"watchers": []}, "http://airflow", {})
+    batch_b.watchers = [StubWatcher("a", [], [], watch_interval=5)]
+    batch_b.watchers[0].batch_id = "batch_b"
+
+    coordinator = Coordinator()
+    coordinator.add_batch(batch_a)
+    coordinator.add_batch(batch_b)
+    assert [(w.batch_id, w.dag_id) for w in coordinator.order] == [("batch_a", "a"), ("batch_a", "b"), ("batch_b", "a")]
+    assert coordinator.graph == {0: {1}, 1: set(), 2: set()}
+
+    # the scene keys are forgotten with their batch, but for the done scenes of the remaining batches
+    batch_b.done_set = DoneSet(["scene_id"], ["a"])
+    batch_b.done_set.report("a", [intern_scene_key(["scn_b"])])
+    intern_scene_key(["scn_a"])
+    forgotten = []
+
+    class DataSource(RestDataSource):
+        def forget_batch(self, batch_id):
+            forgotten.append(batch_id)
+
+    set_data_source(DataSource())
+    try:
+        coordinator.remove_batch("batch_a")
+    finally:
+        set_data_source(None)
+    assert forgotten == ["batch_a"]
+    assert [(w.batch_id, w.dag_id) for w in coordinator.order] == [("batch_b", "a")]
+    assert ("scn_b",) in scene_key_table and ("scn_a",) not in scene_key_table
+    assert intern_scene_key(["".join(["scn_", "b"])]) is next(iter(batch_b.done_set))
+
+
+def test_batch_reload(tmp_path):
+    import copy
+    import yaml
+
+    path = tmp_path / "batch_a.yml"
+    cfg = yaml.safe_load(open("batch/dry_run.yml"))
+    path.write_text(yaml.safe_dump(cfg))
+    batch = Batch.from_file(path, "http://airflow", {})
+    coordinator = Coordinator()
+    coordinator.add_batch(batch)
+    before = {w.dag_id: w for w in batch.watchers}
+    ipm_sensors = list(before["generate_ipm"].upstream_sensors)
+    assert not batch.is_modified()
+
+    new_cfg = copy.deepcopy(cfg)
+    new_cfg["watchers"][0]["max_running_dag_runs"] = 5
+    new_cfg["watchers"][2]["upstream"].append({"class": "scheduler.upstream_sensor.dag_sensor.DagSensor", "args": {"dag_id": "image_undistort"}})
+    removed = new_cfg["watchers"].pop(1)
+    new_cfg["watchers"].append(dict(removed, dag_id="extra_dag"))
+    path.write_text(yaml.safe_dump(new_cfg) + "\n")
+    assert batch.is_modified()
+
+    changes = coordinator.reload_batch("batch_a")
+    assert changes["reconfigured"] == ["generate_base_data", "generate_ipm"]
+    assert changes["removed"] == ["nvidia_segmentation"]
+    assert changes["added"] == ["extra_dag"]
+    assert not batch.is_modified()
+
+    after = {w.dag_id: w for w in batch.watchers}
+    assert after["generate_base_data"] is before["generate_base_data"]
+    assert after["generate_base_data"].max_running_dag_runs == 5
+    ipm_after = after["generate_ipm"].upstream_sensors
+    assert len(ipm_after) == 3 and all(a is b for a, b in zip(ipm_after, ipm_sensors))
+    assert after["image_undistort"] is before["image_undistort"]
+    assert {w.dag_id for w in coordinator.watchers} == set(after)
+
+    # an invalid config leaves the batch as it was
+    bad_cfg = copy.deepcopy(new_cfg)
+    bad_cfg["watchers"][0]["max_running_dag_runs"] = 1
+    bad_cfg["watchers"][0]["trigger_ledger_ttl"] = 5
+    bad_cfg["watchers"][1]["scene_id_keys"] = []
+    ledger_ttl = after["generate_base_data"].ledger.ttl
+    with pytest.raises(AssertionError):
+        coordinator.reload_batch("batch_a", bad_cfg)
+    assert after["generate_base_data"].max_running_dag_runs == 5
+    assert after["generate_base_data"].ledger.ttl == ledger_ttl != 5
+    assert batch.watchers == list(after.values())
+
+
+@pytest.mark.asyncio
+async def test_capacity_pools():
+    import copy
+    import yaml
+    from scheduler.helpers.dag_run_cache import DagRunCache, use_dag_run_cache
+
+    cfg = yaml.safe_load(open("batch/dry_run.yml"))
+    cfg["pools"] = {"gpu": 2, "cpu": {"slots": 5}}
+    cfg["watchers"][1]["pool"] = "gpu"
+    cfg["watchers"][2]["pool"] = "gpu"
+    cfg["watchers"][3]["pool"] = "missing"
+    batch_a = Batch("batch_a", cfg, "http://airflow", {})
+    cfg_b = copy.deepcopy(cfg)
+    cfg_b["pools"] = {"gpu": 3}
+    batch_b = Batch("batch_b", cfg_b, "http://airflow", {})
+
+    coordinator = Coordinator()
+    coordinator.add_batch(batch_a)
+    coordinator.add_batch(batch_b)
+    assert sorted(coordinator.pools) == ["cpu", "gpu"]
+    gpu = coordinator.pools["gpu"]
+    assert gpu.slots == 3
+    assert sorted(dag_id for _, dag_id, _ in gpu.members) == ["generate_ipm", "nvidia_segmentation"]
+    assert batch_a.watchers[1].pool is gpu and batch_b.watchers[2].pool is gpu
+    assert batch_a.watchers[3].pool is None
+
+    cache = DagRunCache()
+    with use_dag_run_cache(cache):
+        cache.put("http://airflow", "nvidia_segmentation", [{"dag_run_id": "r1", "state": "running"}, {"dag_run_id": "r2", "state": "success"}])
+        cache.put("http://airflow", "generate_ipm", [{"dag_run_id": "r3", "state": "queued"}])
+        await gpu.refresh()
+        assert (gpu.occupied, gpu.available) == (2, 1)
+        gpu.acquire()
+        assert not gpu.has_capacity()
+
+        # the triggered DagRuns that are not listed yet take a slot
+        ledger = batch_a.watchers[2].ledger
+        ledger.record(("s1",), "r3")
+        ledger.record(("s2",), "r4")
+        await gpu.refresh({("http://airflow", "generate_ipm"): [ledger]})
+        assert (gpu.occupied, gpu.acquired) == (3, 0)
+
+    coordinator.remove_batch("batch_b")
+    assert coordinator.pools["gpu"] is gpu and gpu.slots == 2
+
+
+@pytest.mark.asyncio
+async def test_bulk_prefetch(aiohttp_server):
+    from aiohttp import web
+    from scheduler.helpers import aiohttp_requests as ar
+    from scheduler.helpers.dag_run_cache import DagRunCache
+
+    dag_runs = [{"dag_id": dag_id, "dag_run_id": f"r{i}", "state": "success", "conf": {}} for i, dag_id in enumerate("abcab")]
+    queries = []
+
+    async def list_dag_runs(request):
+        query = await request.json()
+        queries.append(query)
+        selected = [dr for dr in dag_runs if dr["dag_id"] in query["dag_ids"]]
+        page = selected[query["page_offset"]:query["page_offset"] + query["page_limit"]]
+        return web.json_response({"dag_runs": page, "total_entries": len(selected)})
+
+    app = web.Application()
+    app.router.add_post("/api/v1/dags/~/dagRuns/list", list_dag_runs)
+    server = await aiohttp_server(app)
+    api_url = str(server.make_url("")).rstrip("/")
+
+    coordinator = Coordinator([StubWatcher("b", ["a", "d"], [])], bulk_fetch=True)
+    for w in coordinator.watchers:
+        w.api_url, w.cookies = api_url, {}
+    cache = DagRunCache()
+    await coordinator.prefetch(cache, coordinator.watchers)
+    assert len(queries) == 1 and queries[0]["dag_ids"] == ["a", "b", "d"]
+    assert [dr["dag_run_id"] for dr in await cache.get(api_url, "a", None)] == ["r0", "r3"]
+    assert [dr["dag_run_id"] for dr in await cache.get(api_url, "b", None)] == ["r1", "r4"]
+    assert await cache.get(api_url, "d", None) == []
+
+    from scheduler.helpers.airflow_api import request_dag_runs_bulk
+    queries.clear()
+    result = await request_dag_runs_bulk(api_url, ["a", "b", "c"], {}, page_limit=2)
+    assert [q["page_offset"] for q in queries] == [0, 2, 4]
+    assert {dag_id: len(runs) for dag_id, runs in result.items()} == {"a": 2, "b": 2, "c": 1}
+    await ar.close_session()
+
+
+@pytest.mark.asyncio
+async def test_refresh_policy():
+    from scheduler.helpers import aiohttp_requests as ar
+    from scheduler.helpers.dag_state import RefreshPolicy
+    from scheduler.simulator import SIMULATED_API_URL, SimulatedAirflow, VirtualClock
+
+    airflow = SimulatedAirflow(VirtualClock(), default_duration=5)
+    airflow.post_dag_run("a", {"conf": {}})
+    airflow.advance(5)
+    coordinator = Coordinator([StubWatcher("b", ["a"], [])], refresh_policy=RefreshPolicy(hot=0, warm=30, cold=100, hot_for=15))
+    for w in coordinator.watchers:
+        w.api_url, w.cookies = SIMULATED_API_URL, {}
+    dag_state = coordinator.dag_state
+    ar.set_transport(airflow)
+    try:
+        # both DAGs are hot until 15s after their last change (the first fetch)
+        for now in (0, 10, 20):
+            await coordinator.run_cycle(now=now)
+        assert dag_state.stats() == {"hot": 0, "warm": 1, "cold": 1, "refreshes": 6, "reused": 0}
+        # a is waited on by b, until b is cold too
+        await coordinator.run_cycle(now=30)
+        assert dag_state.get(SIMULATED_API_URL, "a").tier == "cold"
+        for now in range(40, 120, 10):
+            await coordinator.run_cycle(now=now)
+        assert dag_state.num_refreshes == 6
+
+        # an external trigger is seen at the next refresh of the cold DAG, which is then hot
+        airflow.clock.now = 115
+        airflow.post_dag_run("a", {"conf": {}})
+        await coordinator.run_cycle(now=120)
+        state = dag_state.get(SIMULATED_API_URL, "a")
+        assert (state.tier, state.num_active, len(state.dag_runs)) == ("hot", 1, 2)
+        assert dag_state.num_refreshes == 8
+    finally:
+        ar.set_transport(None)
+
+
+@pytest.mark.asyncio
+async def test_staggered_phases():
+    from scheduler.watcher.base import stagger_phases
+
+    ticks = []
+    watchers = [StubWatcher(dag_id, [], ticks, watch_interval=30) for dag_id in "abc"]
+    coordinator = Coordinator(watchers, cycle_interval=10, stagger="spread")
+    assert [w.phase for w in watchers] == [0, 10, 20]
+    for now in range(0, 70, 10):
+        await coordinator.run_cycle(now=now)
+    assert ticks == ["a", "b", "c", "a", "b", "c", "a"]
+
+    watchers = [StubWatcher("a", [], []), StubWatcher("b", [], [])]
+    watchers[0].batch_id = watchers[1].batch_id = "batch"
+    stagger_phases(watchers, "hash")
+    phases = [w.phase for w in watchers]
+    assert all(0 <= p < 10 for p in phases) and phases[0] != phases[1]
+    watchers[0].phase = None
+    stagger_phases(watchers, "hash")
+    assert [w.phase for w in watchers] == phases
+
+    # fixed rate: the next slot after an overrun, delay: one interval after the end
+    w = watchers[0]
+    assert w.next_start(100, 103) == 113
+    w.set_schedule(fixed_rate=True)
+    assert w.next_start(100, 103) == 110
+    assert w.next_start(100, 125) == 130
+
+
+class SlowWatcher(StubWatcher):
+    def __init__(self, dag_id, delay, cancelled):
+        super().__init__(dag_id, [], [], watch_interval=1)
+        self.delay = delay
+        self.cancelled = cancelled
+
+    async def watch(self):
+        import asyncio
+
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(self.dag_id)
+            raise
+        result = WatchResult()
+        result.action = "trigger"
+        return result
+
+    async def trigger(self, context):
+        self.ticks.append(self.dag_id)
+
+
+@pytest.mark.asyncio
+async def test_tick_deadline():
+    cancelled = []
+    slow, fast = SlowWatcher("slow", 0.5, cancelled), SlowWatcher("fast", 0.01, cancelled)
+    coordinator = Coordinator([slow, fast], tick_deadline=0.1)
+    await coordinator.run_cycle(now=0)
+    # the slow watch is cancelled and triggers nothing, the next watcher still ticks
+    assert cancelled == ["slow"] and slow.ticks == [] and fast.ticks == ["fast"]
+    stats = coordinator.tick_stats()
+    assert (stats["None/slow"]["ticks"], stats["None/slow"]["timeouts"], stats["None/fast"]["timeouts"]) == (1, 1, 0)
+    assert stats["None/slow"]["max_duration"] < 0.5
+
+    # without a deadline, a watch longer than watch_interval is an overrun
+    slow.delay = 1.1
+    slow.set_deadline(None)
+    result = await slow.tick()
+    assert result.action == "trigger" and slow.tick_stats()["overruns"] == 1
@@ -0,0 +1,16 @@
+from scheduler.watcher.ledger import TriggerLedger
+
+
+def test_trigger_ledger():
+    ledger = TriggerLedger(ttl=60)
+    ledger.record(("s1",), "run_1", now=0)
+    ledger.record(("s2",), None, now=10)
+    ledger.record(("s3",), "run_3", now=20)
+    assert len(ledger) == 3 and ("s2",) in ledger
+    assert ledger.unseen(["run_1"]) == 2
+
+    # s1 shows up in the DagRun list, s2 never does
+    ledger.reconcile([("s1",)], now=30)
+    assert ledger.keys() == {("s2",), ("s3",)}
+    ledger.reconcile([], now=75)
+    assert ledger.keys() == {("s3",)}
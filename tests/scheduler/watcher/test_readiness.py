@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+
+from scheduler.helpers.compute import configure_compute, shutdown_compute
+from scheduler.watcher.readiness import ReadinessEngine, success_scene_keys
+from scheduler.watcher.restapi_watcher import RestAPIWatcher, find_ready_scenes
+
+
+def success_df(dag_id, scene_ids):
+    return pd.DataFrame({"batch_id": "b", "dag_id": dag_id, "scene_id": scene_ids, "state": "success"})
+
+
+def test_readiness_engine():
+    engine = ReadinessEngine(2)
+    assert engine.update(0, frozenset({("s1",), ("s2",)})) == (set(), set())
+    assert engine.update(1, frozenset({("s1",), ("s3",)})) == ({("s1",)}, set())
+    assert engine.ready == {("s1",)}
+
+    # s1 of sensor 0 is cleared, s2 of sensor 1 succeeds
+    assert engine.update(0, frozenset({("s2",)})) == (set(), {("s1",)})
+    assert engine.update(1, frozenset({("s1",), ("s2",), ("s3",)})) == ({("s2",)}, set())
+    assert engine.ready == {("s2",)}
+    assert engine.masks == {("s1",): 0b10, ("s2",): 0b11, ("s3",): 0b10}
+
+
+@pytest.fixture(params=["inline", "thread", "process"])
+def compute_executor(request):
+    # the success keys are rebuilt in the compute executor
+    configure_compute(request.param, max_workers=1)
+    yield request.param
+    shutdown_compute()
+
+
+@pytest.mark.asyncio
+async def test_incremental_readiness(compute_executor):
+    class Sensor:
+        def __init__(self, dag_id):
+            self.query_key_values = {"batch_id": "b", "dag_id": dag_id}
+
+    sensors = [Sensor("up_a"), Sensor("up_b")]
+    watcher = RestAPIWatcher("a", "b", None, sensors, dag_id="down", scene_id_keys=["scene_id"], incremental_readiness=True)
+    ticks = [
+        [success_df("up_a", ["s1", "s2"]), success_df("up_b", ["s1", "s3"])],
+        [success_df("up_a", ["s1", "s2", "s3"]), success_df("up_b", ["s1", "s3"])],
+        [success_df("up_a", ["s2", "s3"]), success_df("up_b", ["s1", "s3", None])],
+    ]
+    for success_df_list in ticks:
+        expected = find_ready_scenes(
+            pd.concat(success_df_list).dropna(), ["scene_id"], [s.query_key_values for s in sensors]
+        )
+        assert sorted(await watcher.update_readiness(success_df_list)) == [(s["scene_id"],) for s in expected]
+
+    # the same DataFrame is not read again
+    static = success_df("up_a", ["s1"])
+    engine = watcher.readiness
+    assert await engine.update_from_df(0, static, ["scene_id"], sensors[0].query_key_values) == ({("s1",)}, {("s3",)})
+    assert await engine.update_from_df(0, static, ["scene_id"], sensors[0].query_key_values) == (set(), set())
+
+    # a reload replacing the sensors rebuilds the engine
+    watcher.upstream_sensors = [sensors[1]]
+    assert await watcher.update_readiness([success_df("up_b", ["s9"])]) == {("s9",)}
+    assert success_scene_keys(success_df("up_b", ["s9"]), ["scene_id", "missing"], {}) == frozenset()
@@ -4,7 +4,7 @@ import numpy as np
 
 pd.set_option("display.max_columns", None)
 
-from scheduler.watcher.restapi_watcher import RestAPIWatcher
+from scheduler.watcher.restapi_watcher import RestAPIWatcher, find_ready_scenes
 from scheduler.upstream_sensor.dag_sensor import DagSensor, ExpandableDagSensor
 from scheduler.upstream_sensor.task_sensor import TaskSensor
 
@@ -187,3 +187,101 @@ async def test_scene_id_dtypes():
     assert watcher.convert_dtypes({"scene_id": "123.0"}) == {"scene_id": 123.0}
     watcher = RestAPIWatcher( "a", "a", None, [], dag_id="a", scene_id_keys=["scene_id", "split_id"], scene_id_dtypes=["str", "int"], )
     assert watcher.convert_dtypes({"scene_id": 123.0, "split_id": 4.0}) == {"scene_id": "123.0", "split_id": 4}
+
+
+def test_find_ready_scenes():
+    success_df = pd.DataFrame(
+        {
+            "batch_id": ["b"] * 4,
+            "dag_id": ["up_a", "up_a", "up_b", "up_b"],
+            "scene_id": ["s1", "s2", "s1", "s3"],
+            "state": ["success"] * 4,
+        }
+    )
+    query_key_values_list = [{"batch_id": "b", "dag_id": "up_a"}, {"batch_id": "b", "dag_id": "up_b"}]
+    assert find_ready_scenes(success_df, ["scene_id"], query_key_values_list) == [{"scene_id": "s1"}]
+
+
+@pytest.mark.asyncio
+async def test_paused_dag_trigger():
+    from scheduler.helpers import aiohttp_requests as ar
+    from scheduler.simulator import SIMULATED_API_URL, SimulatedAirflow, VirtualClock
+    from scheduler.watcher.batch import Batch
+    from scheduler.watcher.pool import CapacityPool
+    from scheduler.watcher.scheduling import fair_share
+
+    class PausedAirflow(SimulatedAirflow):
+        def dag(self, dag_id, data=None):
+            return 200, {"dag_id": dag_id, "is_paused": True}
+
+    cfg = {
+        "watchers": [
+            {
+                "dag_id": "paused",
+                "class": "scheduler.watcher.restapi_watcher.RestAPIWatcher",
+                "fixed_dag_run_conf": {},
+                "scene_id_keys": ["scene_id"],
+                "fair_share_weight": 1.0,
+                "upstream": [],
+            }
+        ]
+    }
+    watcher = Batch("paused_batch", cfg, SIMULATED_API_URL, {}).watchers[0]
+    watcher.pool = CapacityPool("gpu", 2)
+    airflow = PausedAirflow(VirtualClock())
+    ar.set_transport(airflow)
+    try:
+        await watcher.trigger({"scene_id": "s0"})
+    finally:
+        ar.set_transport(None)
+    # nothing was triggered, so no slot is taken and no fair-share credit is charged
+    assert airflow.num_posted == 0
+    assert watcher.pool.available == 2 and len(watcher.ledger) == 0
+    assert "paused_batch" not in fair_share.shares(watcher.fair_share_key)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("incremental_readiness", [False, True])
+async def test_ready_queue_pushes_changes(incremental_readiness):
+    from scheduler.helpers import aiohttp_requests as ar
+    from scheduler.simulator import SIMULATED_API_URL, SimulatedAirflow, VirtualClock
+
+    class Sensor:
+        query_key_values = {"batch_id": "b"}
+        upstream_dag_ids = set()
+
+        async def sense(self, state=None):
+            return self.df
+
+    def success_df(priorities):
+        return pd.DataFrame(
+            {"batch_id": "b", "scene_id": list(priorities), "priority": list(priorities.values()), "state": "success"}
+        )
+
+    sensor = Sensor()
+    watcher = RestAPIWatcher(
+        SIMULATED_API_URL, "b", {}, [sensor], dag_id="d", scene_id_keys=["scene_id"], max_running_dag_runs=0,
+        scheduling_policy={"name": "priority"}, incremental_readiness=incremental_readiness,
+    )
+    pushed = []
+    push = watcher.ready_queue.push
+    watcher.ready_queue.push = lambda skey, scene, sort_key=(): pushed.append(skey) or push(skey, scene, sort_key)
+    ar.set_transport(SimulatedAirflow(VirtualClock()))
+    try:
+        sensor.df = success_df({"s1": 1, "s2": 2, "s3": 3})
+        await watcher.watch()
+        assert sorted(pushed) == [("s1",), ("s2",), ("s3",)]
+        # the same scenes (in a new DataFrame) are left in the heap
+        sensor.df = success_df({"s1": 1, "s2": 2, "s3": 3})
+        await watcher.watch()
+        assert len(pushed) == 3
+        # only the new scene and the re-ranked one are pushed, the scene no longer ready is dropped
+        sensor.df = success_df({"s2": 5, "s3": 3, "s4": 4})
+        await watcher.watch()
+        assert sorted(pushed[3:]) == [("s2",), ("s4",)]
+    finally:
+        ar.set_transport(None)
+    queue = watcher.ready_queue
+    assert [queue.pop(), queue.pop(), queue.pop(), queue.pop()] == [
+        {"scene_id": "s2"}, {"scene_id": "s4"}, {"scene_id": "s3"}, None
+    ]
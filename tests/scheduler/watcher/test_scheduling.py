@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+from scheduler.watcher.scheduling import FairShare, ReadyQueue, compute_sort_keys, create_scheduling_policy
+
+
+def test_ready_queue():
+    queue = ReadyQueue()
+    scenes = {("s3",): {"scene_id": "s3"}, ("s1",): {"scene_id": "s1"}, ("s2",): {"scene_id": "s2"}}
+    queue.sync(scenes)
+    assert queue.peek() == {"scene_id": "s1"}
+
+    # s1 is gone (e.g. triggered by someone else), s2 is re-ranked to the end, s0 shows up
+    queue.sync({("s2",): {"scene_id": "s2"}, ("s3",): {"scene_id": "s3"}, ("s0",): {"scene_id": "s0"}}, {("s2",): (1,)})
+    assert len(queue) == 3
+    assert [queue.pop(), queue.pop(), queue.pop(), queue.pop()] == [
+        {"scene_id": "s0"}, {"scene_id": "s3"}, {"scene_id": "s2"}, None
+    ]
+
+
+def test_scheduling_policies():
+    success_df = pd.DataFrame(
+        {
+            "scene_id": ["s1", "s1", "s2", "s3"],
+            "end_date": ["2024-01-01T00:00:10+00:00", "2024-01-01T00:00:30+00:00", "2024-01-01T00:00:20+00:00", None],
+            "priority": [1, 5, "3", None],
+        }
+    )
+    keys = ["scene_id"]
+
+    fifo = create_scheduling_policy("fifo").sort_keys(success_df, keys)
+    assert sorted(fifo, key=fifo.get) == [("s2",), ("s1",), ("s3",)]
+
+    priority = create_scheduling_policy({"name": "priority", "default": 4}).sort_keys(success_df, keys)
+    assert sorted(priority, key=priority.get) == [("s1",), ("s3",), ("s2",)]
+
+    assert create_scheduling_policy(None).sort_keys(success_df, keys) == {}
+
+    # the policies are recreated from their name and params in the compute executor
+    for cfg in ["fifo", {"name": "priority", "default": 4}, {"name": "fifo", "column": "priority"}, None]:
+        policy = create_scheduling_policy(cfg)
+        assert create_scheduling_policy({"name": policy.name, **policy.params}) == policy
+        assert compute_sort_keys(policy.name, policy.params, success_df, keys) == policy.sort_keys(success_df, keys)
+    with pytest.raises(AssertionError):
+        create_scheduling_policy("random")
+
+
+def test_fair_share():
+    share = FairShare()
+    key = ("http://airflow", "downstream")
+    triggers = {"a": 0, "b": 0}
+    for tick in range(30):
+        for batch_id, weight in [("a", 2.0), ("b", 1.0)]:
+            share.report(key, batch_id, True, weight, now=tick)
+            if share.may_trigger(key, batch_id, now=tick):
+                share.record_trigger(key, batch_id, weight)
+                triggers[batch_id] += 1
+    assert triggers["a"] == pytest.approx(2 * triggers["b"], abs=2)
+
+    # alone, a batch gets all the capacity
+    share.report(key, "b", False, now=30)
+    for now in range(30, 35):
+        share.report(key, "a", True, 2.0, now=now)
+        assert share.may_trigger(key, "a", now=now)
+        share.record_trigger(key, "a", 2.0)
+